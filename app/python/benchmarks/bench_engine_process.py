@@ -0,0 +1,89 @@
+"""Onset timing with the experiment engine in the GUI process vs in its own process.
+
+Plays n stimuli on a 10 ms grid into a VirtualBsense (pty), with the engine
+either as a thread of this process (like BsenseGUI does by default) or in
+an ExperimentProcess whose scheduler and writer threads are pinned to the
+last CPU (when there are several), with and without SCHED_FIFO.
+Each is run idle and with a "GUI load" thread that keeps this process's
+GIL busy with pure-Python work, like repopulating a large treeview.
+Reports the scheduler's onset lateness and inter-onset interval error
+(core.timing). With the engine in its own process, the numbers should not
+change with the load.
+
+Run from app/python:
+    python benchmarks/bench_engine_process.py [n_stimuli]
+"""
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.experiment import Experiment
+from core.engine_process import ExperimentProcess, default_placement
+from core.virtual_device import VirtualBsense
+
+
+def plan(n_stimuli):
+    return {"Type": "Sequence", "Repeat": n_stimuli, "Content": [
+        {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+        {"Type": "Delay", "Duration": 0.01}]}
+
+
+def gui_load(stop):
+    """Pure-Python work holding the GIL, like rebuilding a treeview of a long plan."""
+    while not stop.is_set():
+        rows = [(str(i), f"Vib1 {i * 0.01:.2f}") for i in range(20000)]
+        rows.sort(key=lambda row: row[1])
+
+
+def run(engine, n_stimuli, load):
+    device = VirtualBsense()
+    device.start()
+    cpu, priority = default_placement()
+    if engine == "thread":
+        exp = Experiment(async_writes=True)
+    else:
+        exp = ExperimentProcess(cpu, priority if engine == "fifo" else None, async_writes=True)
+    done = threading.Event()
+    exp.log_cb = lambda text: done.set() if text == "End of experiment" else None
+    stop = threading.Event()
+    loader = threading.Thread(target=gui_load, args=(stop,), daemon=True)
+    try:
+        exp.connect_arduino(device.port)
+        exp.from_dict(plan(n_stimuli))
+        if load:
+            loader.start()
+        exp.start()
+        done.wait()
+        stats = exp.timing.stats() if engine == "thread" else exp.timing_stats()
+        policy = "-" if engine == "thread" else exp.engine_info["policy"]
+    finally:
+        stop.set()
+        if load:
+            loader.join()
+        exp.close()
+        device.stop()
+    return stats, policy
+
+
+def main():
+    n_stimuli = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    cpu, priority = default_placement()
+    print(f"{n_stimuli} stimuli every 10 ms; engine process timing threads on cpu {cpu}, "
+          f"fifo: SCHED_FIFO {priority} where allowed")
+    print(f"{'engine':<8} {'policy':<8} {'GUI load':<9} {'late p50':>9} {'late p99':>9} {'late max':>9} "
+          f"{'ioi p99':>9}")
+    # thread: in this process; process: own process, normal policy; fifo: own process, SCHED_FIFO
+    for engine in ("thread", "process", "fifo"):
+        for load in (False, True):
+            s, policy = run(engine, n_stimuli, load)
+            late, ioi = s["lateness_ms"], s["interval_error_ms"]
+            print(f"{'thread' if engine == 'thread' else 'process':<8} {policy:<8} {'yes' if load else 'no':<9} "
+                  f"{late['p50']:>7.3f}ms {late['p99']:>7.3f}ms {late['max']:>7.3f}ms {ioi['p99']:>7.3f}ms")
+
+
+if __name__ == '__main__':
+    main()
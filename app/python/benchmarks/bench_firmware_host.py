@@ -0,0 +1,73 @@
+"""Firmware cost on the host harness: frame parsing and timer handlers.
+
+Runs teensyScript.ino compiled for Linux (core.firmware_host) and sends
+each frame kind n times, one per simulated millisecond. Reports the host
+CPU time of the loop() passes that read a frame (parse + apply), of an idle
+loop() pass and of a timer handler call. Absolute numbers are for this
+host's CPU, not the Teensy's; compare them between firmware changes.
+Frames answered with a reply ('q', 'p') also pay for the harness writing
+the reply to its pipe.
+
+Run from app/python:
+    python benchmarks/bench_firmware_host.py [n_frames]
+"""
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.firmware_host import FirmwareHost
+from core.protocol import (encode_signal, encode_trigger, encode_table_entry, encode_sequenced,
+                           encode_scheduled, encode_multi, encode_ping)
+
+VIB = encode_signal(('v', 0.5, 170, 100))
+BUZZ = encode_signal(('b', 0.5, 1000, 30))
+FRAMES = {
+    "v": lambda i, t_us: VIB,
+    "c": lambda i, t_us: encode_signal(('c', 0.5, 170, 100, 0.3, 1000, 30)),
+    "x (trigger)": lambda i, t_us: encode_trigger(0),
+    "q (sequenced v)": lambda i, t_us: encode_sequenced(i, VIB),
+    "s (scheduled v)": lambda i, t_us: encode_scheduled(i, t_us + 500, VIB),
+    "m (v + b)": lambda i, t_us: encode_multi([VIB, BUZZ]),
+    "p (ping)": lambda i, t_us: encode_ping(i),
+}
+
+
+def bench(name, make_frame, n_frames):
+    with FirmwareHost() as fw:
+        fw.send(encode_table_entry(0, VIB))
+        fw.run(1000)
+        busy = []
+        totals = [0, 0, 0, 0]  # loops, loop_ns, isr_calls, isr_ns
+        for i in range(n_frames):
+            fw.send(make_frame(i, fw.now_us))
+            stats = fw.run(1000)
+            if stats.busy_loops:
+                busy.append(stats.busy_ns / stats.busy_loops)
+            totals[0] += stats.loops - stats.busy_loops
+            totals[1] += stats.loop_ns - stats.busy_ns
+            totals[2] += stats.isr_calls
+            totals[3] += stats.isr_ns
+    busy.sort()
+    return {
+        "name": name,
+        "parse_p50_ns": busy[len(busy) // 2],
+        "parse_p99_ns": busy[min(len(busy) - 1, int(len(busy) * 0.99))],
+        "idle_loop_ns": totals[1] / totals[0],
+        "isr_ns": totals[3] / totals[2],
+    }
+
+
+def main():
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    print(f"{n_frames} frames per kind, host CPU time per call")
+    print(f"{'frame':<18} {'parse p50':>10} {'parse p99':>10} {'idle loop':>10} {'timer ISR':>10}")
+    for name, make_frame in FRAMES.items():
+        r = bench(name, make_frame, n_frames)
+        print(f"{r['name']:<18} {r['parse_p50_ns']:>8.0f}ns {r['parse_p99_ns']:>8.0f}ns "
+              f"{r['idle_loop_ns']:>8.1f}ns {r['isr_ns']:>8.1f}ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Experiment scheduler overhead: per-event cost against plan length, and start latency.
+
+Plays plans of zero-length delays without a device, so the time measured
+is the scheduler itself (main loop, callbacks, delay wait). The per-event
+cost should not grow with the plan length. Start latency is the time from
+start() to the first event_cb, with the main loop idle.
+
+Run from app/python:
+    python benchmarks/bench_scheduler.py [max_events]
+"""
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.experiment import Experiment
+
+
+def plan(n_events):
+    return {"Type": "Sequence", "Repeat": n_events, "Content": [{"Type": "Delay", "Duration": 0}]}
+
+
+def per_event_us(n_events):
+    exp = Experiment()
+    try:
+        exp.from_dict(plan(n_events))
+        done = threading.Event()
+        exp.add_cb_log(lambda message: message == "End of experiment" and done.set())
+        t0 = time.perf_counter()
+        exp.start()
+        done.wait()
+        return (time.perf_counter() - t0) / n_events * 1e6
+    finally:
+        exp.close()
+
+
+def start_latency_us(repeats=50):
+    exp = Experiment()
+    try:
+        exp.from_dict(plan(1))
+        started = threading.Event()
+        t_event = []
+        exp.add_cb_event(lambda idx: (t_event.append(time.perf_counter()), started.set()))
+        latencies = []
+        for _ in range(repeats):
+            time.sleep(0.01)  # main loop idle
+            started.clear()
+            t0 = time.perf_counter()
+            exp.start()
+            started.wait()
+            latencies.append((t_event[-1] - t0) * 1e6)
+            exp.stop()
+        latencies.sort()
+        return latencies[len(latencies) // 2], latencies[-1]
+    finally:
+        exp.close()
+
+
+def main():
+    max_events = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    n = 1000
+    print(f"{'events':>8} {'per event':>10}")
+    while n <= max_events:
+        print(f"{n:>8} {per_event_us(n):>8.2f}us")
+        n *= 10
+    p50, worst = start_latency_us()
+    print(f"start latency: p50 {p50:.0f}us, max {worst:.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""Microbenchmark: per-event host overhead of the stimulus send path.
+
+Compares encoding the frame on every send (ArduinoCom.send_signal) with
+writing a frame prebuilt at experiment load (ArduinoCom.send_frame), for
+'v', 'b' and 'c' frames. The serial port is replaced by a sink that only
+counts bytes, so the numbers are host overhead only.
+
+Run from app/python:
+    python benchmarks/bench_send_path.py [iterations]
+"""
+import sys
+import os
+import timeit
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.arduino_communication import ArduinoCom
+from core.protocol import encode_signal
+
+
+class NullPort:
+    """Stands in for serial.Serial: accepts writes and discards them."""
+    is_open = True
+
+    def __init__(self):
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+SIGNALS = {
+    'v': ('v', 0.5, 170, 100),
+    'b': ('b', 0.5, 1000, 30),
+    'c': ('c', 0.5, 170, 100, 0.3, 1000, 30),
+}
+
+
+def bench(iterations=200000):
+    com = ArduinoCom()
+    com.arduino = NullPort()
+    results = {}
+    for source, signal in SIGNALS.items():
+        frame = encode_signal(signal)
+        t_encode = min(timeit.repeat(lambda: com.send_signal(signal), number=iterations, repeat=5))
+        t_frame = min(timeit.repeat(lambda: com.send_frame(frame), number=iterations, repeat=5))
+        results[source] = (t_encode / iterations * 1e9, t_frame / iterations * 1e9)
+    return results
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    print(f"{'frame':<6}{'send_signal (ns)':>18}{'send_frame (ns)':>18}{'saved':>10}")
+    for source, (t_encode, t_frame) in bench(n).items():
+        print(f"{source!r:<6}{t_encode:>18.0f}{t_frame:>18.0f}{1 - t_frame / t_encode:>10.0%}")
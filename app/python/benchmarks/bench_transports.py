@@ -0,0 +1,60 @@
+"""Framing and link overhead per transport, against the virtual device.
+
+For each transport (in-process loopback, TCP and UDP on localhost, pty)
+measures one-way frame throughput and the round trip of acknowledged
+frames. The loopback numbers are the cost of the host code and the
+emulator alone; the difference to the other transports is the link.
+
+Run from app/python:
+    python benchmarks/bench_transports.py [n_frames]
+"""
+import sys
+import os
+import statistics
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.arduino_communication import ArduinoCom
+from core.protocol import encode_signal
+from core.virtual_device import VirtualBsense
+
+
+def throughput(arduino, device, frame, n_frames):
+    del device.commands[:]
+    t0 = time.perf_counter_ns()
+    for _ in range(n_frames):
+        arduino.send_frame(frame)
+    while len(device.commands) < n_frames and time.perf_counter_ns() - t0 < 10e9:
+        time.sleep(0.001)
+    elapsed = (device.commands[-1].recv_ns - t0) / 1e9
+    return len(device.commands) / elapsed
+
+
+def ack_rtt(arduino, frame, n_frames):
+    arduino.enable_acks(timeout=1.0)
+    rtts = []
+    for _ in range(n_frames):
+        start = time.perf_counter_ns()
+        handle = arduino.submit(frame)
+        if handle.wait_ack(1.0):
+            rtts.append((handle.ack_ns - start) / 1e3)
+    arduino.disable_acks()
+    return rtts
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    frame = encode_signal(('v', 0.5, 170, 10))
+    transports = ["loop", "tcp", "udp"] + (["pty"] if hasattr(os, "openpty") else [])
+    print(f"{'transport':<10}{'frames/s':>12}{'rtt p50 us':>12}{'rtt p99 us':>12}")
+    for transport in transports:
+        with VirtualBsense(transport) as device:
+            arduino = ArduinoCom()
+            arduino.connect(device.port, retries=1)
+            rate = throughput(arduino, device, frame, n)
+            rtts = sorted(ack_rtt(arduino, frame, min(n, 500)))
+            arduino.close()
+        print(f"{transport:<10}{rate:>12.0f}{statistics.median(rtts):>12.1f}"
+              f"{rtts[int(len(rtts) * 0.99) - 1]:>12.1f}")
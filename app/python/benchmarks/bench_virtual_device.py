@@ -0,0 +1,71 @@
+"""End-to-end scheduling benchmark against the virtual (pty) device.
+
+Runs an Experiment made of N stimuli separated by a fixed Delay, with the
+emulator standing in for the Teensy, and reports how far the delivered
+inter-onset intervals are from the planned ones. Also measures raw frame
+throughput through the pty.
+
+Run from app/python (Linux/macOS):
+    python benchmarks/bench_virtual_device.py [n_events] [delay_s]
+"""
+import sys
+import os
+import statistics
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.experiment import Experiment
+from core.protocol import encode_signal
+from core.virtual_device import VirtualBsense
+
+
+def scheduling(device, n_events, delay_s):
+    exp = Experiment()
+    done = []
+    exp.log_cb = lambda text: done.append(True) if text == "End of experiment" else None
+    exp.connect_arduino(device.port)
+    exp.from_dict({
+        "Type": "Sequence",
+        "Repeat": n_events,
+        "Content": [
+            {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 10}]},
+            {"Type": "Delay", "Duration": delay_s},
+        ],
+    })
+    del device.commands[:]
+    exp.start()
+    while not done:
+        time.sleep(0.01)
+    time.sleep(0.05)  # let the emulator drain the last frame
+    exp.close()
+    onsets = [c.recv_ns for c in device.commands]
+    return [(b - a) / 1e6 - delay_s * 1e3 for a, b in zip(onsets, onsets[1:])]
+
+
+def throughput(device, n_frames):
+    import serial
+    port = serial.Serial(device.port, 115200)
+    frame = encode_signal(('v', 0.5, 170, 10))
+    del device.commands[:]
+    t0 = time.perf_counter_ns()
+    for _ in range(n_frames):
+        port.write(frame)
+    while len(device.commands) < n_frames and time.perf_counter_ns() - t0 < 10e9:
+        time.sleep(0.001)
+    elapsed = (device.commands[-1].recv_ns - t0) / 1e9
+    port.close()
+    return len(device.commands) / elapsed
+
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    delay = float(sys.argv[2]) if len(sys.argv) > 2 else 0.01
+    with VirtualBsense() as device:
+        errors = scheduling(device, n, delay)
+        print(f"inter-onset error over {len(errors)} intervals (planned {delay * 1e3:.1f} ms):")
+        print(f"  mean {statistics.mean(errors):+.3f} ms  stdev {statistics.pstdev(errors):.3f} ms"
+              f"  max {max(errors):+.3f} ms")
+        print(f"  drift over session {sum(errors):+.1f} ms")
+        print(f"throughput: {throughput(device, 2000):.0f} frames/s")
@@ -1,46 +1,490 @@
 import serial
+import serial.tools.list_ports
 import time
+import queue
+import collections
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from core.protocol import (encode_frame, encode_signal, encode_sequenced, decode_ack, encode_ping, decode_pong,
+                           encode_identify, decode_ready, encode_table_entry, encode_scheduled, encode_flush,
+                           encode_counters_request, decode_counters, frame_to_hex, FrameParser, ACK, PONG, READY,
+                           FLUSHED, COUNTERS, SEQ_MODULO, TABLE_SIZE, TABLE_PROTOCOL, SCHEDULE_PROTOCOL,
+                           MULTI_PROTOCOL, COUNTERS_PROTOCOL)
+from core.clock_sync import ClockSync, perf_to_wall
+from core.hotplug import HotplugMonitor
+from core.telemetry import LinkTelemetry, dump_json
+from core.transport import open_transport
+from core.wire_trace import TraceWriter, TX, RX
 
 logger = logging.getLogger(__name__)
 
+READ_TIMEOUT = 0.02  # seconds; how often the reader thread wakes up when the port is quiet
+
+# Identity reported by the firmware's ready banner
+DeviceInfo = collections.namedtuple("DeviceInfo", "port protocol firmware serial_number")
+
+# USB vendor ids of the boards the firmware runs on: PJRC (Teensy) and Arduino.
+# discover_devices() only writes to these ports, not to other USB-serial equipment.
+BSENSE_USB_VIDS = (0x16C0, 0x2341, 0x2A03)
+
+
+def wait_until(deadline_ns, spin_ns=1_000_000):
+    """Sleep until shortly before a perf_counter_ns() deadline, then spin to it."""
+    remaining = deadline_ns - time.perf_counter_ns()
+    if remaining > spin_ns:
+        time.sleep((remaining - spin_ns) / 1e9)
+    while time.perf_counter_ns() < deadline_ns:
+        pass
+
+
+def probe_port(path, timeout=0.3, serial_number=None):
+    """Open path, ask for the ready banner and close it again.
+
+    Returns a DeviceInfo if a Bsense device answered, None otherwise
+    (port busy, not a Bsense, or firmware without the handshake).
+    """
+    try:
+        port = open_transport(path, READ_TIMEOUT)
+    except (serial.SerialException, OSError, ValueError):
+        return None
+    try:
+        info = ArduinoCom.handshake(port, timeout)
+    except (serial.SerialException, OSError):
+        info = None
+    finally:
+        port.close()
+    if info is not None:
+        info = info._replace(serial_number=serial_number)
+    return info
+
+
+def discover_devices(timeout=0.3, ports=None, serial_numbers=None):
+    """Find connected Bsense devices by probing serial ports concurrently.
+
+    Probing writes an identify frame, so by default only the ports of a
+    Teensy or Arduino (USB vendor id in BSENSE_USB_VIDS) are opened.
+
+    Args:
+        timeout: Max wait for each port's ready banner in seconds
+        ports: Port paths to probe, as given (default: the Teensy / Arduino ports
+            from serial.tools.list_ports)
+        serial_numbers: If given, probe only the ports with one of these USB serial
+            numbers, whatever their vendor id
+
+    Returns:
+        List of DeviceInfo (port, protocol, firmware, serial_number), in port order
+    """
+    listed = serial.tools.list_ports.comports()
+    port_serials = {p.device: p.serial_number for p in listed}
+    if ports is None:
+        if serial_numbers is not None:
+            ports = sorted(p.device for p in listed if p.serial_number in serial_numbers)
+        else:
+            ports = sorted(p.device for p in listed if p.vid in BSENSE_USB_VIDS)
+        skipped = len(listed) - len(ports)
+        if skipped:
+            logger.debug(f"Not probing {skipped} serial port(s) of other USB devices")
+    if not ports:
+        return []
+    with ThreadPoolExecutor(max_workers=len(ports)) as pool:
+        results = pool.map(lambda path: probe_port(path, timeout, port_serials.get(path)), ports)
+        return [info for info in results if info is not None]
+
+
+class WriteHandle:
+    """Tracks one frame submitted for writing.
+
+    enqueue_ns and complete_ns are time.perf_counter_ns() values taken when
+    the frame was submitted and when the write call returned (or failed).
+    With acknowledgements enabled, seq is the frame's sequence number and
+    ack_ns / device_us are filled in when the firmware confirms the onset;
+    onset_ns is that onset in host perf_counter_ns() once the clock is synced.
+    not_before_ns holds the write back until that perf_counter_ns() deadline.
+    """
+    __slots__ = ("frame", "enqueue_ns", "complete_ns", "error", "_done", "not_before_ns",
+                 "seq", "attempts", "ack_ns", "device_us", "onset_ns", "lost", "_acked")
+
+    def __init__(self, frame, seq=None, not_before_ns=None):
+        self.frame = frame
+        self.not_before_ns = not_before_ns
+        self.enqueue_ns = time.perf_counter_ns()
+        self.complete_ns = None
+        self.error = None
+        self._done = threading.Event()
+        self.seq = seq
+        self.attempts = 0
+        self.ack_ns = None
+        self.device_us = None
+        self.onset_ns = None
+        self.lost = False
+        self._acked = threading.Event()
+
+    def _complete(self, error=None):
+        self.error = error
+        self.attempts += 1
+        self.complete_ns = time.perf_counter_ns()
+        self._done.set()
+
+    def _acknowledge(self, ack_ns, device_us):
+        self.ack_ns = ack_ns
+        self.device_us = device_us
+        self._acked.set()
+
+    def _give_up(self):
+        self.lost = True
+        self._acked.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        """Block until the frame has been written. Returns False on timeout."""
+        return self._done.wait(timeout)
+
+    def wait_ack(self, timeout=None):
+        """Block until the frame is acknowledged or given up on.
+
+        Returns True only if an acknowledgement was received.
+        """
+        self._acked.wait(timeout)
+        return self.ack_ns is not None
+
+    @property
+    def latency_ns(self):
+        """Time between submission and write completion, or None if pending."""
+        if self.complete_ns is None:
+            return None
+        return self.complete_ns - self.enqueue_ns
+
+    @property
+    def rtt_ns(self):
+        """Time between the last write completing and its ack, or None."""
+        if self.ack_ns is None or self.complete_ns is None:
+            return None
+        return self.ack_ns - self.complete_ns
+
+
 class ArduinoCom:
     def __init__(self):
         # Arduino communication setup
         self.arduino = None
-        pass
+        self.path = None
+        self.device_info = None  # DeviceInfo from the ready banner, None for legacy firmware
+        self.disconnect_cb = None  # called with the exception when the connection is lost
+        self._monitor = None  # HotplugMonitor for the open device node
+        self._conn_lock = threading.Lock()
+        self._write_queue = None
+        self._writer_thread = None
+        self._writer_stop = threading.Event()  # set when stop_writer() gives up on the queued frames
+        self.rejected_writes = 0  # submissions refused because the writer queue was full
+        self.telemetry = LinkTelemetry()  # write counts, rates and timings (see stats())
+        self.trace = None  # TraceWriter recording every frame, see start_trace()
+        # Stimulus table (uploaded once, then stimuli are sent as trigger frames)
+        self.stimulus_table = []
+        self.table_loaded = False  # True while the connected device holds stimulus_table
+        # Acknowledgements (sequenced frames)
+        self.ack_cb = None  # called with the WriteHandle when a frame is acked or lost
+        self.ack_timeout = 0.25  # seconds before a frame counts as unacknowledged
+        self.max_retransmits = 0
+        self.acked_frames = 0
+        self.lost_frames = 0
+        self.retransmits = 0
+        self._acks_enabled = False
+        self._next_seq = 0
+        self._pending = {}  # seq -> WriteHandle awaiting ack
+        self._pending_lock = threading.Lock()
+        # Device-side scheduling: seq -> WriteHandle acknowledged when the device fires it
+        self._scheduled = {}
+        self._flushed = threading.Event()
+        # Firmware frame parser counters, see request_device_counters()
+        self.device_counters = None
+        self._counters_received = threading.Event()
+        # Clock synchronisation (ping/pong)
+        self.clock = ClockSync()
+        self._pings = {}  # token -> perf_counter_ns() when the ping was written
+        self._next_ping = 0
+        self._sync_thread = None
+        self._sync_stop = threading.Event()
+        self._sync_restart = threading.Event()  # set by connect(): ping in a burst again
+
+        self.reconnect_cb = None  # called with the outage in ns after a reconnect, None on giving up
+        self.reconnect_interval = 0.5
+        self.reconnect_timeout = None
+        self.reconnects = 0
+        self._reconnect_enabled = False
+        self._reconnect_thread = None
+        self._reconnect_stop = threading.Event()
+        # Reader thread
+        self._frame_handlers = {ACK: self.__on_ack, PONG: self.__on_pong, FLUSHED: self.__on_flushed,
+                                COUNTERS: self.__on_counters}
+        self._write_lock = threading.Lock()  # writer, reader (retransmits) and sync threads share the port
+        self._reader_thread = None
+        self._reader_active = False
 
-    def connect(self, path, retries=3, retry_delay=1.0):
-        """Connect to Arduino with retry logic.
+    def connect(self, path, retries=3, retry_delay=0.25, handshake_timeout=2.0):
+        """Connect to Arduino with retry logic and wait until it is ready.
+
+        Instead of sleeping for a fixed time, the port is polled for the
+        firmware's ready banner (sent at boot, on port open and in reply to one
+        identify frame), so connect returns as soon as the device has booted.
+        Firmware without the banner is assumed ready after handshake_timeout;
+        it takes the identify frame for a trigger command and emits one pulse
+        on the trigger output while connecting.
 
         Args:
-            path: Serial port path (e.g., COM3, /dev/ttyUSB0)
+            path: Serial port path (e.g., COM3, /dev/ttyUSB0), or a tcp://, udp://
+                or loop:// URL (see core.transport)
             retries: Number of connection attempts (default: 3)
-            retry_delay: Delay between retries in seconds (default: 1.0)
+            retry_delay: Delay between retries in seconds (default: 0.25)
+            handshake_timeout: Max wait for the ready banner in seconds (default: 2.0)
         """
+        if threading.current_thread() is not self._reconnect_thread:
+            self.__cancel_reconnect()  # an explicit connect replaces any reconnect in progress
         # Close existing connection if any
         self.disconnect()
         self.path = path
+        self.device_info = None
+        self.table_loaded = False
+        self.clock.reset()  # the device may have rebooted: its micros() restarted
+        self._pings.clear()
+        self._sync_restart.set()
         last_error = None
 
         for attempt in range(retries):
+            port = None
             try:
-                self.arduino = serial.Serial(path, 115200, timeout=1)
-                time.sleep(2)  # Wait for Arduino to reset
+                port = open_transport(path, READ_TIMEOUT)
+                self.device_info = self.handshake(port, handshake_timeout, self.trace)
+                if self.device_info is None:
+                    logger.warning(f"No ready banner from {path} after {handshake_timeout}s, assuming legacy firmware")
+                else:
+                    logger.info(f"Device ready on {path}: firmware {self.device_info.firmware}, "
+                                f"protocol {self.device_info.protocol}")
+                self.arduino = port
+                self.__watch(path, port)
+                self.start_reader()  # also detects unplugging through read errors
+                self.__upload_table()  # the device table does not survive a reset
+                self.__clear_schedule()
                 return  # Success
             except serial.SerialException as e:
                 last_error = f"Arduino not found at {path}: {e}"
             except OSError as e:
                 last_error = f"Cannot open port {path}: {e}"
+            if port is not None:
+                # handshake or setup failed: do not keep the port open across retries
+                if port is self.arduino:
+                    self.disconnect()
+                else:
+                    try:
+                        port.close()
+                    except Exception:
+                        pass
 
-            # Wait before retry (with exponential backoff)
+            # Wait before retry (linear backoff)
             if attempt < retries - 1:
                 time.sleep(retry_delay * (attempt + 1))
 
         raise Exception(last_error)
 
+    @staticmethod
+    def handshake(port, timeout, trace=None):
+        """Wait for the ready banner on an open port.
+
+        Returns a DeviceInfo, or None if nothing answered within timeout
+        (firmware predating the handshake). Frames are recorded to trace
+        (a TraceWriter) if given.
+
+        A single identify frame is sent: a device still booting announces
+        itself when setup() ends, and firmware without the handshake reads
+        the frame as a trigger command, so every repeat would be a spurious
+        pulse on the trigger output.
+        """
+        parser = FrameParser()
+        deadline = time.perf_counter() + timeout
+        frame = encode_identify()
+        if trace is not None:
+            trace.record(TX, time.perf_counter_ns(), frame)
+        port.write(frame)
+        while True:
+            if time.perf_counter() >= deadline:
+                return None
+            data = port.read(1)
+            if data and port.in_waiting:
+                data += port.read(port.in_waiting)
+            for source, payload in parser.feed(data):
+                if trace is not None:
+                    trace.record(RX, time.perf_counter_ns(), encode_frame(source, payload))
+                if source == READY:
+                    protocol, firmware = decode_ready(payload)
+                    return DeviceInfo(port.port, protocol, firmware, None)
+
+    def __watch(self, path, port):
+        # Report removal of the device node the moment it happens
+        if "://" in path:
+            return  # network and loopback transports report a lost peer through reads
+        monitor = HotplugMonitor(path, lambda p: self.__connection_lost(
+            port, serial.SerialException(f"Device {p} removed")))
+        if monitor.start():
+            self._monitor = monitor
+
+    def __clear_schedule(self):
+        # Commands scheduled before a reconnect must not fire late: the device
+        # drops its queue and the handles are given up (see flush_schedule())
+        if self.device_info is None or self.device_info.protocol < SCHEDULE_PROTOCOL:
+            return
+        self.send_frame(encode_flush())
+        with self._pending_lock:
+            stale = list(self._scheduled.values())
+            self._scheduled.clear()
+        for handle in stale:
+            handle._give_up()
+
+    def __connection_lost(self, port, error):
+        """Drop a port that failed or vanished and notify disconnect_cb once."""
+        lost_ns = time.perf_counter_ns()
+        with self._conn_lock:
+            if port is None or self.arduino is not port:
+                return  # already handled, or an old port
+            self.arduino = None
+            monitor, self._monitor = self._monitor, None
+        if monitor is not None:
+            monitor.stop()
+        try:
+            port.close()
+        except Exception:
+            pass
+        logger.error(f"[DISCONNECTED] {self.path}: {error}")
+        if self.disconnect_cb is not None:
+            self.disconnect_cb(error)
+        if self._reconnect_enabled:
+            self.__start_reconnect(lost_ns)
+
+    def enable_reconnect(self, interval=0.5, timeout=None):
+        """Re-open the port in the background whenever the connection is lost.
+
+        Every interval seconds connect() is tried again on the same path (the
+        handshake, table upload and clock resync are redone). On success
+        reconnect_cb is called with the outage duration in ns, measured from
+        the moment the loss was detected. After timeout seconds (None: never)
+        it gives up and reconnect_cb is called with None. disconnect_cb is
+        still called when the connection is lost.
+        """
+        self.reconnect_interval = interval
+        self.reconnect_timeout = timeout
+        self._reconnect_enabled = True
+
+    def disable_reconnect(self):
+        self._reconnect_enabled = False
+        self.__cancel_reconnect()
+
+    @property
+    def reconnecting(self):
+        return self._reconnect_thread is not None
+
+    def __start_reconnect(self, lost_ns):
+        with self._conn_lock:
+            if self._reconnect_thread is not None:
+                return
+            self._reconnect_stop.clear()
+            self._reconnect_thread = threading.Thread(target=self.__reconnect_loop, args=(self.path, lost_ns),
+                                                      daemon=True)
+            self._reconnect_thread.start()
+
+    def __cancel_reconnect(self):
+        thread = self._reconnect_thread
+        if thread is None:
+            return
+        self._reconnect_stop.set()
+        if thread is not threading.current_thread():
+            thread.join(timeout=5.0)
+        self._reconnect_thread = None
+
+    def __reconnect_loop(self, path, lost_ns):
+        attempts = 0
+        while not self._reconnect_stop.wait(self.reconnect_interval):
+            attempts += 1
+            try:
+                self.connect(path, retries=1)
+            except Exception as e:
+                waited = (time.perf_counter_ns() - lost_ns) / 1e9
+                logger.debug(f"[RECONNECT] attempt {attempts} on {path} failed: {e}")
+                if self.reconnect_timeout is not None and waited >= self.reconnect_timeout:
+                    logger.error(f"[RECONNECT] giving up on {path} after {waited:.1f} s")
+                    self._reconnect_thread = None
+                    if self.reconnect_cb is not None:
+                        self.reconnect_cb(None)
+                    return
+                continue
+            if self._reconnect_stop.is_set():
+                return  # cancelled while connecting: close() or an explicit connect() takes over
+            outage_ns = time.perf_counter_ns() - lost_ns
+            self.reconnects += 1
+            self._reconnect_thread = None
+            logger.warning(f"[RECONNECTED] {path} after an outage of {outage_ns / 1e6:.1f} ms "
+                           f"({attempts} attempt(s))")
+            if self.reconnect_cb is not None:
+                self.reconnect_cb(outage_ns)
+            return
+
+    def close(self):
+        """Stop all background threads and close the connection."""
+        self.__cancel_reconnect()
+        if self.is_connected() and self._reader_active and self.counters_supported:
+            counters = self.request_device_counters(timeout=0.2)
+            if counters and (counters["malformed"] or counters["dropped"] or counters["skipped_bytes"]):
+                logger.info(f"Device {self.path} parser: {counters}")
+        self.stop_clock_sync()
+        self.stop_writer()
+        self.stop_reader()
+        self.disconnect()
+        self.stop_trace()
+        if self.telemetry.frames_written or self.telemetry.write_errors:
+            logger.info(f"Link {self.path}: {self.telemetry.summary()}")
+
+    def start_trace(self, path):
+        """Record every frame sent and received to a binary trace file (see core.wire_trace).
+
+        The trace survives reconnects and is closed by stop_trace() or close().
+        """
+        self.stop_trace()
+        self.trace = TraceWriter(path)
+
+    def stop_trace(self):
+        trace, self.trace = self.trace, None
+        if trace is not None:
+            trace.close()
+            logger.info(f"Trace {trace.path}: {trace.records} frames")
+
+    def stats(self):
+        """Write-path telemetry plus the ack/retry counters, as a dict.
+
+        Times are in ns. See core.telemetry for the fields; dump_stats()
+        writes the same dict as JSON.
+        """
+        stats = self.telemetry.snapshot()
+        stats.update({
+            "port": self.path,
+            "rejected_writes": self.rejected_writes,
+            "retransmits": self.retransmits,
+            "acked_frames": self.acked_frames,
+            "lost_frames": self.lost_frames,
+            "pending_acks": self.pending_acks,
+            "reconnects": self.reconnects,
+            "device_counters": self.device_counters,
+        })
+        return stats
+
+    def dump_stats(self, path):
+        """Write stats() to path as JSON (e.g. at the end of a session)."""
+        dump_json(self.stats(), path)
+
     def disconnect(self):
         """Close the serial connection if open."""
+        with self._conn_lock:
+            monitor, self._monitor = self._monitor, None
+        if monitor is not None:
+            monitor.stop()
         if self.arduino is not None:
             try:
                 self.arduino.close()
@@ -67,6 +511,505 @@ class ArduinoCom:
             self.arduino = None  # Clean up stale reference
             raise serial.SerialException("Arduino disconnected")
 
+    @property
+    def table_supported(self):
+        """True if the connected firmware has the stimulus table."""
+        return self.device_info is not None and self.device_info.protocol >= TABLE_PROTOCOL
+
+    @property
+    def multi_supported(self):
+        """True if the connected firmware starts MULTI frames (several channels at one onset)."""
+        return self.device_info is not None and self.device_info.protocol >= MULTI_PROTOCOL
+
+    @property
+    def counters_supported(self):
+        """True if the connected firmware reports its frame parser counters."""
+        return self.device_info is not None and self.device_info.protocol >= COUNTERS_PROTOCOL
+
+    def request_device_counters(self, timeout=0.5):
+        """Ask the firmware for its frame parser counters.
+
+        Returns a dict with the frames parsed, malformed (rejected) and
+        dropped (incomplete or overflowing) frames, and bytes skipped while
+        resynchronising, all counted since the device booted. Returns None if
+        the firmware does not keep them or does not answer within timeout.
+        The last answer is kept in device_counters and reported by stats().
+        """
+        if not self.counters_supported:
+            return None
+        self._counters_received.clear()
+        try:
+            self.__enqueue(WriteHandle(encode_counters_request()), block=True)
+        except (serial.SerialException, OSError, queue.Full) as e:
+            logger.warning(f"Parser counters request failed: {e}")
+            return None
+        if not self._counters_received.wait(timeout):
+            logger.warning(f"No parser counters from {self.path} after {timeout}s")
+            return None
+        return self.device_counters
+
+    def __on_counters(self, payload, recv_ns):
+        try:
+            self.device_counters = decode_counters(payload)
+        except ValueError as e:
+            logger.warning(f"Bad counters frame: {e}")
+            return
+        self._counters_received.set()
+
+    def load_table(self, frames):
+        """Upload stimulus frames to the device table (slot i holds frames[i]).
+
+        The table is kept and uploaded again on every connect(). Returns
+        table_loaded: whether protocol.encode_trigger(i) frames can now be
+        sent instead of the full frames.
+        """
+        if len(frames) > TABLE_SIZE:
+            raise ValueError(f"Stimulus table too large: {len(frames)} entries (max {TABLE_SIZE})")
+        self.stimulus_table = list(frames)
+        self.table_loaded = False
+        if self.is_connected():
+            self.__upload_table()
+        return self.table_loaded
+
+    def __upload_table(self):
+        if not self.stimulus_table:
+            return
+        if not self.table_supported:
+            logger.info(f"Firmware on {self.path} has no stimulus table, sending full frames")
+            return
+        for index, frame in enumerate(self.stimulus_table):
+            self.send_frame(encode_table_entry(index, frame))
+        self.table_loaded = True
+        logger.info(f"Stimulus table uploaded to {self.path}: {len(self.stimulus_table)} entries")
+
+    def start_writer(self, maxsize=64):
+        """Start a background thread that performs the serial writes.
+
+        Frames passed to submit() are then queued (up to maxsize) and written
+        by the thread, so a slow write never blocks the caller.
+        """
+        if self._writer_thread is not None:
+            return
+        self._write_queue = queue.Queue(maxsize=maxsize)
+        self._writer_stop = threading.Event()
+        self._writer_thread = threading.Thread(target=self.__writer_loop, daemon=True)
+        self._writer_thread.start()
+
+    def stop_writer(self, timeout=2.0):
+        """Stop the writer thread after it has drained the queued frames.
+
+        If the queue stays full for timeout seconds (write() stalled, e.g. on
+        a wedged USB port), the queued frames are dropped, their handles
+        completed with an error, and the thread is left to exit once the
+        stalled write returns.
+        """
+        if self._writer_thread is None:
+            return
+        try:
+            self._write_queue.put(None, timeout=timeout)  # sentinel, after the queued frames
+        except queue.Full:
+            logger.warning(f"Writer on {self.path} stalled; dropping {self._write_queue.qsize()} queued frame(s)")
+            self._writer_stop.set()
+            error = serial.SerialException("writer stopped with frames still queued")
+            while True:
+                try:
+                    handle = self._write_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if handle is not None:
+                    handle._complete(error)
+                    self.__forget(handle)
+            self._write_queue.put_nowait(None)
+        self._writer_thread.join(timeout=timeout)
+        self._writer_thread = None
+        self._write_queue = None
+
+    @property
+    def writer_running(self):
+        return self._writer_thread is not None
+
+    @property
+    def writer_thread(self):
+        """The writer thread (threading.Thread), or None without start_writer()."""
+        return self._writer_thread
+
+    @property
+    def queue_depth(self):
+        """Number of frames waiting for the writer thread."""
+        return self._write_queue.qsize() if self._write_queue is not None else 0
+
+    @property
+    def queue_capacity(self):
+        return self._write_queue.maxsize if self._write_queue is not None else 0
+
+    def submit(self, frame, not_before_ns=None, channel=None):
+        """Submit a prebuilt frame for writing and return its WriteHandle.
+
+        With the writer thread running this never blocks: if the queue is full
+        the frame is refused, rejected_writes is incremented and queue.Full is
+        raised. Without the writer thread the frame is written synchronously
+        and errors are raised directly, as with send_frame().
+
+        If not_before_ns is given, the write is held back until that
+        time.perf_counter_ns() deadline (used to start several devices together).
+        channel is accepted for compatibility with DeviceGroup.submit() and
+        ignored: a single device receives every channel.
+        """
+        if self._acks_enabled:
+            with self._pending_lock:
+                seq = self._next_seq
+                self._next_seq = (seq + 1) % SEQ_MODULO
+                handle = WriteHandle(encode_sequenced(seq, frame), seq, not_before_ns)
+                self._pending[seq] = handle
+        else:
+            handle = WriteHandle(frame, None, not_before_ns)
+        return self.__enqueue(handle)
+
+    def __enqueue(self, handle, block=False):
+        not_before_ns = handle.not_before_ns
+        if self._write_queue is None:
+            try:
+                if not_before_ns is not None:
+                    wait_until(not_before_ns)
+                self.send_frame(handle.frame)
+            except Exception as e:
+                handle._complete(e)
+                self.__forget(handle)
+                raise
+            handle._complete()
+            return handle
+        self.telemetry.record_queue_depth(self._write_queue.qsize())
+        try:
+            self._write_queue.put(handle, block=block, timeout=1.0 if block else None)
+        except queue.Full:
+            self.rejected_writes += 1
+            self.__forget(handle)
+            raise
+        return handle
+
+    def __forget(self, handle):
+        # Drop a handle that never reached the port from the ack bookkeeping
+        if handle.seq is not None:
+            with self._pending_lock:
+                if self._pending.get(handle.seq) is handle:
+                    del self._pending[handle.seq]
+                if self._scheduled.get(handle.seq) is handle:
+                    del self._scheduled[handle.seq]
+
+    @property
+    def schedule_supported(self):
+        """True if commands can be scheduled on the device (firmware support and synced clock)."""
+        return (self.device_info is not None and self.device_info.protocol >= SCHEDULE_PROTOCOL
+                and self.clock.synced)
+
+    @property
+    def scheduled_count(self):
+        """Number of scheduled commands not confirmed as fired yet."""
+        with self._pending_lock:
+            return len(self._scheduled)
+
+    def schedule(self, frame, onset_ns, channel=None):
+        """Have the firmware run a prebuilt frame at host time onset_ns.
+
+        onset_ns (time.perf_counter_ns()) is converted to device micros() with
+        the clock mapping, so clock sync must be running. The device keeps up
+        to protocol.SCHEDULE_SIZE commands and fires each one from its timer
+        interrupt; onsets must be submitted in increasing order. The returned
+        WriteHandle is acknowledged when the command fires (device_us and
+        onset_ns give the actual onset). Raises queue.Full like submit();
+        channel is ignored, as in submit().
+        """
+        onset_us = self.clock.host_to_device(onset_ns)
+        with self._pending_lock:
+            seq = self._next_seq
+            self._next_seq = (seq + 1) % SEQ_MODULO
+            handle = WriteHandle(encode_scheduled(seq, onset_us, frame), seq)
+            self._scheduled[seq] = handle
+        return self.__enqueue(handle)
+
+    def flush_schedule(self, timeout=0.5):
+        """Drop every scheduled command the device has not fired yet.
+
+        Waits for the device to confirm, so acks of commands fired before the
+        flush have been processed when this returns. Returns the WriteHandles
+        that were cancelled (marked lost).
+        """
+        self._flushed.clear()
+        try:
+            if self.arduino is not None:  # after a loss, connect() flushes the device
+                self.__enqueue(WriteHandle(encode_flush()), block=True)  # after the frames already queued
+                if not self._flushed.wait(timeout):
+                    logger.warning(f"No flush confirmation from {self.path} after {timeout}s")
+        except (serial.SerialException, OSError, queue.Full) as e:
+            logger.warning(f"Schedule flush failed: {e}")
+        with self._pending_lock:
+            cancelled = list(self._scheduled.values())
+            self._scheduled.clear()
+        for handle in cancelled:
+            handle._give_up()
+        return cancelled
+
+    def __on_flushed(self, payload, recv_ns):
+        logger.debug(f"[FLUSHED] {payload[0] if payload else 0} scheduled command(s) dropped by the device")
+        self._flushed.set()
+
+    def __writer_loop(self):
+        write_queue = self._write_queue
+        stop = self._writer_stop
+        while True:
+            handle = write_queue.get()
+            if handle is None:
+                break
+            if stop.is_set():
+                handle._complete(serial.SerialException("writer stopped with frames still queued"))
+                break
+            if handle.attempts == 0:
+                if handle.not_before_ns is not None:
+                    wait_until(handle.not_before_ns)
+                    due_ns = handle.not_before_ns
+                else:
+                    due_ns = handle.enqueue_ns
+                self.telemetry.record_queue_wait(time.perf_counter_ns() - due_ns)
+            try:
+                self.send_frame(handle.frame)
+            except Exception as e:
+                handle._complete(e)  # a lost connection is reported by send_frame
+                continue
+            handle._complete()
+
+    def enable_acks(self, timeout=0.25, retransmits=0):
+        """Send frames as sequenced commands and confirm each onset.
+
+        The firmware echoes every sequenced frame with its sequence number and
+        micros() at onset. A reader thread matches acks to the WriteHandles
+        returned by submit(). A frame without ack after timeout seconds is
+        re-sent up to retransmits times, then marked lost. The firmware
+        remembers the last 32 sequence numbers it ran: a duplicate among them
+        is acked again with its original onset, not run twice.
+        """
+        self.ack_timeout = timeout
+        self.max_retransmits = retransmits
+        self._acks_enabled = True
+        self.start_reader()
+
+    def disable_acks(self):
+        self._acks_enabled = False
+        with self._pending_lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for handle in pending:
+            handle._give_up()
+
+    @property
+    def acks_enabled(self):
+        return self._acks_enabled
+
+    @property
+    def pending_acks(self):
+        with self._pending_lock:
+            return len(self._pending)
+
+    def start_reader(self):
+        """Start the thread reading frames sent back by the device."""
+        if self._reader_thread is not None:
+            return
+        self._reader_active = True
+        self._reader_thread = threading.Thread(target=self.__reader_loop, daemon=True)
+        self._reader_thread.start()
+
+    def stop_reader(self, timeout=2.0):
+        if self._reader_thread is None:
+            return
+        self._reader_active = False
+        self._reader_thread.join(timeout=timeout)
+        self._reader_thread = None
+
+    def __reader_loop(self):
+        parser = FrameParser()
+        while self._reader_active:
+            port = self.arduino
+            if port is None:
+                time.sleep(READ_TIMEOUT)
+                self.__check_ack_timeouts(time.perf_counter_ns())
+                continue
+            try:
+                data = port.read(1)
+                if data:
+                    waiting = port.in_waiting
+                    if waiting:
+                        data += port.read(waiting)
+            except (serial.SerialException, OSError) as e:
+                # Unplugged (or closed by disconnect(), then port is no longer self.arduino)
+                self.__connection_lost(port, e)
+                parser = FrameParser()
+                continue
+            except (TypeError, AttributeError) as e:
+                if port is self.arduino and port.is_open:
+                    # not a concurrent close(): the port is unusable
+                    logger.exception("[RECV] read failed")
+                    self.__connection_lost(port, e)
+                    parser = FrameParser()
+                else:
+                    time.sleep(READ_TIMEOUT)  # pyserial internals torn down by a concurrent close()
+                continue
+            now = time.perf_counter_ns()
+            trace = self.trace
+            for source, payload in parser.feed(data):
+                if trace is not None:
+                    trace.record(RX, now, encode_frame(source, payload))
+                handler = self._frame_handlers.get(source)
+                if handler is not None:
+                    try:
+                        handler(payload, now)
+                    except Exception:
+                        # a failing handler or callback must not stop acks, pongs and flush replies
+                        logger.exception(f"[RECV] error handling frame [{source}]")
+                else:
+                    logger.debug(f"[RECV] unhandled frame [{source}]: {frame_to_hex(payload)}")
+            self.__check_ack_timeouts(now)
+
+    def __on_ack(self, payload, recv_ns):
+        try:
+            seq, device_us = decode_ack(payload)
+        except ValueError as e:
+            logger.warning(f"[RECV] malformed ack: {e}")
+            return
+        with self._pending_lock:
+            handle = self._pending.pop(seq, None)
+            if handle is None:
+                handle = self._scheduled.pop(seq, None)
+        if handle is None:
+            return  # duplicate ack after a retransmit, or ack for a frame given up on
+        if self.clock.synced:
+            handle.onset_ns = self.clock.device_to_host(device_us)
+        handle._acknowledge(recv_ns, device_us)
+        self.acked_frames += 1
+        self.__notify_ack(handle)
+
+    def __notify_ack(self, handle):
+        if self.ack_cb is not None:
+            try:
+                self.ack_cb(handle)
+            except Exception:
+                logger.exception(f"ack callback failed for seq {handle.seq}")
+
+    def __check_ack_timeouts(self, now):
+        if not self._pending:
+            return
+        timeout_ns = int(self.ack_timeout * 1e9)
+        resend = []
+        lost = []
+        with self._pending_lock:
+            for seq, handle in list(self._pending.items()):
+                if handle.complete_ns is None or now - handle.complete_ns < timeout_ns:
+                    continue
+                if handle.attempts <= self.max_retransmits:
+                    handle.complete_ns = None  # not expired again until re-written
+                    resend.append(handle)
+                else:
+                    del self._pending[seq]
+                    lost.append(handle)
+        for handle in resend:
+            self.retransmits += 1
+            logger.debug(f"[RETRANSMIT] seq {handle.seq} (attempt {handle.attempts + 1})")
+            self.__rewrite(handle)
+        for handle in lost:
+            self.lost_frames += 1
+            handle._give_up()
+            logger.warning(f"[NO ACK] seq {handle.seq} after {handle.attempts} attempt(s)")
+            self.__notify_ack(handle)
+
+    def __rewrite(self, handle):
+        if self._write_queue is not None:
+            try:
+                self._write_queue.put_nowait(handle)  # completed by the writer thread
+            except queue.Full:
+                handle.complete_ns = time.perf_counter_ns()  # try again after another timeout
+            return
+        try:
+            self.send_frame(handle.frame)
+        except Exception as e:
+            handle._complete(e)
+            return
+        handle._complete()
+
+    def ping(self):
+        """Send one clock sync ping; the pong is handled by the reader thread."""
+        token = self._next_ping
+        self._next_ping = (token + 1) % SEQ_MODULO
+        frame = encode_ping(token)
+        port = self.arduino
+        if port is None:
+            return
+        try:
+            with self._write_lock:
+                start_ns = self._pings[token] = time.perf_counter_ns()
+                port.write(frame)
+                self.telemetry.record_write(len(frame), start_ns, time.perf_counter_ns())
+                trace = self.trace
+                if trace is not None:
+                    trace.record(TX, start_ns, frame)
+        except (serial.SerialException, OSError) as e:
+            self._pings.pop(token, None)
+            self.telemetry.record_error()
+            self.__connection_lost(port, e)
+            raise
+
+    def start_clock_sync(self, interval=1.0, burst=8):
+        """Keep the host <-> device clock mapping up to date.
+
+        Sends a burst of pings to get a first estimate quickly, then one ping
+        every interval seconds. Use device_to_host() to convert onset times.
+        """
+        if self._sync_thread is not None:
+            return
+        self.start_reader()
+        self._sync_stop.clear()
+        self._sync_thread = threading.Thread(target=self.__sync_loop, args=(interval, burst), daemon=True)
+        self._sync_thread.start()
+
+    def stop_clock_sync(self, timeout=2.0):
+        if self._sync_thread is None:
+            return
+        self._sync_stop.set()
+        self._sync_restart.set()  # wake the loop
+        self._sync_thread.join(timeout=timeout)
+        self._sync_thread = None
+
+    def __sync_loop(self, interval, burst):
+        sent = 0
+        while not self._sync_stop.is_set():
+            if self._sync_restart.is_set():
+                self._sync_restart.clear()
+                sent = 0  # reconnected: the clock mapping starts over
+            try:
+                self.ping()
+            except (serial.SerialException, OSError) as e:
+                logger.debug(f"[SYNC] ping failed: {e}")
+            sent += 1
+            self._sync_restart.wait(interval if sent >= burst else min(interval, 0.05))
+
+    def __on_pong(self, payload, recv_ns):
+        try:
+            token, device_us = decode_pong(payload)
+        except ValueError as e:
+            logger.warning(f"[RECV] malformed pong: {e}")
+            return
+        send_ns = self._pings.pop(token, None)
+        if send_ns is None:
+            return
+        if len(self._pings) > 16:
+            self._pings.clear()  # pongs that never came back
+        self.clock.add_sample(send_ns, recv_ns, device_us)
+
+    def device_to_host(self, t_us):
+        """Map a device micros() timestamp to host time.perf_counter_ns()."""
+        return self.clock.device_to_host(t_us)
+
+    def device_to_wall(self, t_us):
+        """Map a device micros() timestamp to host time.time() seconds (as used in logs)."""
+        return perf_to_wall(self.clock.device_to_host(t_us))
+
     def send_signal(self, signal):
         """Send a signal to the Arduino
         signal is a tuple:
@@ -75,58 +1018,36 @@ class ArduinoCom:
         - signal[2] is the frequency in Hz (0-65535)
         - signal[3] is the duration in ms (0-65535)
         For 'c' (combined): signal[4]=ampBuzz, signal[5]=freqBuzz, signal[6]=durBuzz
+
+        The frame is encoded on every call; for playback use a frame prebuilt
+        with protocol.encode_signal() and send_frame().
         """
-        # Validate signal format
-        if not isinstance(signal, (tuple, list)) or len(signal) < 1:
-            raise ValueError("Signal must be a tuple/list with at least 1 element")
-        if signal[0] not in ('v', 'w', 'b', 'c'):
-            raise ValueError(f"Invalid signal type: {signal[0]}")
-        if signal[0] in ('v', 'w', 'b') and len(signal) < 4:
-            raise ValueError(f"Signal type '{signal[0]}' requires 4 elements (type, amp, freq, dur)")
-        if signal[0] == 'c' and len(signal) < 7:
-            raise ValueError("Signal type 'c' requires 7 elements (type, ampV, freqV, durV, ampB, freqB, durB)")
-
-        #the cmd must start with 0xaa
-        start = int(0xaa).to_bytes(1, byteorder='big', signed=False)
-        #transform the char into bytes
-        source = ord(signal[0]).to_bytes(1, byteorder='big', signed=False)
-
-        if signal[0] == 'b':
-            #buzzer
-            length = int(5).to_bytes(1, byteorder='big', signed=False)
-            amp = int(max(0, min(255, signal[1]*255))).to_bytes(1, byteorder='big', signed=False)
-            freq = int(signal[2]).to_bytes(2, byteorder='little', signed=False)
-            dt = signal[3].to_bytes(2, byteorder='little', signed=False)
-            buff = amp + freq + dt
-        elif signal[0] == 'w' or signal[0] == 'v':
-            #vib1 or vib2
-            length = int(5).to_bytes(1, byteorder='big', signed=False)
-            amp = int(max(0, min(255, signal[1]*255))).to_bytes(1, byteorder='big', signed=False)
-            freq = int(signal[2]).to_bytes(2, byteorder='little', signed=False)
-            dt = signal[3].to_bytes(2, byteorder='little', signed=False)
-            buff = amp + freq + dt
-        elif signal[0] == 'c':
-            #combined buzz and vib1
-            length = int(10).to_bytes(1, byteorder='big', signed=False)
-            ampVib1 = int(max(0, min(255, signal[1]*255))).to_bytes(1, byteorder='big', signed=False)
-            freqVib1 = int(signal[2]).to_bytes(2, byteorder='little', signed=False)
-            dtVib1 = signal[3].to_bytes(2, byteorder='little', signed=False)
-            ampBuzz = int(max(0, min(255, signal[4]*255))).to_bytes(1, byteorder='big', signed=False)
-            freqBuzz = int(signal[5]).to_bytes(2, byteorder='little', signed=False)
-            dtBuzz = signal[6].to_bytes(2, byteorder='little', signed=False)
-            buff = ampVib1 + freqVib1 + dtVib1 + ampBuzz + freqBuzz + dtBuzz
-
-        cmd = start + source + length + buff
-        cmd_hex = " ".join("{:02x}".format(c) for c in cmd)
+        self.send_frame(encode_signal(signal))
 
-        if self.arduino is not None:
+    def send_frame(self, frame):
+        """Write a prebuilt frame (bytes) to the Arduino.
+
+        No encoding, validation or connection check is done here so the only
+        work between the scheduler deciding to fire and the bytes leaving the
+        host is the write. Unplugging is detected by the hotplug monitor and
+        the reader thread, or by the write failing.
+        """
+        port = self.arduino
+        if port is not None:
             try:
-                self.check_connection()
-                self.arduino.write(cmd)
-                logger.debug(f"[SENT] cmd [{signal[0]}]: {cmd_hex} (len: {len(cmd)})")
+                with self._write_lock:
+                    start_ns = time.perf_counter_ns()
+                    port.write(frame)
+                    self.telemetry.record_write(len(frame), start_ns, time.perf_counter_ns())
+                    trace = self.trace
+                    if trace is not None:
+                        trace.record(TX, start_ns, frame)
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"[SENT] cmd [{chr(frame[1])}]: {frame_to_hex(frame)} (len: {len(frame)})")
             except serial.SerialException as e:
-                logger.error(f"[DISCONNECTED] cmd [{signal[0]}]: {cmd_hex} - {e}")
+                self.telemetry.record_error()
+                logger.error(f"[DISCONNECTED] cmd [{chr(frame[1])}]: {frame_to_hex(frame)} - {e}")
+                self.__connection_lost(port, e)
                 raise
         else:
-            logger.warning(f"[UNSENT] cmd [{signal[0]}]: {cmd_hex} (len: {len(cmd)})")
-            
+            logger.warning(f"[UNSENT] cmd [{chr(frame[1])}]: {frame_to_hex(frame)} (len: {len(frame)})")
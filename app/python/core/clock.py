@@ -0,0 +1,90 @@
+"""Clocks for the experiment scheduler: the host clock or a simulated one.
+
+Experiment reads the time and waits for onsets through a clock object.
+SYSTEM_CLOCK is time.perf_counter_ns() with the sleep-then-spin wait.
+SimulatedClock never waits: a wait jumps the time to its deadline, so a
+whole plan runs in the time its callbacks and writes take, with the
+planned timeline. Before jumping it lets the registered devices catch up
+(see add_settle()), so a VirtualBsense on a loop:// link decodes every
+frame at the simulated time it was written.
+
+Example:
+    clock = SimulatedClock()
+    device = VirtualBsense("loop", clock=clock)
+    device.start()
+    clock.add_settle(device.idle)
+    exp = Experiment(clock=clock)
+"""
+import threading
+import time
+
+SETTLE_TIMEOUT = 1.0  # seconds a simulated wait gives the devices to take in what was written
+
+
+class SystemClock:
+    """The host clock: time.perf_counter_ns() and real waits."""
+    simulated = False
+
+    def now_ns(self):
+        return time.perf_counter_ns()
+
+    def wait_until(self, deadline_ns, stop_event, spin_ns=1_000_000):
+        """Wait for now_ns() to reach deadline_ns; False if stop_event was set first.
+
+        Sleeps on stop_event (so setting it interrupts the wait) until
+        spin_ns before the deadline, then polls the clock: a sleep can
+        overshoot by a scheduler tick, the polling does not.
+        """
+        remaining = deadline_ns - time.perf_counter_ns()
+        if remaining > spin_ns and stop_event.wait((remaining - spin_ns) / 1e9):
+            return False
+        while time.perf_counter_ns() < deadline_ns:
+            if stop_event.is_set():
+                return False
+        return True
+
+
+class SimulatedClock:
+    """A clock that only moves when waited on (or advanced), and then instantly."""
+    simulated = True
+
+    def __init__(self, start_ns=0):
+        self._now_ns = start_ns
+        self._lock = threading.Lock()
+        self._settle = []
+
+    def now_ns(self):
+        with self._lock:
+            return self._now_ns
+
+    def advance(self, ns):
+        with self._lock:
+            self._now_ns += max(0, ns)
+
+    def add_settle(self, idle):
+        """idle() returns True once a device has handled everything sent to it; waits check it first."""
+        self._settle.append(idle)
+
+    def wait_until(self, deadline_ns, stop_event, spin_ns=0):
+        """Jump to deadline_ns (never backwards); False if stop_event is set.
+
+        spin_ns is accepted for compatibility with SystemClock and ignored.
+        """
+        self.settle()
+        if stop_event.is_set():
+            return False
+        with self._lock:
+            self._now_ns = max(self._now_ns, deadline_ns)
+        return True
+
+    def settle(self, timeout=SETTLE_TIMEOUT):
+        """Wait (real time, up to timeout) until every registered device is idle."""
+        end = time.monotonic() + timeout
+        while not all(idle() for idle in self._settle):
+            if time.monotonic() > end:
+                return False
+            time.sleep(0.0001)
+        return True
+
+
+SYSTEM_CLOCK = SystemClock()
@@ -0,0 +1,131 @@
+"""Host <-> device clock mapping from ping/pong exchanges.
+
+Each exchange gives the host perf_counter_ns() when a ping was written and
+when the pong came back, plus the device micros() stamped in the pong. The
+device time is assumed to correspond to the midpoint of the round trip
+(NTP style). A least-squares line through recent exchanges gives the offset
+and drift between the two clocks.
+
+Exchanges with a long round trip carry more uncertainty, so only the half
+of the window with the lowest round-trip time is used in the fit.
+"""
+import collections
+import threading
+import time
+
+MICROS_WRAP = 1 << 32  # micros() is an unsigned 32-bit counter (wraps every ~71.6 min)
+MAX_DRIFT = 1e-3  # crystal rate errors are well below this; a larger fitted drift is noise
+
+
+class ClockSync:
+    def __init__(self, window=64):
+        self._samples = collections.deque(maxlen=window)  # (device_us unwrapped, host_ns, rtt_ns)
+        self._lock = threading.Lock()
+        self._last_raw = None
+        self._wraps = 0
+        # Fit: host_ns = _host0 + slope * (device_us - _dev0)
+        self._host0 = None
+        self._dev0 = None
+        self._slope = 1000.0  # ns per device us
+        self.residual_ns = None  # RMS residual of the last fit
+        self.min_rtt_ns = None
+
+    @property
+    def synced(self):
+        return self._host0 is not None
+
+    @property
+    def sample_count(self):
+        return len(self._samples)
+
+    @property
+    def drift_ppm(self):
+        """Device clock rate error relative to the host, in parts per million."""
+        return (1000.0 / self._slope - 1.0) * 1e6
+
+    @property
+    def error_ns(self):
+        """Rough bound on the mapping error: fit residual plus half the best round trip."""
+        if not self.synced:
+            return None
+        return (self.residual_ns or 0.0) + self.min_rtt_ns / 2
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._last_raw = None
+            self._wraps = 0
+            self._host0 = None
+            self._dev0 = None
+            self._slope = 1000.0
+            self.residual_ns = None
+            self.min_rtt_ns = None
+
+    def add_sample(self, send_ns, recv_ns, device_us):
+        """Add one ping/pong exchange and refit.
+
+        Args:
+            send_ns: host perf_counter_ns() just before the ping was written
+            recv_ns: host perf_counter_ns() when the pong was read
+            device_us: raw device micros() carried by the pong
+        """
+        with self._lock:
+            if self._last_raw is not None and device_us < self._last_raw and \
+                    self._last_raw - device_us > MICROS_WRAP // 2:
+                self._wraps += 1
+            self._last_raw = device_us
+            unwrapped = device_us + self._wraps * MICROS_WRAP
+            self._samples.append((unwrapped, (send_ns + recv_ns) // 2, recv_ns - send_ns))
+            self.__fit()
+
+    def __fit(self):
+        best = sorted(self._samples, key=lambda s: s[2])
+        best = best[:max(2, (len(best) + 1) // 2)]
+        self.min_rtt_ns = best[0][2]
+        n = len(best)
+        dev0 = sum(s[0] for s in best) / n
+        host0 = sum(s[1] for s in best) / n
+        sxx = sum((s[0] - dev0) ** 2 for s in best)
+        if n >= 2 and sxx > 0:
+            slope = sum((s[0] - dev0) * (s[1] - host0) for s in best) / sxx
+        else:
+            slope = 1000.0  # a single point only gives the offset
+        if abs(slope / 1000.0 - 1.0) > MAX_DRIFT:
+            slope = 1000.0  # samples too close together or too noisy to estimate the drift
+        self._dev0, self._host0, self._slope = dev0, host0, slope
+        self.residual_ns = (sum((s[1] - host0 - slope * (s[0] - dev0)) ** 2 for s in best) / n) ** 0.5
+
+    def unwrap(self, device_us):
+        """Place a raw 32-bit micros() value in the wrap period closest to the last sample."""
+        with self._lock:
+            if self._last_raw is None:
+                return device_us
+            ref = self._last_raw + self._wraps * MICROS_WRAP
+        candidate = device_us + (ref - ref % MICROS_WRAP)
+        if candidate - ref > MICROS_WRAP // 2:
+            candidate -= MICROS_WRAP
+        elif ref - candidate > MICROS_WRAP // 2:
+            candidate += MICROS_WRAP
+        return candidate
+
+    def device_to_host(self, device_us):
+        """Map a raw device micros() value to host perf_counter_ns()."""
+        if not self.synced:
+            raise RuntimeError("Clock not synchronised yet")
+        return int(self._host0 + self._slope * (self.unwrap(device_us) - self._dev0))
+
+    def host_to_device(self, host_ns):
+        """Map host perf_counter_ns() to raw device micros() (32-bit)."""
+        if not self.synced:
+            raise RuntimeError("Clock not synchronised yet")
+        return int(round(self._dev0 + (host_ns - self._host0) / self._slope)) % MICROS_WRAP
+
+
+# Offset between time.time() and time.perf_counter_ns(), fixed at import so
+# that every conversion in a session uses the same reference.
+_WALL_OFFSET_NS = time.time_ns() - time.perf_counter_ns()
+
+
+def perf_to_wall(perf_ns):
+    """Convert a perf_counter_ns() value to time.time() seconds."""
+    return (perf_ns + _WALL_OFFSET_NS) / 1e9
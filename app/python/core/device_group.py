@@ -0,0 +1,339 @@
+"""Several Bsense devices driven from one host as a single output.
+
+A DeviceGroup opens one ArduinoCom per port, each with its own writer
+thread. A stimulus sent to the group is queued on every device its channel
+maps to, with a shared perf_counter_ns() deadline: the writer threads wait
+for the deadline and then write, so onsets line up across devices. The
+spread of write completions (and, with acks and clock sync, of the device
+onsets mapped to host time) is recorded for every event.
+
+It exposes the parts of the ArduinoCom interface used by Experiment, so it
+can be passed as Experiment(devices=group):
+
+    group = DeviceGroup(channel_map={"booth1": [0], "booth2": [1]})
+    exp = Experiment(devices=group)
+    exp.connect_arduino(["/dev/ttyACM0", "/dev/ttyACM1"])
+
+Stimulus items choose a channel with an optional "Channel" field; items
+without one (or with an unmapped channel) go to every device.
+"""
+import collections
+import logging
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from core.arduino_communication import ArduinoCom
+from core.telemetry import dump_json
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEAD_NS = 2_000_000  # time given to every writer thread to pick up its frame
+
+
+class GroupEvent:
+    """The frames sent to each device for one stimulus."""
+    __slots__ = ("deadline_ns", "handles")
+
+    def __init__(self, deadline_ns, handles):
+        self.deadline_ns = deadline_ns
+        self.handles = handles  # device index -> WriteHandle
+
+    def wait(self, timeout=None):
+        end = None if timeout is None else time.perf_counter() + timeout
+        for handle in self.handles.values():
+            if not handle.wait(None if end is None else max(0.0, end - time.perf_counter())):
+                return False
+        return True
+
+    def wait_ack(self, timeout=None):
+        """Block until every device acknowledged its frame. Returns False otherwise."""
+        end = None if timeout is None else time.perf_counter() + timeout
+        for handle in self.handles.values():
+            if not handle.wait_ack(None if end is None else max(0.0, end - time.perf_counter())):
+                return False
+        return True
+
+    @property
+    def onset_ns(self):
+        """Earliest device onset in host time, or None until all are known."""
+        times = [h.onset_ns for h in self.handles.values()]
+        if not times or None in times:
+            return None
+        return min(times)
+
+    @property
+    def complete_ns(self):
+        """When the last device's write completed, or None if pending."""
+        times = [h.complete_ns for h in self.handles.values()]
+        if not times or None in times:
+            return None
+        return max(times)
+
+    @property
+    def write_skew_ns(self):
+        """Spread of write completion times across devices, or None if pending."""
+        times = [h.complete_ns for h in self.handles.values()]
+        if None in times:
+            return None
+        return max(times) - min(times)
+
+    @property
+    def onset_skew_ns(self):
+        """Spread of device onsets in host time (needs acks and clock sync), or None."""
+        times = [h.onset_ns for h in self.handles.values()]
+        if not times or None in times:
+            return None
+        return max(times) - min(times)
+
+
+class DeviceGroup:
+    def __init__(self, channel_map=None, lead_ns=DEFAULT_LEAD_NS, history=100000):
+        """
+        Args:
+            channel_map: {channel: [device indices]} (unmapped channels go to all devices);
+                channel names are compared as strings, so "Channel": 1 matches "1"
+            lead_ns: Delay between submit() and the shared write deadline
+            history: Number of GroupEvents kept for skew statistics
+        """
+        self.devices = []
+        self.channel_map = {str(name): list(indices) for name, indices in (channel_map or {}).items()}
+        self.lead_ns = lead_ns
+        self.events = collections.deque(maxlen=history)
+        self.disconnect_cb = None
+        self.ack_cb = None
+        self.reconnect_cb = None  # called once every device is back (see ArduinoCom.enable_reconnect)
+        self._lost_ns = None  # first loss of the current outage
+        self.stimulus_table = []
+        self._closed_devices = []  # kept after close() for stats()
+        self._trace_path = None
+        self._options = []  # (method name, kwargs) to apply to every device
+
+    # -- connection ----------------------------------------------------------
+
+    def connect(self, paths):
+        """Open every port concurrently. paths is a list or a comma separated string."""
+        if isinstance(paths, str):
+            paths = [p.strip() for p in paths.split(",") if p.strip()]
+        bad = {name: indices for name, indices in self.channel_map.items()
+               if any(not 0 <= i < len(paths) for i in indices)}
+        if bad:
+            raise ValueError(f"Channel map refers to devices that do not exist ({len(paths)} ports): "
+                             + ", ".join(f"{name}={indices}" for name, indices in bad.items()))
+        self.close()
+        devices = [self.__make_device(i) for i in range(len(paths))]
+        with ThreadPoolExecutor(max_workers=max(1, len(paths))) as pool:
+            errors = list(pool.map(self.__connect_one, devices, paths))
+        failed = [f"{path}: {err}" for path, err in zip(paths, errors) if err is not None]
+        if failed:
+            for device in devices:
+                device.close()
+            raise Exception("Could not connect all devices: " + "; ".join(failed))
+        self.devices = devices
+        for name, kwargs in self._options:
+            for device in self.devices:
+                getattr(device, name)(**kwargs)
+        if self.stimulus_table:
+            self.load_table(self.stimulus_table)
+        if self._trace_path:
+            self.start_trace(self._trace_path)
+
+    @staticmethod
+    def __connect_one(device, path):
+        try:
+            device.connect(path)
+        except Exception as e:
+            return e
+        return None
+
+    def __make_device(self, index):
+        device = ArduinoCom()
+        device.disconnect_cb = lambda error: self.__on_disconnect(index, error)
+        device.ack_cb = self.__on_ack
+        device.reconnect_cb = lambda outage_ns: self.__on_reconnect(index, outage_ns)
+        device.start_writer()
+        return device
+
+    def __on_disconnect(self, index, error):
+        logger.error(f"Device {index} lost: {error}")
+        if self._lost_ns is None:
+            self._lost_ns = time.perf_counter_ns()
+        if self.disconnect_cb is not None:
+            self.disconnect_cb(error)
+
+    def __on_reconnect(self, index, outage_ns):
+        if outage_ns is None:
+            logger.error(f"Device {index} could not be reconnected")
+        elif not self.is_connected():
+            return  # wait for the other devices
+        else:
+            lost_ns, self._lost_ns = self._lost_ns, None
+            if lost_ns is not None:
+                outage_ns = time.perf_counter_ns() - lost_ns
+        if self.reconnect_cb is not None:
+            self.reconnect_cb(outage_ns)
+
+    def __on_ack(self, handle):
+        if self.ack_cb is not None:
+            self.ack_cb(handle)
+
+    def close(self):
+        for device in self.devices:
+            device.close()
+        if self.devices:
+            self._closed_devices = self.devices
+        self.devices = []
+
+    def disconnect(self):
+        for device in self.devices:
+            device.disconnect()
+
+    def is_connected(self):
+        return bool(self.devices) and all(d.is_connected() for d in self.devices)
+
+    # -- options applied to every device -------------------------------------
+
+    def __apply(self, name, **kwargs):
+        self._options.append((name, kwargs))
+        for device in self.devices:
+            getattr(device, name)(**kwargs)
+
+    def start_writer(self, maxsize=64):
+        pass  # every device always has its writer thread
+
+    def stop_writer(self):
+        for device in self.devices:
+            device.stop_writer()
+
+    def enable_acks(self, timeout=0.25, retransmits=0):
+        self.__apply("enable_acks", timeout=timeout, retransmits=retransmits)
+
+    def start_clock_sync(self, interval=1.0, burst=8):
+        self.__apply("start_clock_sync", interval=interval, burst=burst)
+
+    def enable_reconnect(self, interval=0.5, timeout=None):
+        self.__apply("enable_reconnect", interval=interval, timeout=timeout)
+
+    def start_trace(self, path):
+        """Trace every device's frames (ArduinoCom.start_trace), one file per device.
+
+        With several devices, device i writes to path with ".i" inserted
+        before the extension (trace.bin -> trace.0.bin, trace.1.bin, ...).
+        """
+        self._trace_path = path
+        for index, device in enumerate(self.devices):
+            if len(self.devices) == 1:
+                device.start_trace(path)
+            else:
+                root, ext = os.path.splitext(path)
+                device.start_trace(f"{root}.{index}{ext}")
+
+    def stop_trace(self):
+        self._trace_path = None
+        for device in self.devices:
+            device.stop_trace()
+
+    def load_table(self, frames):
+        """Upload the stimulus table to every device (see ArduinoCom.load_table)."""
+        self.stimulus_table = list(frames)
+        loaded = [device.load_table(frames) for device in self.devices]
+        return bool(loaded) and all(loaded)
+
+    @property
+    def table_loaded(self):
+        # trigger frames are only used when every device holds the table
+        return bool(self.devices) and all(d.table_loaded for d in self.devices)
+
+    @property
+    def multi_supported(self):
+        return bool(self.devices) and all(d.multi_supported for d in self.devices)
+
+    @property
+    def schedule_supported(self):
+        return bool(self.devices) and all(d.schedule_supported for d in self.devices)
+
+    @property
+    def scheduled_count(self):
+        return max((d.scheduled_count for d in self.devices), default=0)
+
+    def schedule(self, frame, onset_ns, channel=None):
+        """Schedule frame on every device of channel at host time onset_ns.
+
+        Each device converts the onset with its own clock mapping, so the
+        devices fire together to within their clock sync error.
+        """
+        handles = {}
+        for index in self.devices_for(channel):
+            handles[index] = self.devices[index].schedule(frame, onset_ns)
+        event = GroupEvent(onset_ns, handles)
+        self.events.append(event)
+        return event
+
+    def flush_schedule(self, timeout=0.5):
+        cancelled = []
+        for device in self.devices:
+            cancelled += device.flush_schedule(timeout)
+        return cancelled
+
+    @property
+    def queue_depth(self):
+        return max((d.queue_depth for d in self.devices), default=0)
+
+    # -- sending -------------------------------------------------------------
+
+    def unused_channels(self, channels):
+        """Mapped channel names that none of channels (as used by a plan) refers to."""
+        used = {str(channel) for channel in channels if channel is not None}
+        return sorted(set(self.channel_map) - used)
+
+    def devices_for(self, channel):
+        """Indices of the devices a channel is sent to."""
+        indices = self.channel_map.get(None if channel is None else str(channel))
+        if indices is None:
+            return range(len(self.devices))
+        return indices
+
+    def submit(self, frame, channel=None, deadline_ns=None):
+        """Queue frame on every device of channel, all released at one deadline.
+
+        Returns the GroupEvent. Raises queue.Full only if no device accepted
+        the frame.
+        """
+        if deadline_ns is None:
+            deadline_ns = time.perf_counter_ns() + self.lead_ns
+        handles = {}
+        full = None
+        for index in self.devices_for(channel):
+            try:
+                handles[index] = self.devices[index].submit(frame, not_before_ns=deadline_ns)
+            except queue.Full as e:
+                full = e
+                logger.warning(f"Device {index} writer queue full, frame dropped")
+        if not handles:
+            if full is not None:
+                raise full
+            logger.warning(f"[UNSENT] no device for channel {channel!r}")
+        event = GroupEvent(deadline_ns, handles)
+        self.events.append(event)
+        return event
+
+    def stats(self):
+        """Per-device link telemetry (ArduinoCom.stats()) and the skew summary."""
+        devices = self.devices or self._closed_devices
+        return {"devices": [device.stats() for device in devices], "skew": self.skew_summary()}
+
+    def dump_stats(self, path):
+        dump_json(self.stats(), path)
+
+    def skew_summary(self):
+        """Statistics of write and onset skew over the recorded events (in ns)."""
+        summary = {}
+        for name in ("write_skew_ns", "onset_skew_ns"):
+            values = [v for v in (getattr(e, name) for e in self.events) if v is not None]
+            summary[name] = {
+                "count": len(values),
+                "mean": sum(values) / len(values) if values else None,
+                "max": max(values) if values else None,
+            }
+        return summary
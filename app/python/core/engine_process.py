@@ -0,0 +1,310 @@
+"""The experiment engine in its own process, away from the GUI's GIL.
+
+ExperimentProcess runs an Experiment in a child process and exposes the
+part of its interface the GUI uses (connect, load, start / pause / stop,
+seek, callbacks). The scheduler and the serial I/O threads then never wait
+for the Tk main loop: repopulating the treeview or appending to the log
+happens in another interpreter.
+
+Only the threads that time the onsets, the scheduler and the serial
+writer, are pinned to one CPU and raised to SCHED_FIFO / SCHED_RR
+(apply_realtime()). The scheduler busy-waits the last stretch before each
+onset, and a real-time policy does not time-slice: the reader, clock sync
+and command threads keep the normal policy and are free to run on the
+other CPUs. Where the OS does not allow it (no permission, not Linux) the
+engine runs with normal priority and the reason is logged. Commands go
+over a multiprocessing Pipe (a socketpair on Unix, tens of microseconds
+per round trip); log lines and event indices come back over it and the
+callbacks are called from a reader thread, like Experiment's callbacks are
+called from its scheduler thread.
+
+The plan is built in the child (randomisation included); sequence holds a
+copy for display, with (None, name, parameters) rows. The device must be
+reachable from another process: a serial port, a pty or a tcp:// / udp://
+URL, not loop://.
+
+Example:
+    exp = ExperimentProcess(cpu=3, priority=50, async_writes=True)
+    exp.log_cb = print
+    exp.connect_arduino("/dev/ttyACM0")
+    exp.from_json("experiment.json")
+    exp.start()
+"""
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("fifo", "rr")
+DEFAULT_PRIORITY = 50  # SCHED_FIFO priority (1-99) used by default_placement()
+
+# Experiment methods and attributes the parent may use
+_METHODS = ("connect_arduino", "from_json", "from_dict", "start", "stop", "pause", "enable_reconnect",
+            "start_trace", "drift_report")
+_GETTABLE = ("running", "current_idx", "timing_path")
+_SETTABLE = ("current_idx", "timing_path")
+
+
+def apply_realtime(cpu=None, priority=None, policy="fifo", tid=0):
+    """Pin a thread to one CPU and give it a real-time scheduling policy, where allowed.
+
+    tid is a native thread id (threading.Thread.native_id), 0 for the
+    calling thread; threads it starts later inherit both. Returns what was
+    applied: {"tid", "cpu", "policy", "priority"} (cpu None and policy
+    "default" when not applied).
+    """
+    if policy not in POLICIES:
+        raise ValueError(f"Unknown scheduling policy '{policy}' (expected one of {', '.join(POLICIES)})")
+    info = {"tid": tid or threading.get_native_id(), "cpu": None, "policy": "default", "priority": None}
+    if cpu is not None:
+        if hasattr(os, "sched_setaffinity"):
+            try:
+                os.sched_setaffinity(tid, {cpu})
+                info["cpu"] = cpu
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not pin the engine to CPU {cpu}: {e}")
+        else:
+            logger.warning("CPU pinning is not supported on this platform")
+    if priority is not None:
+        if hasattr(os, "sched_setscheduler"):
+            sched = os.SCHED_FIFO if policy == "fifo" else os.SCHED_RR
+            try:
+                os.sched_setscheduler(tid, sched, os.sched_param(priority))
+                info["policy"] = policy
+                info["priority"] = priority
+            except (OSError, ValueError) as e:
+                # unprivileged: needs CAP_SYS_NICE or an rtprio limit (ulimit -r)
+                logger.warning(f"Real-time priority not allowed ({e}); the engine runs with normal priority")
+        else:
+            logger.warning("Real-time scheduling is not supported on this platform")
+    return info
+
+
+def default_placement():
+    """(cpu, priority) for the engine: the last CPU when there are several, and DEFAULT_PRIORITY."""
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    return (cpus[-1] if len(cpus) > 1 else None), DEFAULT_PRIORITY
+
+
+def _timing_threads(exp):
+    # the threads whose latency sets the onsets; the others keep the normal policy
+    threads = {"scheduler": exp.thread}
+    if exp.arduino.writer_thread is not None:
+        threads["writer"] = exp.arduino.writer_thread
+    return threads
+
+
+def _sequence_view(sequence):
+    # the events hold bound methods; the parent only displays name and parameters
+    return tuple((None, event[1], event[2]) for event in sequence)
+
+
+def _engine_main(conn, experiment_kwargs, cpu, priority, policy):
+    """Child process: run an Experiment and serve the parent's commands until "close"."""
+    from core.experiment import Experiment  # the parent never needs it
+
+    send_lock = threading.Lock()
+
+    def send(*message):
+        with send_lock:
+            try:
+                conn.send(message)
+            except (OSError, ValueError):
+                pass  # parent gone
+
+    try:
+        exp = Experiment(**experiment_kwargs)
+    except Exception as e:
+        send("reply", False, e)
+        return
+    applied = {name: apply_realtime(cpu, priority, policy, thread.native_id)
+               for name, thread in _timing_threads(exp).items()}
+    scheduler = applied["scheduler"]
+    info = {"pid": os.getpid(), "cpu": scheduler["cpu"], "policy": scheduler["policy"],
+            "priority": scheduler["priority"], "threads": {name: a["tid"] for name, a in applied.items()}}
+    exp.log_cb = lambda text: send("log", text)
+    exp.event_cb = lambda idx: send("event", idx)
+    exp.disconnect_cb = lambda: send("disconnect")
+    send("reply", True, info)
+    while True:
+        try:
+            command, name, args = conn.recv()
+        except (EOFError, OSError):
+            exp.close()  # parent died
+            return
+        try:
+            if command == "close":
+                exp.close()
+                send("reply", True, None)
+                return
+            elif command == "call" and name in _METHODS:
+                value = getattr(exp, name)(*args)
+                if name in ("from_json", "from_dict"):
+                    value = _sequence_view(exp.sequence)
+            elif command == "get" and name in _GETTABLE:
+                value = getattr(exp, name)
+            elif command == "set" and name in _SETTABLE:
+                setattr(exp, name, args[0])
+                value = None
+            elif command == "timing":
+                value = exp.timing.stats()
+            else:
+                raise ValueError(f"Unknown engine command {command} {name}")
+        except Exception as e:
+            try:
+                send("reply", False, e)
+            except Exception:
+                send("reply", False, RuntimeError(str(e)))
+            continue
+        send("reply", True, value)
+
+
+class ExperimentProcess:
+    """An Experiment running in a child process; see the module docstring.
+
+    cpu pins the child's scheduler and writer threads to that CPU, priority
+    (1-99) gives them the real-time policy ("fifo" or "rr");
+    experiment_kwargs are passed to Experiment (they must be picklable, so
+    no devices= DeviceGroup). engine_info is what apply_realtime() managed
+    to apply: {"pid", "cpu", "policy", "priority", "threads"}, threads
+    mapping "scheduler" / "writer" to their native thread ids.
+    """
+
+    def __init__(self, cpu=None, priority=None, policy="fifo", **experiment_kwargs):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown scheduling policy '{policy}' (expected one of {', '.join(POLICIES)})")
+        self.log_cb = self.__default_cb
+        self.event_cb = self.__default_cb
+        self.disconnect_cb = self.__default_cb
+        self._sequence = ()
+        self._replies = queue.Queue()
+        self._call_lock = threading.Lock()
+        # spawn: a fresh interpreter, no copy of the GUI's threads and Tk state
+        context = multiprocessing.get_context("spawn")
+        self._conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_engine_main, name="bsense-engine", daemon=True,
+                                       args=(child_conn, experiment_kwargs, cpu, priority, policy))
+        self.process.start()
+        child_conn.close()
+        self._reader = threading.Thread(target=self.__read_loop, daemon=True)
+        self._reader.start()
+        try:
+            self.engine_info = self.__wait_reply()
+        except Exception:
+            self.process.join(timeout=2.0)
+            raise
+        logger.info(f"Experiment engine in process {self.engine_info['pid']} "
+                    f"(cpu {self.engine_info['cpu']}, policy {self.engine_info['policy']})")
+
+    def __default_cb(self, *args):
+        pass
+
+    def __read_loop(self):
+        while True:
+            try:
+                message = self._conn.recv()
+            except (EOFError, OSError):
+                self._replies.put((False, RuntimeError("Experiment engine process exited")))
+                return
+            kind = message[0]
+            if kind == "reply":
+                self._replies.put(message[1:])
+            elif kind == "log":
+                self.log_cb(message[1])
+            elif kind == "event":
+                self.event_cb(message[1])
+            elif kind == "disconnect":
+                self.disconnect_cb()
+
+    def __wait_reply(self):
+        ok, value = self._replies.get()
+        if not ok:
+            raise value
+        return value
+
+    def __request(self, command, name=None, *args):
+        with self._call_lock:
+            if not self.process.is_alive():
+                raise RuntimeError("Experiment engine process is not running")
+            self._conn.send((command, name, args))
+            return self.__wait_reply()
+
+    # -- Experiment interface --------------------------------------------
+
+    def connect_arduino(self, path):
+        self.__request("call", "connect_arduino", path)
+
+    def from_json(self, path):
+        self._sequence = self.__request("call", "from_json", path)
+
+    def from_dict(self, rules):
+        self._sequence = self.__request("call", "from_dict", rules)
+
+    def start(self):
+        self.__request("call", "start")
+
+    def stop(self):
+        self.__request("call", "stop")
+
+    def pause(self):
+        self.__request("call", "pause")
+
+    def enable_reconnect(self, resume="shift", timeout=None):
+        self.__request("call", "enable_reconnect", resume, timeout)
+
+    def start_trace(self, path):
+        self.__request("call", "start_trace", path)
+
+    def drift_report(self):
+        return self.__request("call", "drift_report")
+
+    def timing_stats(self):
+        """Experiment.timing.stats() of the engine."""
+        return self.__request("timing")
+
+    def add_cb_log(self, cb):
+        self.log_cb = cb
+
+    def add_cb_event(self, cb):
+        self.event_cb = cb
+
+    @property
+    def sequence(self):
+        return self._sequence
+
+    @property
+    def running(self):
+        return self.__request("get", "running")
+
+    @property
+    def current_idx(self):
+        return self.__request("get", "current_idx")
+
+    @current_idx.setter
+    def current_idx(self, value):
+        self.__request("set", "current_idx", value)
+
+    @property
+    def timing_path(self):
+        return self.__request("get", "timing_path")
+
+    @timing_path.setter
+    def timing_path(self, value):
+        self.__request("set", "timing_path", value)
+
+    def close(self):
+        """Close the Experiment in the child and wait for the process to exit."""
+        if self.process.is_alive():
+            try:
+                self.__request("close")
+            except (RuntimeError, OSError) as e:
+                logger.warning(f"Experiment engine did not close cleanly: {e}")
+        self.process.join(timeout=5.0)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        self._reader.join(timeout=1.0)  # ends on the end of file left by the child
+        self._conn.close()
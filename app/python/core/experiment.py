@@ -1,10 +1,23 @@
 
+import collections
 import json
+import queue
 import random
 import time
 import threading
 import serial
 from core.arduino_communication import ArduinoCom
+from core.protocol import (encode_signal, encode_trigger, encode_multi, split_multi, MULTI, MULTI_MAX_PAYLOAD,
+                           SIGNAL_TYPES, TABLE_SIZE)
+from core.clock_sync import perf_to_wall
+from core.timing import OnsetRecorder
+from core.clock import SYSTEM_CLOCK
+
+SCHEDULE_LEAD_NS = 50_000_000  # first device-scheduled onset, after starting or resuming
+SCHEDULE_GRACE_NS = 1_000_000_000  # how long after its onset a scheduled stimulus may be confirmed
+RESUME_POLICIES = ("shift", "keep")  # what happens to the plan after a reconnect (see enable_reconnect)
+RESYNC_TIMEOUT = 2.0  # seconds to wait for the clock mapping before resuming a device-scheduled run
+SPIN_NS = 1_000_000  # last part of a wait for an onset spent polling the clock instead of sleeping
 
 
 # def exp_loop():
@@ -48,6 +61,7 @@ class Experiment:
         "frequency": "Frequency",
         "tone": "Tone",
         "label": "Label",
+        "channel": "Channel",
         # Dropout_sequence fields
         "number_drop": "Number_drop",
         "dropout_content": "Dropout_content",
@@ -70,17 +84,71 @@ class Experiment:
         "deviation_duration": "Deviation_duration",
     }
 
-    def __init__(self):
+    def __init__(self, async_writes=False, acks=False, clock_sync=False, devices=None,
+                 device_scheduling=False, lookahead=8, stats_path=None, reconnect=None, trace_path=None,
+                 spin_ns=SPIN_NS, timing_path=None, clock=None):
         # Experiment initialization
+        # clock: the time source of the host-timed scheduler (core.clock); a
+        # SimulatedClock runs the plan without waiting. The device-timed path and
+        # the writer thread stay on perf_counter_ns(), so they need the host clock.
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        if self.clock.simulated and (async_writes or device_scheduling):
+            raise ValueError("A simulated clock needs synchronous writes and host timing "
+                             "(async_writes=False, device_scheduling=False)")
         self.log_cb = self.__default_cb
         self.event_cb = self.__default_cb
         self.disconnect_cb = self.__default_cb  # called on connection error
-        self.arduino = ArduinoCom()
+        # devices: optional DeviceGroup to drive several Bsense boxes as one output
+        self.arduino = devices if devices is not None else ArduinoCom()
+        self.arduino.disconnect_cb = self.__on_link_lost
+        if async_writes:
+            # serial writes happen on the ArduinoCom writer thread, never on the scheduler
+            self.arduino.start_writer()
+        if acks:
+            # firmware confirms every stimulus onset; results reported through __on_ack
+            self.arduino.ack_cb = self.__on_ack
+            self.arduino.enable_acks()
+        if clock_sync or device_scheduling:
+            # map acked device onset times to host time
+            self.arduino.start_clock_sync()
+        # device_scheduling: stream stimuli tagged with their onset time, up to
+        # lookahead stimuli ahead, and let the firmware fire them (see __run_scheduled)
+        self.device_scheduling = device_scheduling
+        self.lookahead = lookahead
+        self.stats_path = stats_path  # link telemetry is written there as JSON on close()
+        if trace_path:
+            # binary record of every frame on the link (core.wire_trace)
+            self.arduino.start_trace(trace_path)
         self._lock = threading.Lock()  # protects shared state
-        self._sequence = []
+        # notified on start, pause, stop, seek and close; the main loop sleeps on it while idle
+        self._changed = threading.Condition(self._lock)
+        self._sequence = ()  # the plan: an immutable tuple, replaced as a whole
+        self.stimulus_table = []  # distinct stimulus frames, uploaded to the device once
+        self._unmerged = set()  # (names, channel) of stimuli too long for one MULTI frame, per load
         self._current_idx = 0
         self._running = False
         self._stop_event = threading.Event()  # for fast interrupt of delays
+        self._stops = 0  # incremented by stop(), so a run can tell stop from pause
+        self._loop_idle = threading.Event()  # set while the main loop waits to be started
+        self._event_start_ns = None  # when the event at current_idx started (or was planned to)
+        # Onsets are absolute deadlines from the start of the run: delays move the
+        # deadline forward, so the time spent sending and logging does not add up.
+        # A wait sleeps until spin_ns before its deadline, then polls the clock.
+        self.spin_ns = spin_ns
+        self._deadline_ns = 0
+        self._starts = 0  # incremented by start(): the deadlines restart from the clock
+        # planned vs actual onset of every stimulus (core.timing); written as CSV to
+        # timing_path at the end of the run and on close()
+        self.timing = OnsetRecorder()
+        self.timing_path = timing_path
+        self._head_start_ns = 0  # part of the next delay already elapsed before a resume
+        # auto-reconnect: None (off), "shift" or "keep"
+        self.reconnect = None
+        self._lost_ns = None
+        self._lost_scheduling = False
+        self._resume_on_reconnect = False
+        if reconnect is not None:
+            self.enable_reconnect(reconnect)
         self.__active = True
         self.thread = threading.Thread(target=self.__main_loop, daemon=True)
         self.thread.start()
@@ -92,8 +160,19 @@ class Experiment:
 
     @sequence.setter
     def sequence(self, value):
+        # stored as a tuple so a run can keep a reference to the plan instead of copying it
         with self._lock:
-            self._sequence = value
+            self._sequence = tuple(value)
+
+    @property
+    def channels(self):
+        """The "Channel" values the stimuli of the loaded plan use."""
+        return {event[4] for event in self.sequence if event[0] == self.__stimulus and event[4] is not None}
+
+    @property
+    def duration_s(self):
+        """Planned length of the loaded plan in seconds: the sum of its delays."""
+        return sum(event[2][1] for event in self.sequence if event[0] == self.__delay)
 
     @property
     def current_idx(self):
@@ -102,8 +181,10 @@ class Experiment:
 
     @current_idx.setter
     def current_idx(self, value):
-        with self._lock:
+        # seek: takes effect at the next start()
+        with self._changed:
             self._current_idx = value
+            self._changed.notify_all()
 
     @property
     def running(self):
@@ -112,21 +193,37 @@ class Experiment:
 
     @running.setter
     def running(self, value):
-        with self._lock:
+        with self._changed:
             self._running = value
+            self._changed.notify_all()
 
-    def __default_cb(self, x):
+    def __default_cb(self, *args):
         pass
 
     def close(self):
-        self.__active = False
-        self.running = False
+        with self._changed:
+            self.__active = False
+            self._running = False
+            self._changed.notify_all()
         self._stop_event.set()  # interrupt any ongoing delay
         self.thread.join(timeout=2.0)
-        self.arduino.disconnect()  # clean up serial connection
+        self.arduino.close()  # stop I/O threads and clean up serial connection
+        if self.timing.count:
+            self.__export_timing()
+        if self.stats_path:
+            try:
+                self.arduino.dump_stats(self.stats_path)
+            except OSError as e:
+                self.log_cb(f"Could not write link statistics to {self.stats_path}: {e}")
 
     def connect_arduino(self, path):
         self.arduino.connect(path)
+        if self.stimulus_table:
+            self.arduino.load_table(self.stimulus_table)
+
+    def start_trace(self, path):
+        # record every frame on the link to a binary trace file (core.wire_trace)
+        self.arduino.start_trace(path)
 
     def add_cb_log(self, cb):
         self.log_cb = cb
@@ -136,39 +233,233 @@ class Experiment:
 
     def start(self):
         self._stop_event.clear()  # reset stop event
-        self.running = True
+        with self._changed:
+            self._running = True
+            self._starts += 1
+            self._changed.notify_all()
 
     def stop(self):
-        with self._lock:
+        with self._changed:
             self._running = False
             self._current_idx = 0
+            self._stops += 1
+            self._head_start_ns = 0
+            self._resume_on_reconnect = False
+            self._changed.notify_all()
+        self.timing.reset()
         self._stop_event.set()  # interrupt any ongoing delay immediately
 
+    def wait_finished(self, timeout=None):
+        """Block until the run is over: the plan ended (after its last log lines), or
+        stop(), pause(), close() or a lost link without reconnect ended it.
+
+        Returns False if it is still running after timeout seconds.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: not self.__active or (
+                not self._running and not self._resume_on_reconnect and self._loop_idle.is_set()), timeout)
+
     def pause(self):
-        self.running = False
+        with self._changed:
+            self._running = False
+            self._resume_on_reconnect = False
+            self._changed.notify_all()
         self._stop_event.set()  # interrupt any ongoing delay
 
+    def enable_reconnect(self, resume="shift", timeout=None):
+        """Reconnect automatically after a link loss and resume the run.
+
+        While the link is down the run is suspended at current_idx (not
+        stopped). Once the device is back and the handshake is redone, a
+        running experiment resumes from the interrupted event:
+
+        - "shift": the rest of the plan is shifted by the outage. The
+          interrupted stimulus is sent again; an interrupted delay only
+          runs for the part that was left.
+        - "keep": the rest of the plan keeps its planned times. Stimuli
+          whose onset fell into the outage are logged as missed and
+          skipped; the run continues at the next event still ahead.
+
+        With device scheduling, stimuli already queued on the device keep
+        firing until the reconnect flushes its queue. Those due before the
+        loss count as played; the rest are resumed as above, so one that the
+        device fired during the outage can be played again with "shift"
+        (and be logged as missed with "keep").
+
+        The outage duration is logged. If timeout (seconds) passes without
+        a reconnect, the experiment is stopped and disconnect_cb is called.
+        """
+        if resume not in RESUME_POLICIES:
+            raise ValueError(f"Unknown resume policy '{resume}' (expected one of {', '.join(RESUME_POLICIES)})")
+        self.reconnect = resume
+        self.arduino.reconnect_cb = self.__on_reconnect
+        self.arduino.enable_reconnect(timeout=timeout)
+
     def __main_loop(self):
-        while self.__active:
-            with self._lock:
-                is_running = self._running
-                idx = self._current_idx
-                seq_len = len(self._sequence)
-                seq_copy = self._sequence[:]  # copy for safe iteration
+        """Play the plan while running; sleep on _changed otherwise.
 
-            if is_running and idx >= seq_len:
-                self.running = False
+        The plan is an immutable tuple, so each pass only takes a reference
+        to it: the cost per event does not depend on the plan length.
+        """
+        starts = 0
+        while True:
+            with self._changed:
+                while self.__active and not self._running:
+                    if not self._loop_idle.is_set():
+                        self._loop_idle.set()
+                        self._changed.notify_all()  # wakes wait_finished()
+                    self._changed.wait()
+                if not self.__active:
+                    return
+                self._loop_idle.clear()
+                sequence = self._sequence
+                idx = self._current_idx
+                if idx >= len(sequence):
+                    self._running = False
+                restarted, starts = starts != self._starts, self._starts
+            if restarted:
+                # started or resumed: the plan continues from now
+                self._deadline_ns = self.clock.now_ns()
+
+            if idx >= len(sequence):
                 self.log_cb("End of experiment")
-            elif is_running:
+                if self.timing.count:
+                    self.log_cb(self.timing.summary())
+                    self.__export_timing()
+            elif self.device_scheduling and self.arduino.schedule_supported:
+                self.__run_scheduled(idx, sequence)
+            else:
                 self.event_cb(idx)
-                seq_copy[idx][0](seq_copy[idx][2])
+                event = sequence[idx]
+                self._event_start_ns = planned_ns = self._deadline_ns
+                dispatch_ns = self.clock.now_ns()
+                handle = event[0](*event[2:])
+                if handle is not None:  # a stimulus that was sent
+                    # write times are host clock times; on a simulated clock the write is instantaneous
+                    self.timing.record(idx, planned_ns, dispatch_ns, None if self.clock.simulated else handle)
                 # check if still running after execution (might have been stopped)
                 with self._lock:
                     if self._running:
                         self._current_idx += 1
-            else:
-                time.sleep(0.1)
     
+    def __run_scheduled(self, start, sequence):
+        """Play sequence[start:] with every onset timed by the device.
+
+        Delays only move the planned onset time forward. Stimuli are
+        scheduled on the device up to lookahead stimuli ahead of the last
+        confirmed one, and the firmware fires them from its timer interrupt, so
+        host load and USB latency do not affect the intervals. Events are
+        logged, reported to event_cb and reflected in current_idx in order as
+        the device acks them, not as they are scheduled. Pause and stop flush
+        the device queue; a pause resumes at the first stimulus that had not fired.
+        """
+        stops = self._stops
+        onset_ns = time.perf_counter_ns() + SCHEDULE_LEAD_NS
+        head_start, self._head_start_ns = self._head_start_ns, 0
+        in_flight = collections.deque()  # (idx, event, handle or None for delays, planned onset)
+        scheduled = 0  # stimuli in in_flight
+        idx = start
+        while idx < len(sequence) and not self._stop_event.is_set():
+            event = sequence[idx]
+            if event[0] == self.__stimulus:
+                while scheduled >= self.lookahead and self.__confirm(in_flight[0]):
+                    if in_flight.popleft()[2] is not None:
+                        scheduled -= 1
+                if self._stop_event.is_set():
+                    break
+                try:
+                    in_flight.append((idx, event, self.__schedule(event, onset_ns), onset_ns))
+                    scheduled += 1
+                except queue.Full:
+                    self.log_cb(f"stimulus dropped (writer queue full, depth {self.arduino.queue_depth}): {event[2]}")
+                except serial.SerialException:
+                    break  # reported through ArduinoCom.disconnect_cb (__on_link_lost)
+                except Exception as e:
+                    self.log_cb(f"stimulus error: {e}")
+                    self.stop()
+                    break
+            else:
+                in_flight.append((idx, event, None, onset_ns - head_start))
+                onset_ns += int(event[2][1] * 1e9) - head_start
+            head_start = 0
+            idx += 1
+        while in_flight and self.__confirm(in_flight[0]):
+            in_flight.popleft()
+        if in_flight:
+            # paused or stopped: drop what the device has not fired yet
+            self.arduino.flush_schedule()
+            # resume after the last stimulus that fired
+            fired = [k for k, entry in enumerate(in_flight) if entry[2] is not None and entry[2].ack_ns is not None]
+            k = fired[-1] + 1 if fired else 0
+            lost_ns = self._lost_ns
+            if lost_ns is not None:
+                # link lost: what was due before that was queued on the device and fired unconfirmed
+                while k < len(in_flight) and self.__due_before(in_flight[k], lost_ns):
+                    k += 1
+            resume, planned_ns = (in_flight[k][0], in_flight[k][3]) if k < len(in_flight) else (idx, onset_ns)
+            with self._lock:
+                if self._stops == stops:  # stop() resets current_idx to 0
+                    self._current_idx = resume
+                    self._event_start_ns = planned_ns
+        else:
+            if not self._stop_event.is_set():
+                # let the last delay run out before the end of the experiment is reported
+                self._stop_event.wait(max(0, onset_ns - time.perf_counter_ns()) / 1e9)
+            with self._lock:
+                if self._stops == stops:
+                    self._current_idx = idx  # everything scheduled has fired
+
+    def __due_before(self, entry, t_ns):
+        _, event, handle, planned_ns = entry
+        if handle is None:
+            return planned_ns + int(event[2][1] * 1e9) <= t_ns
+        return planned_ns <= t_ns and handle.done() and handle.error is None
+
+    def __compatible(self, frame):
+        # Firmware without MULTI frames gets the channels as separate frames
+        if frame[1] == ord(MULTI) and not self.arduino.multi_supported:
+            return split_multi(frame)
+        return (frame,)
+
+    def __schedule(self, event, onset_ns):
+        frame = event[5] if event[5] is not None and self.arduino.table_loaded else event[3]
+        for part in self.__compatible(frame):  # all at one onset; the last handle confirms the event
+            handle = self.arduino.schedule(part, onset_ns, channel=event[4])  # routed by a DeviceGroup
+        return handle
+
+    def __confirm(self, entry):
+        """Wait for the next in-flight event to happen and log it.
+
+        Returns False (entry not consumed) if the experiment was paused or stopped.
+        """
+        idx, event, handle, planned_ns = entry
+        if handle is None:
+            # delay: starts when the stimulus before it fires
+            if self._stop_event.wait(max(0, planned_ns - time.perf_counter_ns()) / 1e9):
+                return False
+            self.__fired(idx)
+            self.log_cb(f"delay: {event[2][1]}")
+            return True
+        deadline_ns = planned_ns + SCHEDULE_GRACE_NS
+        while not handle.wait_ack(0.05):
+            if self._stop_event.is_set():
+                return False
+            if handle.lost or time.perf_counter_ns() > deadline_ns:
+                self.log_cb(f"stimulus not confirmed by the device: {event[2]}")
+                return True
+        if handle.onset_ns is not None:
+            self.timing.record(idx, planned_ns, handle.onset_ns, handle)  # the device onset as dispatch time
+        self.__fired(idx)
+        self.log_cb("stimulus: " + str(event[2]))
+        return True
+
+    def __fired(self, idx):
+        # A device-scheduled event happened: it becomes the current one
+        with self._lock:
+            if self._running:
+                self._current_idx = idx
+        self.event_cb(idx)
+
     def __read_type(self, rules):
         if not isinstance(rules, dict) or "Type" not in rules:
             raise ValueError("Invalid rule: missing 'Type' field")
@@ -254,8 +545,35 @@ class Experiment:
             else:
                 raise ValueError(f"Unknown stimulus type: {fb_type}")
 
-            arr.append([self.__stimulus, fb_type, signal])
-        return arr
+            # Encode the wire frame now so playback only has to write bytes
+            arr.append([self.__stimulus, fb_type, signal, encode_signal(signal), fb.get("Channel")])
+        return self.__merge_channels(arr)
+
+    def __merge_channels(self, items):
+        """Combine the items of one stimulus that go to the same channel into one MULTI frame.
+
+        The firmware starts every command of a MULTI frame at the same
+        micros(), so the channels have no onset skew; separate frames would
+        start one write apart. Items that do not fit one frame are kept separate
+        and reported by from_dict().
+        """
+        groups = {}
+        for item in items:
+            groups.setdefault(item[4], []).append(item)
+        merged = []
+        for channel, group in groups.items():
+            if len(group) == 1:
+                merged += group
+                continue
+            try:
+                frame = encode_multi([item[3] for item in group])
+            except ValueError:
+                self._unmerged.add(("+".join(item[1] for item in group), channel))
+                merged += group
+                continue
+            merged.append([self.__stimulus, "+".join(item[1] for item in group),
+                           (MULTI,) + tuple(item[2] for item in group), frame, channel])
+        return merged
     
     def __read_delay(self, rules):
         if "Duration" not in rules:
@@ -456,24 +774,131 @@ class Experiment:
 
         return items
 
-    def __stimulus(self, signal):
-        # Stimulus logic
+    def __stimulus(self, signal, frame, channel=None, trigger=None):
+        # Stimulus logic; returns the write handle of the last frame, None if not sent
+        if trigger is not None and self.arduino.table_loaded:
+            frame = trigger  # the device holds this stimulus: send its table index only
+        handle = None
         try:
-            self.arduino.send_signal(signal)
+            for part in self.__compatible(frame):
+                handle = self.arduino.submit(part, channel=channel)  # routed by a DeviceGroup
             self.log_cb("stimulus: " + str(signal))
-        except serial.SerialException as e:
-            self.log_cb(f"stimulus error (disconnected): {e}")
-            self.stop()
-            self.disconnect_cb()  # Notify UI of disconnection
+        except queue.Full:
+            self.log_cb(f"stimulus dropped (writer queue full, depth {self.arduino.queue_depth}): {signal}")
+        except serial.SerialException:
+            pass  # reported through ArduinoCom.disconnect_cb (__on_link_lost)
         except Exception as e:
             self.log_cb(f"stimulus error: {e}")
             self.stop()
-    
+        else:
+            return handle
+        return None
+
+    def __on_link_lost(self, error):
+        # Called by ArduinoCom (any thread) when the device is unplugged or a write fails
+        if self.reconnect is None:
+            self.log_cb(f"stimulus error (disconnected): {error}")
+            self.stop()
+            self.disconnect_cb()  # Notify UI of disconnection
+            return
+        # suspend at the interrupted event until __on_reconnect
+        with self._lock:
+            if self._lost_ns is None:
+                self._lost_ns = self.clock.now_ns()
+                self._resume_on_reconnect = self._running
+                self._lost_scheduling = self.device_scheduling and self.arduino.schedule_supported
+            self._running = False
+        self._stop_event.set()
+        self.log_cb(f"link lost ({error}), reconnecting")
+
+    def __on_reconnect(self, outage_ns):
+        # Called from the ArduinoCom reconnect thread once the device answered the handshake again
+        if outage_ns is None:
+            self.log_cb("reconnect failed, experiment stopped")
+            self._lost_ns = None
+            self.stop()
+            self.disconnect_cb()
+            return
+        self.log_cb(f"reconnected after an outage of {outage_ns / 1e9:.3f} s")
+        self._loop_idle.wait(timeout=5.0)  # let the interrupted event wind down
+        if self._lost_scheduling:
+            # the clock mapping starts over after a reconnect; scheduling needs it
+            deadline = time.monotonic() + RESYNC_TIMEOUT
+            while not self.arduino.schedule_supported and time.monotonic() < deadline:
+                time.sleep(0.01)
+        with self._lock:
+            lost_ns, self._lost_ns = self._lost_ns, None
+            if not self._resume_on_reconnect or self._running or lost_ns is None:
+                return  # paused, stopped or restarted by the operator meanwhile
+            self._resume_on_reconnect = False
+            idx, self._head_start_ns, missed = self.__resume_point(self._current_idx, self._sequence, lost_ns)
+            self._current_idx = idx
+            sequence = self._sequence
+        for i in missed:
+            self.log_cb(f"stimulus missed during outage: {sequence[i][2]}")
+        self.log_cb(f"resuming at event {idx} ({self.reconnect} schedule)")
+        self.start()
+
+    def __resume_point(self, idx, sequence, lost_ns):
+        """Where to resume after an outage: (index, head start of the delay there in ns, missed indices)."""
+        start_ns = self._event_start_ns if self._event_start_ns is not None else lost_ns
+        interrupted_delay = idx < len(sequence) and sequence[idx][0] == self.__delay
+        if self.reconnect == "shift":
+            elapsed = lost_ns - start_ns if interrupted_delay else 0
+        else:
+            elapsed = self.clock.now_ns() - start_ns
+        missed = []
+        while idx < len(sequence) and elapsed > 0:
+            event = sequence[idx]
+            if event[0] == self.__delay:
+                duration_ns = int(event[2][1] * 1e9)
+                if elapsed < duration_ns:
+                    break
+                elapsed -= duration_ns
+            else:
+                missed.append(idx)
+            idx += 1
+        if idx >= len(sequence) or sequence[idx][0] != self.__delay:
+            elapsed = 0
+        return idx, max(0, elapsed), missed
+
+    def __on_ack(self, handle):
+        # Called from the ArduinoCom reader thread for every sequenced frame
+        if handle.lost:
+            self.log_cb(f"stimulus not acknowledged: seq {handle.seq} after {handle.attempts} attempt(s)")
+            return
+        # rtt is unknown when the ack arrives while the frame is being retransmitted
+        rtt = "n/a" if handle.rtt_ns is None else f"{handle.rtt_ns / 1e6:.3f} ms"
+        if handle.onset_ns is not None:
+            onset = perf_to_wall(handle.onset_ns)
+            self.log_cb(f"ack: seq {handle.seq} rtt {rtt} device_us {handle.device_us} onset {onset:.6f}")
+        else:
+            self.log_cb(f"ack: seq {handle.seq} rtt {rtt} device_us {handle.device_us}")
+
     def __delay(self, value):
         delay_seconds = value[1]
         self.log_cb(f"delay: {delay_seconds}")
-        # Use event.wait() for interruptible delay - returns immediately if stop_event is set
-        self._stop_event.wait(timeout=delay_seconds)
+        head_start, self._head_start_ns = self._head_start_ns, 0  # resumed after an outage
+        self._deadline_ns += int(delay_seconds * 1e9) - head_start
+        # sleep then spin (SystemClock.wait_until); stop() and pause() interrupt it
+        self.clock.wait_until(self._deadline_ns, self._stop_event, self.spin_ns)
+
+    def drift_report(self):
+        """Onsets since the last stop(), with their mean and max lateness and the lateness of the last one (ms)."""
+        stats = self.timing.stats()
+        return {
+            "onsets": stats["events"],
+            "mean_ms": stats["mean_lateness_ms"] or 0.0,
+            "max_ms": self.timing.max_late_ns / 1e6 if stats["events"] else 0.0,
+            "drift_ms": stats["drift_ms"] or 0.0,
+        }
+
+    def __export_timing(self):
+        if self.timing_path:
+            try:
+                self.timing.export(self.timing_path)
+            except OSError as e:
+                self.log_cb(f"Could not write onset timing to {self.timing_path}: {e}")
     
     def from_json(self, path):
         # Load experiment from json file
@@ -492,8 +917,34 @@ class Experiment:
         rules = self.__normalize(rules)
         # Validate schema first (catches errors before playback)
         self.__validate_schema(rules)
-        self.sequence = self.__read_type(rules)
+        self._unmerged.clear()
+        sequence = self.__read_type(rules)
+        for names, channel in sorted(self._unmerged, key=str):
+            on = "" if channel is None else f" on channel {channel}"
+            self.log_cb(f"warning: stimulus {names}{on} does not fit one multi-channel frame "
+                        f"({MULTI_MAX_PAYLOAD} bytes): its commands start one write apart")
+        self.stimulus_table = self.__build_table(sequence)
+        self.sequence = sequence
         self.current_idx = 0
+        self.timing.reset()
+        if self.stimulus_table and self.arduino.is_connected():
+            self.arduino.load_table(self.stimulus_table)
+
+    def __build_table(self, sequence):
+        """Deduplicate stimulus frames into the device stimulus table.
+
+        Each stimulus event gets the trigger frame of its table entry appended.
+        If there are more distinct frames than table slots, the most frequent
+        ones are stored and the rest keep sending full frames.
+        """
+        stimuli = [event for event in sequence if event[0] == self.__stimulus]
+        # MULTI frames are longer than a table slot and are always sent in full
+        counts = collections.Counter(event[3] for event in stimuli if chr(event[3][1]) in SIGNAL_TYPES)
+        table = [frame for frame, _ in counts.most_common(TABLE_SIZE)]
+        triggers = {frame: encode_trigger(i) for i, frame in enumerate(table)}
+        for event in stimuli:
+            event.append(triggers.get(event[3]))
+        return table
 
     def __normalize(self, obj):
         """Recursively normalize dictionary keys and type values to canonical form.
@@ -603,6 +1054,10 @@ class Experiment:
 
         fb_type = fb["Type"]
 
+        channel = fb.get("Channel")
+        if channel is not None and (isinstance(channel, bool) or not isinstance(channel, (str, int))):
+            raise ValueError(f"stimulus item 'Channel' must be a name or a number at {path}")
+
         if fb_type == "Buzzer":
             if "Amplitude" not in fb:
                 raise ValueError(f"Buzzer missing 'Amplitude' at {path}")
@@ -0,0 +1,98 @@
+"""Run an experiment file on a simulated clock, without waiting for its delays.
+
+The plan is played by Experiment as in a session, with its callbacks and
+log, into a VirtualBsense on an in-process loop:// link, but on a
+SimulatedClock (core.clock): every wait jumps to its deadline, so a
+40-minute protocol runs in the time the scheduler, the writes and the
+emulator take. The device decodes each frame at the simulated time it was
+written, so the command timeline and the session log times are the planned
+ones. Host overhead is not simulated (onsets are never late): use this
+to review a protocol's structure and duration, not its timing jitter.
+
+Run from app/python:
+    python -m core.fast_forward experiment.json [-v]
+
+-v prints the session log with simulated times. A run that stops before
+its end (e.g. a stimulus error) is reported as such.
+"""
+import collections
+import logging
+import sys
+import threading
+import time
+
+from core.clock import SimulatedClock
+from core.experiment import Experiment
+from core.virtual_device import VirtualBsense
+
+# What a fast-forwarded run did: simulated duration, session log as
+# (t_ns, text) pairs, the VirtualBsense commands (recv_ns from the run start),
+# onset timing stats (core.timing), the real time the run took and whether
+# the plan played to its end
+FastForwardResult = collections.namedtuple("FastForwardResult", "duration_ns log commands timing wall_s completed")
+
+TIMEOUT = 600.0  # real seconds a fast-forwarded run may take
+
+
+def fast_forward(rules, timeout=TIMEOUT):
+    """Play rules (an experiment dict or a JSON path) on a simulated clock; returns a FastForwardResult.
+
+    Raises TimeoutError if the run is still going after timeout real seconds.
+    """
+    clock = SimulatedClock()
+    device = VirtualBsense("loop", clock=clock)
+    port = device.start()
+    clock.add_settle(device.idle)
+    exp = Experiment(clock=clock)
+    log = []
+    ended = threading.Event()
+
+    def on_log(text):
+        log.append((clock.now_ns(), text))
+        if text == "End of experiment":
+            ended.set()
+
+    exp.add_cb_log(on_log)
+    wall = time.perf_counter()
+    try:
+        exp.connect_arduino(port)
+        if isinstance(rules, str):
+            exp.from_json(rules)
+        else:
+            exp.from_dict(rules)
+        start_ns = clock.now_ns()
+        exp.start()
+        # ends with the plan, or earlier if a stimulus error or a lost link stops the run
+        if not exp.wait_finished(timeout):
+            raise TimeoutError(f"Fast-forwarded run still going after {timeout} s")
+        clock.settle()
+    finally:
+        exp.close()  # lets the end-of-run summary be logged
+        device.stop()
+    return FastForwardResult(
+        duration_ns=clock.now_ns() - start_ns,
+        log=[(t_ns - start_ns, text) for t_ns, text in log if t_ns >= start_ns],
+        commands=[c._replace(recv_ns=c.recv_ns - start_ns) for c in device.commands],
+        timing=exp.timing.stats(),
+        wall_s=time.perf_counter() - wall,
+        completed=ended.is_set(),
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = sys.argv[1:]
+    verbose = "-v" in args
+    paths = [a for a in args if a != "-v"]
+    if len(paths) != 1:
+        print(__doc__)
+        sys.exit(2)
+    result = fast_forward(paths[0])
+    if verbose:
+        for t_ns, text in result.log:
+            print(f"{t_ns / 1e9:12.6f} s  {text}")
+    print(f"{len(result.commands)} device commands, plan duration {result.duration_ns / 1e9:.3f} s, "
+          f"simulated in {result.wall_s:.3f} s")
+    if not result.completed:
+        print("run stopped before the end of the plan (see the log with -v)")
+        sys.exit(1)
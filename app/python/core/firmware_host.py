@@ -0,0 +1,258 @@
+"""The device firmware compiled for Linux and driven through a pipe.
+
+build_firmware() compiles teensyScript.ino (or the older arduino.ino) with
+the mock Arduino API in code/host/: micros() runs on a simulated clock,
+interval timers fire between loop() passes, Serial is a pipe to this
+process and every pin write is reported with its simulated time. The same
+firmware source as on the board is used, with function prototypes added
+the way the Arduino builder does.
+
+FirmwareHost runs the binary and advances it explicitly, so runs are
+deterministic: frames go in with send(), run(us) simulates that much device
+time, and the replies (frames), pin timeline (pins) and host CPU cost of
+loop() and the timer handlers come back.
+
+Example:
+    with FirmwareHost() as fw:
+        fw.send(encode_signal(('v', 1.0, 170, 100)))
+        fw.run(200_000)
+        print(fw.timeline(PIN_VIB1_PWM, "a"))
+
+Build from app/python (needs a C++ compiler, g++ or clang++):
+    python -m core.firmware_host [teensy|arduino]
+"""
+import collections
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+
+from core.protocol import FrameParser
+
+logger = logging.getLogger(__name__)
+
+CODE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))))), "code")
+HOST_DIR = os.path.join(CODE_DIR, "host")
+BUILD_DIR = os.path.join(HOST_DIR, "build")
+SKETCHES = {
+    "teensy": os.path.join(CODE_DIR, "teensyScript", "teensyScript.ino"),
+    "arduino": os.path.join(CODE_DIR, "arduino", "arduino.ino"),
+}
+HOST_SOURCES = ("Arduino.h", "TimerInterrupt.h", "host_main.cpp")
+
+# teensyScript.ino pins
+PIN_TRIG = 2
+PIN_VIB1_PWM = 0
+PIN_VIB1_PH = 1
+PIN_BUZZER_TONE = 4
+PIN_BUZZER_AMP = 3
+PIN_LED = 13
+
+# A pin output change: kind is "d" (digital), "a" (PWM duty), "f" (PWM frequency) or "t" (tone)
+PinEvent = collections.namedtuple("PinEvent", "t_us pin kind value")
+# A frame written by the firmware, with the simulated time of its last byte
+DeviceFrame = collections.namedtuple("DeviceFrame", "t_us source payload")
+# What one run() did: loop() passes and host CPU time, the passes that read
+# Serial input (busy), and the timer handler calls
+RunStats = collections.namedtuple("RunStats", "t_us loops loop_ns busy_loops busy_ns isr_calls isr_ns")
+
+# Function definition at the start of a line: return type, name, parameters
+_FUNCTION = re.compile(r"^([A-Za-z_][\w\s\*&]*?[\s\*&])([A-Za-z_]\w*)\s*\(([^;{}()]*)\)\s*(//.*)?$")
+
+
+def find_compiler():
+    """The C++ compiler to build with ($CXX, g++, clang++ or c++), or None."""
+    if os.environ.get("CXX"):
+        return os.environ["CXX"]
+    for name in ("g++", "clang++", "c++"):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def add_prototypes(source):
+    """Insert a prototype for every function before the first definition, like the Arduino builder.
+
+    #line directives keep compiler messages pointing at the .ino lines.
+    """
+    lines = source.splitlines()
+    prototypes = []
+    first = None
+    for i, line in enumerate(lines):
+        match = _FUNCTION.match(line)
+        if not match or match.group(2) in ("setup", "loop"):
+            continue
+        following = lines[i + 1].strip() if i + 1 < len(lines) else ""
+        if not (following.startswith("{") or line.rstrip().endswith("{")):
+            continue
+        prototypes.append(f"{match.group(1).strip()} {match.group(2)}({match.group(3).strip()});")
+        if first is None:
+            first = i
+    if first is None:
+        return source
+    return "\n".join(lines[:first] + prototypes + [f"#line {first + 1}"] + lines[first:]) + "\n"
+
+
+def build_firmware(firmware="teensy", force=False, defines=None):
+    """Compile a firmware with the host harness; returns the executable path.
+
+    defines ({name: value}) are passed to the compiler, e.g.
+    {"VIB1_WAVEFORM": "WAVE_SINE"}; each set of defines gets its own
+    executable. The build is skipped when the executable is newer than the
+    sketch and the harness sources. Raises RuntimeError without a compiler
+    or on a compile error.
+    """
+    if firmware not in SKETCHES:
+        raise ValueError(f"Unknown firmware '{firmware}' (expected one of {', '.join(SKETCHES)})")
+    sketch = SKETCHES[firmware]
+    defines = sorted((defines or {}).items())
+    name = "_".join([firmware] + [f"{key}-{value}" for key, value in defines])
+    binary = os.path.join(BUILD_DIR, f"bsense_{name}")
+    sources = [sketch] + [os.path.join(HOST_DIR, name) for name in HOST_SOURCES]
+    if (not force and os.path.exists(binary)
+            and os.path.getmtime(binary) >= max(os.path.getmtime(s) for s in sources)):
+        return binary
+    compiler = find_compiler()
+    if compiler is None:
+        raise RuntimeError("No C++ compiler found (set CXX or install g++ / clang++)")
+
+    os.makedirs(BUILD_DIR, exist_ok=True)
+    with open(sketch) as f:
+        code = add_prototypes(f.read())
+    sketch_cpp = os.path.join(BUILD_DIR, f"{name}_sketch.cpp")
+    with open(sketch_cpp, "w") as f:
+        f.write('#include "Arduino.h"\n')
+        # Teensy and AVR longs are 32 bits: keep micros() arithmetic wrapping like on the board
+        f.write("#define long int\n")
+        f.write(f'#line 1 "{sketch}"\n')
+        f.write(code)
+    command = ([compiler, "-std=c++11", "-O2", "-Wall", "-Wno-cpp", "-I", HOST_DIR]
+               + [f"-D{key}={value}" for key, value in defines]
+               + [sketch_cpp, os.path.join(HOST_DIR, "host_main.cpp"), "-o", binary])
+    result = subprocess.run(command, capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"Building the {firmware} firmware failed:\n{result.stderr}")
+    if result.stderr:
+        logger.info(result.stderr.strip())
+    return binary
+
+
+class FirmwareHost:
+    """A firmware build running on the simulated clock.
+
+    loop_ns and micros_ns are the simulated cost of one loop() pass and of
+    one micros() call; start_us is the clock at boot (set it near 2**32 to
+    exercise the micros() wraparound). defines selects firmware build
+    options, see build_firmware().
+    """
+
+    def __init__(self, firmware="teensy", loop_ns=1000, micros_ns=50, start_us=0, defines=None):
+        self.firmware = firmware
+        self.defines = defines
+        self.loop_ns = loop_ns
+        self.micros_ns = micros_ns
+        self.start_us = start_us
+        self.frames = []     # DeviceFrames, in order
+        self.pins = []       # PinEvents, in order
+        self.now_us = start_us
+        self._parser = FrameParser()
+        self._process = None
+
+    def start(self):
+        """Build if needed, boot the firmware and run setup()."""
+        binary = build_firmware(self.firmware, defines=self.defines)
+        self._process = subprocess.Popen(
+            [binary, "-l", str(self.loop_ns), "-m", str(self.micros_ns), "-t", str(self.start_us)],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        return self.__read_until_done()
+
+    def stop(self):
+        if self._process is None:
+            return
+        try:
+            self._process.stdin.write("quit\n")
+            self._process.stdin.close()
+        except (BrokenPipeError, OSError):
+            pass
+        try:
+            self._process.wait(timeout=2.0)
+        except subprocess.TimeoutExpired:
+            self._process.kill()
+            self._process.wait()
+        self._process.stdout.close()
+        self._process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def send(self, data):
+        """Bytes arriving on the device's Serial port (read on the next loop() passes)."""
+        if data:
+            self.__command(f"rx {bytes(data).hex()}")
+
+    def set_dtr(self, state):
+        """Open (True) or close the port from the host side."""
+        self.__command(f"dtr {int(bool(state))}")
+
+    def run(self, us):
+        """Simulate us microseconds; returns the RunStats of that stretch."""
+        self.__command(f"run {int(us)}")
+        return self.__read_until_done()
+
+    def run_until(self, t_us):
+        """Simulate up to device time t_us (no-op if already past)."""
+        return self.run(max(0, t_us - self.now_us))
+
+    def timeline(self, pin, kind="d", since_us=0):
+        """(t_us, value) changes of one pin output, from device time since_us on."""
+        return [(e.t_us, e.value) for e in self.pins if e.pin == pin and e.kind == kind and e.t_us >= since_us]
+
+    def pin_value(self, pin, t_us, kind="d"):
+        """Value of a pin output at device time t_us (None before the first write)."""
+        value = None
+        for event in self.pins:
+            if event.t_us > t_us:
+                break
+            if event.pin == pin and event.kind == kind:
+                value = event.value
+        return value
+
+    def __command(self, line):
+        if self._process is None:
+            raise RuntimeError("Firmware not started")
+        self._process.stdin.write(line + "\n")
+
+    def __read_until_done(self):
+        while True:
+            line = self._process.stdout.readline()
+            if not line:
+                raise RuntimeError(f"{self.firmware} firmware exited (code {self._process.poll()})")
+            kind, _, rest = line.rstrip("\n").partition(" ")
+            if kind == "tx":
+                t_us, data = rest.split(" ")
+                for source, payload in self._parser.feed(bytes.fromhex(data)):
+                    self.frames.append(DeviceFrame(int(t_us), source, payload))
+            elif kind == "pin":
+                t_us, pin, pin_kind, value = rest.split(" ")
+                self.pins.append(PinEvent(int(t_us), int(pin), pin_kind, int(value)))
+            elif kind == "done":
+                stats = RunStats(*(int(v) for v in rest.split(" ")))
+                self.now_us = stats.t_us
+                return stats
+            elif kind == "err":
+                raise RuntimeError(f"Firmware harness: {rest}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    names = sys.argv[1:] or list(SKETCHES)
+    for name in names:
+        print(build_firmware(name, force=True))
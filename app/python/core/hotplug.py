@@ -0,0 +1,120 @@
+"""Hot-unplug detection for serial device nodes.
+
+HotplugMonitor watches the directory holding a device node (e.g. /dev for
+/dev/ttyACM0) with inotify and calls a callback as soon as the node is
+removed, which the kernel/udev does the moment the USB cable is pulled.
+This needs Linux; elsewhere start() returns False and callers rely on read
+errors from the port instead.
+"""
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+
+logger = logging.getLogger(__name__)
+
+IN_MOVED_FROM = 0x00000040
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len (followed by len bytes of name)
+
+
+def _load_libc():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1  # check the symbols exist
+        libc.inotify_add_watch
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+_libc = _load_libc()
+
+
+def inotify_available():
+    return _libc is not None
+
+
+class HotplugMonitor:
+    def __init__(self, path, on_removed):
+        """
+        Args:
+            path: Device node to watch (symlinks such as /dev/serial/by-id/... are resolved)
+            on_removed: Called once, from the monitor thread, with the path when the node disappears
+        """
+        self.path = path
+        self.on_removed = on_removed
+        self._fd = None
+        self._wake_r = None
+        self._wake_w = None
+        self._thread = None
+
+    def start(self):
+        """Start watching. Returns False if inotify cannot watch this path."""
+        if _libc is None or self._thread is not None:
+            return False
+        node = os.path.realpath(self.path)
+        directory, self._name = os.path.split(node)
+        if not os.path.exists(node):
+            return False  # not a device node (e.g. COM3) or already gone
+        fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return False
+        if _libc.inotify_add_watch(fd, directory.encode(), IN_DELETE | IN_MOVED_FROM) < 0:
+            logger.debug(f"inotify cannot watch {directory}: errno {ctypes.get_errno()}")
+            os.close(fd)
+            return False
+        if not os.path.exists(node):
+            # removed before the watch was in place
+            os.close(fd)
+            self.on_removed(self.path)
+            return True
+        self._fd = fd
+        self._wake_r, self._wake_w = os.pipe()
+        self._thread = threading.Thread(target=self.__loop, daemon=True)
+        self._thread.start()
+        return True
+
+    def stop(self):
+        if self._thread is None:
+            return
+        os.write(self._wake_w, b"x")
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=2.0)
+        self._thread = None
+        for fd in (self._fd, self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fd = self._wake_r = self._wake_w = None
+
+    def __loop(self):
+        fd, wake = self._fd, self._wake_r
+        while True:
+            ready, _, _ = select.select([fd, wake], [], [])
+            if wake in ready:
+                return
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                continue
+            except OSError:
+                return
+            offset = 0
+            while offset + _EVENT.size <= len(data):
+                _, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size:offset + _EVENT.size + length].rstrip(b"\0").decode(errors="replace")
+                offset += _EVENT.size + length
+                if name == self._name:
+                    self.on_removed(self.path)
+                    return
@@ -0,0 +1,315 @@
+"""Bsense serial protocol encoding.
+
+Every frame sent to the device has the layout:
+
+    [0xaa] [source] [len] [payload...]
+
+The functions here turn signal tuples into ready-to-write frames so that
+encoding can be done once, when an experiment is loaded, instead of on the
+critical path right before a stimulus onset.
+"""
+import struct
+
+START_CHAR = 0xaa
+
+# Signal sources understood by the firmware
+SIGNAL_TYPES = ('v', 'w', 'b', 'c')
+
+# Host -> device: a command wrapped with a sequence number, [seq:2][cmd:1][payload]
+SEQUENCED = 'q'
+# Device -> host: acknowledgement of a sequenced command, [seq:2][onset micros:4]
+ACK = 'k'
+SEQ_MODULO = 1 << 16
+# Host -> device: clock sync ping, [token:2]
+PING = 'p'
+# Device -> host: reply to a ping, [token:2][micros:4]
+PONG = 'o'
+
+# Host -> device: ask for the ready banner
+IDENTIFY = 'i'
+# Device -> host: ready banner, [protocol version:1][firmware version, ascii]
+READY = 'r'
+# Host -> device: store a stimulus in the device table, [index:1][cmd:1][payload]
+TABLE_ENTRY = 't'
+# Host -> device: run a stored stimulus, [index:1]
+TRIGGER = 'x'
+TABLE_SIZE = 128  # entries in the firmware stimulus table
+
+# Host -> device: run a command at a device time, [seq:2][onset micros:4][cmd:1][payload]
+# (acknowledged with an ACK frame when it fires)
+SCHEDULED = 's'
+# Host -> device: drop every scheduled command not fired yet
+FLUSH = 'f'
+# Device -> host: reply to FLUSH, [number of commands dropped:1]
+FLUSHED = 'd'
+SCHEDULE_SIZE = 32  # entries in the firmware schedule ring buffer
+
+# Host -> device: several stimulus commands started together at one onset,
+# [count:1] then [cmd:1][len:1][payload] per command
+MULTI = 'm'
+MULTI_MAX_PAYLOAD = 24  # largest payload the firmware schedule can hold (three 'v'/'w'/'b' commands)
+
+# Host -> device: ask for the frame parser counters
+COUNTERS_REQUEST = 'g'
+# Device -> host: [frames:4][malformed:4][dropped:4][skipped bytes:4]
+COUNTERS = 'n'
+
+# Protocol version implemented by this host code (1 = original fire-and-forget commands)
+PROTOCOL_VERSION = 6
+# First protocol version with the stimulus table (TABLE_ENTRY / TRIGGER)
+TABLE_PROTOCOL = 3
+# First protocol version with device-side scheduling (SCHEDULED / FLUSH)
+SCHEDULE_PROTOCOL = 4
+# First protocol version with multi-channel frames (MULTI)
+MULTI_PROTOCOL = 5
+# First protocol version with the non-blocking parser and its counters (COUNTERS_REQUEST)
+COUNTERS_PROTOCOL = 6
+
+_ACK = struct.Struct('<HI')
+_SCHEDULED = struct.Struct('<HI')  # seq, onset micros
+_PONG = struct.Struct('<HI')
+_COUNTERS = struct.Struct('<IIII')
+COUNTER_NAMES = ("frames", "malformed", "dropped", "skipped_bytes")
+
+_SINGLE = struct.Struct('<BHH')      # amp, freq, duration
+_COMBINED = struct.Struct('<BHHBHH')  # ampV, freqV, durV, ampB, freqB, durB
+
+
+def amplitude_to_byte(amp):
+    """Scale an amplitude in 0.0-1.0 to the 0-255 wire range (clamped)."""
+    return int(max(0, min(255, amp * 255)))
+
+
+def validate_signal(signal):
+    """Check a signal tuple has a known source and enough elements.
+
+    Raises:
+        ValueError: if the signal is malformed
+    """
+    if not isinstance(signal, (tuple, list)) or len(signal) < 1:
+        raise ValueError("Signal must be a tuple/list with at least 1 element")
+    if signal[0] not in SIGNAL_TYPES:
+        raise ValueError(f"Invalid signal type: {signal[0]}")
+    if signal[0] in ('v', 'w', 'b') and len(signal) < 4:
+        raise ValueError(f"Signal type '{signal[0]}' requires 4 elements (type, amp, freq, dur)")
+    if signal[0] == 'c' and len(signal) < 7:
+        raise ValueError("Signal type 'c' requires 7 elements (type, ampV, freqV, durV, ampB, freqB, durB)")
+
+
+def encode_frame(source, payload):
+    """Wrap a payload with the start byte, source and length header."""
+    if len(payload) > 255:
+        raise ValueError(f"Payload too long for a single frame: {len(payload)} bytes")
+    return bytes((START_CHAR, ord(source), len(payload))) + bytes(payload)
+
+
+def encode_payload(signal):
+    """Encode the payload bytes of a signal tuple (without the header)."""
+    validate_signal(signal)
+    try:
+        if signal[0] == 'c':
+            return _COMBINED.pack(amplitude_to_byte(signal[1]), int(signal[2]), int(signal[3]),
+                                  amplitude_to_byte(signal[4]), int(signal[5]), int(signal[6]))
+        return _SINGLE.pack(amplitude_to_byte(signal[1]), int(signal[2]), int(signal[3]))
+    except struct.error as e:
+        raise ValueError(f"Signal value out of range for '{signal[0]}': {signal} ({e})")
+
+
+def encode_signal(signal):
+    """Encode a signal tuple into its complete wire frame.
+
+    signal is a tuple:
+    - signal[0] is the source ['v', 'w', 'b', 'c'] vib1, vib2, buzzer, combined
+    - signal[1] is the amplitude (0.0-1.0)
+    - signal[2] is the frequency in Hz (0-65535)
+    - signal[3] is the duration in ms (0-65535)
+    For 'c' (combined): signal[4]=ampBuzz, signal[5]=freqBuzz, signal[6]=durBuzz
+
+    Returns:
+        bytes ready to be written to the port
+    """
+    payload = encode_payload(signal)
+    return encode_frame(signal[0], payload)
+
+
+def encode_sequenced(seq, frame):
+    """Wrap an encoded frame so the firmware acknowledges it with seq."""
+    return encode_frame(SEQUENCED, struct.pack('<H', seq % SEQ_MODULO) + frame[1:2] + frame[3:])
+
+
+def decode_sequenced(payload):
+    """Split a sequenced payload into (seq, source, inner payload)."""
+    if len(payload) < 3:
+        raise ValueError(f"Sequenced payload too short: {len(payload)} bytes")
+    return struct.unpack_from('<H', payload)[0], chr(payload[2]), bytes(payload[3:])
+
+
+def encode_table_entry(index, frame):
+    """Store an encoded stimulus frame in slot index of the device table."""
+    if not 0 <= index < TABLE_SIZE:
+        raise ValueError(f"Table index out of range: {index}")
+    if chr(frame[1]) not in SIGNAL_TYPES:
+        raise ValueError(f"Only stimulus frames can be stored in the table, got '{chr(frame[1])}'")
+    return encode_frame(TABLE_ENTRY, bytes((index,)) + frame[1:2] + frame[3:])
+
+
+def decode_table_entry(payload):
+    """Split a table entry payload into (index, source, stimulus payload)."""
+    if len(payload) < 2:
+        raise ValueError(f"Table entry payload too short: {len(payload)} bytes")
+    return payload[0], chr(payload[1]), bytes(payload[2:])
+
+
+def encode_trigger(index):
+    """Frame running the stimulus stored in slot index (4 bytes on the wire)."""
+    if not 0 <= index < TABLE_SIZE:
+        raise ValueError(f"Table index out of range: {index}")
+    return encode_frame(TRIGGER, bytes((index,)))
+
+
+def encode_multi(frames):
+    """Combine encoded stimulus frames into one MULTI frame with a single onset."""
+    if not frames:
+        raise ValueError("A multi-channel frame needs at least one command")
+    payload = bytearray((len(frames),))
+    for frame in frames:
+        if chr(frame[1]) not in SIGNAL_TYPES:
+            raise ValueError(f"Only stimulus frames can be combined, got '{chr(frame[1])}'")
+        payload += frame[1:3] + frame[3:]  # [cmd][len][payload]
+    if len(payload) > MULTI_MAX_PAYLOAD:
+        raise ValueError(f"Multi-channel payload too long: {len(payload)} bytes (max {MULTI_MAX_PAYLOAD})")
+    return encode_frame(MULTI, payload)
+
+
+def decode_multi(payload):
+    """Split a MULTI payload into a list of (source, payload) commands."""
+    if len(payload) < 1:
+        raise ValueError("Multi-channel payload is empty")
+    commands = []
+    pos = 1
+    for _ in range(payload[0]):
+        if pos + 2 > len(payload) or pos + 2 + payload[pos + 1] > len(payload):
+            raise ValueError(f"Multi-channel payload truncated at command {len(commands)}")
+        length = payload[pos + 1]
+        commands.append((chr(payload[pos]), bytes(payload[pos + 2:pos + 2 + length])))
+        pos += 2 + length
+    return commands
+
+
+def split_multi(frame):
+    """The separate stimulus frames a MULTI frame combines (for firmware without MULTI)."""
+    return [encode_frame(source, payload) for source, payload in decode_multi(frame[3:])]
+
+
+def encode_scheduled(seq, onset_us, frame):
+    """Wrap an encoded frame so the firmware runs it at device time onset_us."""
+    return encode_frame(SCHEDULED, _SCHEDULED.pack(seq % SEQ_MODULO, onset_us & 0xffffffff)
+                        + frame[1:2] + frame[3:])
+
+
+def decode_scheduled(payload):
+    """Split a scheduled payload into (seq, onset micros, source, inner payload)."""
+    if len(payload) < _SCHEDULED.size + 1:
+        raise ValueError(f"Scheduled payload too short: {len(payload)} bytes")
+    seq, onset_us = _SCHEDULED.unpack_from(payload)
+    return seq, onset_us, chr(payload[_SCHEDULED.size]), bytes(payload[_SCHEDULED.size + 1:])
+
+
+def encode_flush():
+    return encode_frame(FLUSH, b"")
+
+
+def encode_flushed(count):
+    return encode_frame(FLUSHED, bytes((min(count, 255),)))
+
+
+def encode_ack(seq, device_us):
+    return encode_frame(ACK, _ACK.pack(seq % SEQ_MODULO, device_us & 0xffffffff))
+
+
+def decode_ack(payload):
+    """Return (seq, device onset micros) from an ack payload."""
+    if len(payload) < _ACK.size:
+        raise ValueError(f"Ack payload too short: {len(payload)} bytes")
+    return _ACK.unpack_from(payload)
+
+
+def encode_ping(token):
+    return encode_frame(PING, struct.pack('<H', token % SEQ_MODULO))
+
+
+def encode_pong(token, device_us):
+    return encode_frame(PONG, _PONG.pack(token % SEQ_MODULO, device_us & 0xffffffff))
+
+
+def decode_pong(payload):
+    """Return (token, device micros) from a pong payload."""
+    if len(payload) < _PONG.size:
+        raise ValueError(f"Pong payload too short: {len(payload)} bytes")
+    return _PONG.unpack_from(payload)
+
+
+def encode_counters_request():
+    return encode_frame(COUNTERS_REQUEST, b"")
+
+
+def encode_counters(frames, malformed, dropped, skipped_bytes):
+    return encode_frame(COUNTERS, _COUNTERS.pack(*(v & 0xffffffff for v in
+                                                  (frames, malformed, dropped, skipped_bytes))))
+
+
+def decode_counters(payload):
+    """Return the parser counters as a dict keyed by COUNTER_NAMES."""
+    if len(payload) < _COUNTERS.size:
+        raise ValueError(f"Counters payload too short: {len(payload)} bytes")
+    return dict(zip(COUNTER_NAMES, _COUNTERS.unpack_from(payload)))
+
+
+def encode_identify():
+    return encode_frame(IDENTIFY, b"")
+
+
+def encode_ready(protocol, firmware):
+    return encode_frame(READY, bytes([protocol]) + firmware.encode("ascii"))
+
+
+def decode_ready(payload):
+    """Return (protocol version, firmware version string) from a ready banner."""
+    if len(payload) < 1:
+        raise ValueError("Empty ready banner")
+    return payload[0], payload[1:].decode("ascii", errors="replace")
+
+
+class FrameParser:
+    """Incremental parser turning a byte stream into (source, payload) frames.
+
+    Bytes before a start byte are discarded, so the parser resynchronises
+    after noise or a partial frame.
+    """
+
+    def __init__(self):
+        self._buf = bytearray()
+
+    def feed(self, data):
+        """Add received bytes and return the list of complete frames."""
+        self._buf += data
+        frames = []
+        buf = self._buf
+        while buf:
+            start = buf.find(START_CHAR)
+            if start < 0:
+                buf.clear()
+                break
+            if start:
+                del buf[:start]
+            if len(buf) < 3 or len(buf) < 3 + buf[2]:
+                break
+            end = 3 + buf[2]
+            frames.append((chr(buf[1]), bytes(buf[3:end])))
+            del buf[:end]
+        return frames
+
+
+def frame_to_hex(frame):
+    """Format a frame as space separated hex bytes for logging."""
+    return " ".join("{:02x}".format(c) for c in frame)
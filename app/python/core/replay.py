@@ -0,0 +1,257 @@
+"""Replay the host -> device frames of a wire trace with their original timing.
+
+Reads a trace recorded with ArduinoCom.start_trace() (core.wire_trace) and
+writes its TX frames to a port, URL or a fresh VirtualBsense, keeping the
+recorded inter-frame intervals (optionally sped up). Frames are released
+with the same sleep-then-spin wait as the writer thread, and the actual
+write times are compared to the plan, so the report shows how faithfully
+the original timing was reproduced on this host and link.
+
+Device-scheduled frames ('s') carry an onset in the recording device's
+micros(). They are rebased onto the device replayed into: the recorded
+ping/pong exchanges give the original clock mapping, a fresh clock sync
+the new one, and each onset keeps its recorded distance from the frame's
+send time. Without recorded pongs the 's' frames are skipped and counted
+in the report. Recorded pings are not replayed: the replay runs its own
+clock sync.
+
+Run from app/python:
+    python -m core.replay session.trace [-p PORT|virtual[:tcp|udp|loop|pty]] [-s SPEED] [--skip i,p]
+
+SPEED 2 plays twice as fast, 0 sends every frame as soon as possible.
+Without -p the trace is replayed into an in-process virtual device.
+"""
+import logging
+import sys
+import time
+
+from core.arduino_communication import ArduinoCom, wait_until
+from core.clock_sync import ClockSync
+from core.protocol import (IDENTIFY, PING, PONG, SCHEDULED, encode_frame, encode_scheduled, decode_scheduled,
+                           decode_pong)
+from core.wire_trace import iter_trace, TX, RX
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SKIP = (IDENTIFY, PING)  # connect() does its own handshake, the replay its own clock sync
+SYNC_TIMEOUT = 2.0  # seconds to wait for the replay device's clock mapping
+
+
+def load_tx_frames(path, skip=DEFAULT_SKIP):
+    """(t_ns, frame) of every host -> device frame in a trace, minus skipped sources."""
+    skip = {ord(s) for s in skip}
+    return [(r.t_ns, r.frame) for r in iter_trace(path)
+            if r.direction == TX and len(r.frame) > 1 and r.frame[1] not in skip]
+
+
+def recorded_clock(path):
+    """The host <-> device clock mapping of the recorded session (ClockSync), or None without pongs."""
+    pings = {}
+    clock = ClockSync()
+    for r in iter_trace(path):
+        if len(r.frame) < 3:
+            continue
+        source = chr(r.frame[1])
+        if r.direction == TX and source == PING:
+            pings[int.from_bytes(r.frame[3:5], "little")] = r.t_ns
+        elif r.direction == RX and source == PONG:
+            token, device_us = decode_pong(r.frame[3:])
+            send_ns = pings.pop(token, None)
+            if send_ns is not None:
+                clock.add_sample(send_ns, r.t_ns, device_us)
+    return clock if clock.synced else None
+
+
+def summarize(values):
+    """count, mean, p50, p99 and max of a list of numbers (None when empty)."""
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p99": None, "max": None}
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "mean": sum(ordered) / len(ordered),
+        "p50": ordered[len(ordered) // 2],
+        "p99": ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))],
+        "max": ordered[-1],
+    }
+
+
+class ReplayReport:
+    """Planned vs actual write times of a replay (all times in ns)."""
+
+    def __init__(self, planned_ns, actual_ns, speed, errors=0):
+        self.planned_ns = planned_ns
+        self.actual_ns = actual_ns
+        self.speed = speed
+        self.errors = errors  # frames whose write failed
+        self.rebased = 0  # 's' frames whose onset was moved to the replay device's clock
+        self.skipped_scheduled = 0  # 's' frames not sent: no clock mapping
+        self.device_commands = None  # set when replayed into a VirtualBsense
+        self.device_malformed = None
+
+    @property
+    def frames(self):
+        return len(self.actual_ns)
+
+    @property
+    def onset_error_ns(self):
+        """Lateness of every write against its planned time."""
+        return [a - p for p, a in zip(self.planned_ns, self.actual_ns)]
+
+    @property
+    def interval_error_ns(self):
+        """Difference between replayed and planned intervals, per consecutive pair."""
+        return [(a1 - a0) - (p1 - p0) for p0, p1, a0, a1 in
+                zip(self.planned_ns, self.planned_ns[1:], self.actual_ns, self.actual_ns[1:])]
+
+    def to_dict(self):
+        duration = (self.actual_ns[-1] - self.actual_ns[0]) / 1e9 if self.actual_ns else 0.0
+        planned = (self.planned_ns[-1] - self.planned_ns[0]) / 1e9 if self.planned_ns else 0.0
+        return {
+            "frames": self.frames,
+            "errors": self.errors,
+            "rebased": self.rebased,
+            "skipped_scheduled": self.skipped_scheduled,
+            "speed": self.speed,
+            "planned_duration_s": planned,
+            "duration_s": duration,
+            "onset_error_ns": summarize(self.onset_error_ns),
+            "abs_interval_error_ns": summarize([abs(e) for e in self.interval_error_ns]),
+            "device_commands": self.device_commands,
+            "device_malformed": self.device_malformed,
+        }
+
+    def summary(self):
+        d = self.to_dict()
+        lines = [f"{d['frames']} frames in {d['duration_s']:.3f} s "
+                 f"(planned {d['planned_duration_s']:.3f} s, speed {self.speed or 'max'}), {d['errors']} errors"]
+        if self.rebased or self.skipped_scheduled:
+            lines.append(f"scheduled frames: {self.rebased} rebased to the device clock, "
+                         f"{self.skipped_scheduled} skipped (no clock mapping)")
+        for name in ("onset_error_ns", "abs_interval_error_ns"):
+            s = d[name]
+            if s["count"]:
+                lines.append(f"{name[:-3]}: mean {s['mean'] / 1e3:.1f} us, p50 {s['p50'] / 1e3:.1f} us, "
+                             f"p99 {s['p99'] / 1e3:.1f} us, max {s['max'] / 1e3:.1f} us")
+        if self.device_commands is not None:
+            lines.append(f"virtual device: {self.device_commands} commands, "
+                         f"{self.device_malformed} rejected frames")
+        return "\n".join(lines)
+
+
+def replay(frames, arduino, speed=1.0, lead_ns=50_000_000, clock=None):
+    """Write (t_ns, frame) pairs to a connected ArduinoCom with their recorded spacing.
+
+    speed scales the timeline (2.0 = twice as fast); 0 or None writes every
+    frame as soon as possible. clock is the recorded session's mapping
+    (recorded_clock()): with it, and arduino's clock sync running, 's'
+    frames are rebased onto the device; otherwise they are skipped.
+    Returns a ReplayReport.
+    """
+    planned = []
+    actual = []
+    errors = 0
+    rebased = skipped = 0
+    if not frames:
+        return ReplayReport(planned, actual, speed)
+    can_rebase = clock is not None and arduino.clock.synced
+    t0 = frames[0][0]
+    start_ns = time.perf_counter_ns() + lead_ns
+    for t_ns, frame in frames:
+        if speed:
+            due_ns = start_ns + int((t_ns - t0) / speed)
+            wait_until(due_ns)
+        else:
+            due_ns = time.perf_counter_ns()
+        if frame[1] == ord(SCHEDULED):
+            if not can_rebase:
+                skipped += 1
+                continue
+            seq, onset_us, source, payload = decode_scheduled(frame[3:])
+            # keep the recorded lead between sending the frame and its onset
+            lead = clock.device_to_host(onset_us) - t_ns
+            onset_ns = due_ns + int(lead / speed if speed else lead)
+            frame = encode_scheduled(seq, arduino.clock.host_to_device(onset_ns), encode_frame(source, payload))
+            rebased += 1
+        sent_ns = time.perf_counter_ns()
+        try:
+            arduino.send_frame(frame)
+        except Exception as e:
+            errors += 1
+            logger.warning(f"Replay write failed: {e}")
+            if not arduino.is_connected():
+                break
+            continue
+        planned.append(due_ns)
+        actual.append(sent_ns)
+    report = ReplayReport(planned, actual, speed, errors)
+    report.rebased = rebased
+    report.skipped_scheduled = skipped
+    if skipped:
+        logger.warning(f"{skipped} scheduled frame(s) skipped: no clock mapping to rebase their onsets")
+    return report
+
+
+def replay_trace(path, port=None, speed=1.0, skip=DEFAULT_SKIP):
+    """Replay a trace file into port (path or URL), or into a new VirtualBsense.
+
+    port may also be "virtual" or "virtual:<transport>". Returns the
+    ReplayReport; with a virtual device, its decoded command count and
+    parser rejects are filled in as device_commands / device_malformed.
+    """
+    from core.virtual_device import VirtualBsense
+
+    frames = load_tx_frames(path, skip)
+    scheduled = any(frame[1] == ord(SCHEDULED) for _, frame in frames)
+    clock = recorded_clock(path) if scheduled else None
+    device = None
+    if port is None or port.startswith("virtual"):
+        _, _, transport = (port or "virtual").partition(":")
+        device = VirtualBsense(transport or "loop")
+        port = device.start()
+    arduino = ArduinoCom()
+    try:
+        arduino.connect(port, retries=1)
+        if clock is not None:
+            arduino.start_clock_sync(interval=0.2)
+            deadline = time.monotonic() + SYNC_TIMEOUT
+            while not arduino.clock.synced and time.monotonic() < deadline:
+                time.sleep(0.01)
+        report = replay(frames, arduino, speed, clock=clock)
+        if device is not None:
+            time.sleep(0.05)  # let the emulator take in the last frames
+            report.device_commands = len(device.commands)
+            report.device_malformed = device.malformed + device.dropped
+    finally:
+        arduino.close()
+        if device is not None:
+            device.stop()
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = sys.argv[1:]
+    trace_path = None
+    port = None
+    speed = 1.0
+    skip = DEFAULT_SKIP
+    i = 0
+    while i < len(args):
+        if args[i] == "-p" and i + 1 < len(args):
+            port = args[i + 1]
+            i += 1
+        elif args[i] == "-s" and i + 1 < len(args):
+            speed = float(args[i + 1])
+            i += 1
+        elif args[i] == "--skip" and i + 1 < len(args):
+            skip = tuple(s for s in args[i + 1].split(",") if s)
+            i += 1
+        else:
+            trace_path = args[i]
+        i += 1
+    if trace_path is None:
+        print(__doc__)
+        sys.exit(2)
+    result = replay_trace(trace_path, port, speed, skip)
+    print(result.summary())
@@ -0,0 +1,180 @@
+"""Write-path telemetry for a device link.
+
+LinkTelemetry counts what the host writes to one device and how long it
+takes: frames and bytes (with per-second rates), the duration of every
+write call, how long frames waited in the writer queue past their due time,
+the queue depth seen by each submission, and write errors. Recording is a
+few integer operations under a lock, so it stays on in the send path.
+
+Durations are kept in Histograms with power-of-two buckets: percentiles are
+estimates (within a factor of two), min, max and mean are exact.
+"""
+import collections
+import json
+import threading
+import time
+
+RATE_WINDOW = 60  # seconds of per-second frame/byte counts kept
+
+
+class Histogram:
+    """Distribution of non-negative integers in power-of-two buckets."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.buckets = [0] * 65  # bucket k holds values with bit_length() == k
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        value = max(0, int(value))
+        self.buckets[value.bit_length()] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, q):
+        """Estimate the q-th percentile (0-100), or None if empty.
+
+        Interpolates linearly inside the bucket holding the rank and clamps
+        to the recorded min and max.
+        """
+        if not self.count:
+            return None
+        rank = q / 100 * self.count
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            if n and seen + n >= rank:
+                low = 0 if k == 0 else 1 << (k - 1)
+                high = 0 if k == 0 else (1 << k) - 1
+                value = low + (high - low) * max(0.0, rank - seen) / n
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min,
+            "p50": self.percentile(50),
+            "p99": self.percentile(99),
+            "max": self.max,
+            "buckets": {str(1 << k if k else 0): n for k, n in enumerate(self.buckets) if n},
+        }
+
+
+class LinkTelemetry:
+    """Counters and histograms for the frames written to one device."""
+
+    HISTOGRAMS = ("write_ns", "queue_wait_ns", "queue_depth")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.frames_written = 0
+            self.bytes_written = 0
+            self.write_errors = 0
+            self.histograms = {name: Histogram() for name in self.HISTOGRAMS}
+            self._rates = collections.deque(maxlen=RATE_WINDOW)  # [second, frames, bytes]
+            self.first_write_ns = None
+            self.last_write_ns = None
+
+    def record_write(self, nbytes, start_ns, end_ns):
+        """One successful write call of nbytes between start_ns and end_ns."""
+        with self._lock:
+            self.frames_written += 1
+            self.bytes_written += nbytes
+            self.histograms["write_ns"].record(end_ns - start_ns)
+            if self.first_write_ns is None:
+                self.first_write_ns = start_ns
+            self.last_write_ns = end_ns
+            second = end_ns // 1_000_000_000
+            if not self._rates or self._rates[-1][0] != second:
+                self._rates.append([second, 0, 0])
+            bucket = self._rates[-1]
+            bucket[1] += 1
+            bucket[2] += nbytes
+
+    def record_error(self):
+        with self._lock:
+            self.write_errors += 1
+
+    def record_queue_wait(self, wait_ns):
+        """Time a frame spent in the writer queue after it was due."""
+        with self._lock:
+            self.histograms["queue_wait_ns"].record(wait_ns)
+
+    def record_queue_depth(self, depth):
+        """Writer queue depth seen by a submission."""
+        with self._lock:
+            self.histograms["queue_depth"].record(depth)
+
+    def rates(self, now_ns=None):
+        """Frames/s and bytes/s: session averages and the busiest recent second."""
+        with self._lock:
+            elapsed = None
+            if self.first_write_ns is not None:
+                elapsed = (self.last_write_ns - self.first_write_ns) / 1e9
+            recent = list(self._rates)
+        if now_ns is None:
+            now_ns = time.perf_counter_ns()
+        # the current second is still filling up, so it only counts towards the peak
+        current = now_ns // 1_000_000_000
+        last = [b for b in recent if b[0] == current - 1]
+        return {
+            "frames_per_s": self.frames_written / elapsed if elapsed else None,
+            "bytes_per_s": self.bytes_written / elapsed if elapsed else None,
+            "last_s_frames": last[0][1] if last else 0,
+            "last_s_bytes": last[0][2] if last else 0,
+            "peak_frames_per_s": max((b[1] for b in recent), default=0),
+            "peak_bytes_per_s": max((b[2] for b in recent), default=0),
+        }
+
+    def snapshot(self):
+        """All counters, rates and histograms as a JSON-serialisable dict."""
+        rates = self.rates()
+        with self._lock:
+            return {
+                "frames_written": self.frames_written,
+                "bytes_written": self.bytes_written,
+                "write_errors": self.write_errors,
+                "rates": rates,
+                "histograms": {name: h.to_dict() for name, h in self.histograms.items()},
+            }
+
+    def summary(self):
+        """One line for the session log."""
+        with self._lock:
+            write = self.histograms["write_ns"]
+            wait = self.histograms["queue_wait_ns"]
+            depth = self.histograms["queue_depth"]
+            text = f"{self.frames_written} frames, {self.bytes_written} bytes, {self.write_errors} write errors"
+            if write.count:
+                text += (f"; write call p50 {write.percentile(50) / 1e3:.1f} us, "
+                         f"p99 {write.percentile(99) / 1e3:.1f} us, max {write.max / 1e3:.1f} us")
+            if wait.count:
+                text += f"; queue wait max {wait.max / 1e3:.1f} us"
+            if depth.count:
+                text += f"; queue depth max {depth.max}"
+        return text
+
+
+def dump_json(stats, path):
+    """Write a stats dict (see ArduinoCom.stats()) to path as JSON."""
+    with open(path, "w") as f:
+        json.dump(stats, f, indent=2)
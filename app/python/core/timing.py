@@ -0,0 +1,130 @@
+"""Per-event onset timing of an experiment run.
+
+OnsetRecorder keeps, for every stimulus, its planned onset, the actual
+dispatch time and the time its write completed (perf_counter_ns() values)
+in preallocated arrays used as a ring buffer: recording is a few stores,
+with no allocation, so it stays on during a run. The last `capacity`
+events are kept; the running lateness totals cover the whole session.
+
+stats() gives the lateness (dispatch - planned), write completion
+(complete - planned) and inter-onset interval error (actual - planned
+interval between consecutive events) as p50/p95/p99/max, in ms. export()
+writes the events as CSV next to the session log.
+"""
+import array
+import threading
+
+ONSET_CAPACITY = 65536  # events kept by an OnsetRecorder
+PERCENTILES = (50, 95, 99)
+_UNSET = -1  # write not complete (yet)
+
+
+def percentiles(values):
+    """p50/p95/p99 (nearest rank) and max of a list of numbers, or None values if empty."""
+    values = sorted(values)
+    result = {f"p{q}": values[max(0, -(-q * len(values) // 100) - 1)] if values else None for q in PERCENTILES}
+    result["max"] = values[-1] if values else None
+    return result
+
+
+class OnsetRecorder:
+    """Ring buffer of (event index, planned, dispatch, write complete) times, one row per stimulus."""
+
+    def __init__(self, capacity=ONSET_CAPACITY):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._event = array.array("q", bytes(8 * capacity))
+        self._planned = array.array("q", bytes(8 * capacity))
+        self._dispatch = array.array("q", bytes(8 * capacity))
+        self._complete = array.array("q", bytes(8 * capacity))
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0  # events recorded since the reset, including those overwritten
+            self.total_late_ns = 0
+            self.max_late_ns = None
+            self.last_late_ns = None
+            self._handles = [None] * self.capacity  # write handles whose completion is not known yet
+
+    def record(self, idx, planned_ns, dispatch_ns, handle=None):
+        """One stimulus: plan index, planned and actual onset, and the handle of its write.
+
+        handle (WriteHandle or GroupEvent) gives the write completion time
+        once known; without one the write counts as done at dispatch.
+        """
+        late_ns = dispatch_ns - planned_ns
+        with self._lock:
+            slot = self.count % self.capacity
+            self._event[slot] = idx
+            self._planned[slot] = planned_ns
+            self._dispatch[slot] = dispatch_ns
+            complete_ns = dispatch_ns if handle is None else handle.complete_ns
+            self._complete[slot] = _UNSET if complete_ns is None else complete_ns
+            self._handles[slot] = handle if complete_ns is None else None
+            self.count += 1
+            self.total_late_ns += late_ns
+            if self.max_late_ns is None or late_ns > self.max_late_ns:
+                self.max_late_ns = late_ns
+            self.last_late_ns = late_ns
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def events(self):
+        """The kept events, oldest first: (index, planned_ns, dispatch_ns, complete_ns or None)."""
+        with self._lock:
+            n = min(self.count, self.capacity)
+            first = self.count - n
+            rows = []
+            for k in range(first, self.count):
+                slot = k % self.capacity
+                complete_ns = self._complete[slot]
+                if complete_ns == _UNSET:
+                    handle = self._handles[slot]
+                    if handle is not None and handle.complete_ns is not None:
+                        complete_ns = self._complete[slot] = handle.complete_ns
+                        self._handles[slot] = None
+                rows.append((self._event[slot], self._planned[slot], self._dispatch[slot],
+                             None if complete_ns == _UNSET else complete_ns))
+            return rows
+
+    def stats(self):
+        """Lateness, write completion and interval error percentiles (ms) over the kept events."""
+        rows = self.events()
+        late = [(dispatch - planned) / 1e6 for _, planned, dispatch, _ in rows]
+        write = [(complete - planned) / 1e6 for _, planned, _, complete in rows if complete is not None]
+        interval = [abs((b[2] - a[2]) - (b[1] - a[1])) / 1e6 for a, b in zip(rows, rows[1:])]
+        with self._lock:
+            count = self.count
+            mean = self.total_late_ns / count / 1e6 if count else None
+            drift = self.last_late_ns / 1e6 if count else None
+        return {
+            "events": count,
+            "kept": len(rows),
+            "mean_lateness_ms": mean,
+            "drift_ms": drift,
+            "lateness_ms": percentiles(late),
+            "write_ms": percentiles(write),
+            "interval_error_ms": percentiles(interval),
+        }
+
+    def summary(self):
+        """One line for the session log."""
+        s = self.stats()
+        late, interval = s["lateness_ms"], s["interval_error_ms"]
+        text = (f"timing: {s['events']} onsets, lateness p50 {late['p50']:.3f} ms, p95 {late['p95']:.3f} ms, "
+                f"p99 {late['p99']:.3f} ms, max {late['max']:.3f} ms, drift at end {s['drift_ms']:.3f} ms")
+        if interval["max"] is not None:
+            text += (f"; interval error p50 {interval['p50']:.3f} ms, p99 {interval['p99']:.3f} ms, "
+                     f"max {interval['max']:.3f} ms")
+        return text
+
+    def export(self, path):
+        """Write the kept events as CSV: index, planned, dispatch and complete times (ns) and lateness (ms)."""
+        rows = self.events()
+        with open(path, "w") as f:
+            f.write("event,planned_ns,dispatch_ns,complete_ns,lateness_ms\n")
+            for idx, planned, dispatch, complete in rows:
+                f.write(f"{idx},{planned},{dispatch},{'' if complete is None else complete},"
+                        f"{(dispatch - planned) / 1e6:.3f}\n")
@@ -0,0 +1,265 @@
+"""Byte-stream transports for ArduinoCom.
+
+ArduinoCom talks to the device through an object with the part of the
+pyserial Serial interface it uses: write(), read(size) with a timeout,
+in_waiting, close(), is_open and port. open_transport() picks the
+implementation from the port string:
+
+    /dev/ttyACM0, COM3         serial.Serial at 115200 baud
+    tcp://host:port            TCP stream (e.g. a networked stimulator or bridge)
+    udp://host:port            UDP, one datagram per write
+    loop://name                in-process loopback to an endpoint registered
+                               with register_loopback() (e.g. VirtualBsense)
+
+Framing and encoding (core.protocol) are the same on every transport.
+Transport failures raise TransportError, a serial.SerialException, so
+existing disconnect handling applies unchanged.
+"""
+import itertools
+import select
+import socket
+import threading
+import time
+
+import serial
+
+BAUD_RATE = 115200
+UDP_MAX_DATAGRAM = 65507
+
+
+class TransportError(serial.SerialException):
+    """A transport failed or its peer went away."""
+
+
+class Transport:
+    """Base class: a buffered byte stream with pyserial-like reads.
+
+    Subclasses implement _fill(timeout), which appends received bytes to
+    self._buf waiting at most timeout seconds, and _send(data).
+    """
+
+    def __init__(self, port, timeout=None):
+        self.port = port
+        self.timeout = timeout
+        self._buf = bytearray()
+        self._open = True
+
+    @property
+    def is_open(self):
+        return self._open
+
+    @property
+    def in_waiting(self):
+        self.__check_open()
+        self._fill(0)
+        return len(self._buf)
+
+    def read(self, size=1):
+        """Return up to size bytes, waiting at most timeout seconds for all of them."""
+        self.__check_open()
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while len(self._buf) < size:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                break
+            self._fill(remaining)
+        data = bytes(self._buf[:size])
+        del self._buf[:size]
+        return data
+
+    def write(self, data):
+        self.__check_open()
+        try:
+            self._send(bytes(data))
+        except TransportError:
+            raise
+        except OSError as e:
+            raise TransportError(f"{self.port}: write failed: {e}")
+        return len(data)
+
+    def reset_input_buffer(self):
+        self._buf.clear()
+
+    def close(self):
+        self._open = False
+
+    def __check_open(self):
+        if not self._open:
+            raise TransportError(f"{self.port}: transport is closed")
+
+    def _fill(self, timeout):
+        raise NotImplementedError
+
+    def _send(self, data):
+        raise NotImplementedError
+
+
+class _SocketTransport(Transport):
+    def __init__(self, port, sock, timeout=None):
+        super().__init__(port, timeout)
+        self._sock = sock
+        self._sock.settimeout(None)  # reads only happen after select() reports data
+
+    def _fill(self, timeout):
+        try:
+            ready, _, _ = select.select([self._sock], [], [], timeout)
+            if ready:
+                self._receive()
+        except TransportError:
+            raise
+        except (OSError, ValueError) as e:
+            if not self._open:
+                raise TransportError(f"{self.port}: transport is closed")
+            raise TransportError(f"{self.port}: read failed: {e}")
+
+    def close(self):
+        super().close()
+        try:
+            self._sock.close()
+        except OSError:
+            pass
+
+
+class TcpTransport(_SocketTransport):
+    def __init__(self, host, port, timeout=None, connect_timeout=2.0):
+        try:
+            sock = socket.create_connection((host, port), timeout=connect_timeout)
+        except OSError as e:
+            raise TransportError(f"Cannot connect to tcp://{host}:{port}: {e}")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)  # frames are small: no Nagle delay
+        super().__init__(f"tcp://{host}:{port}", sock, timeout)
+
+    def _receive(self):
+        data = self._sock.recv(4096)
+        if not data:
+            raise TransportError(f"{self.port}: connection closed by peer")
+        self._buf += data
+
+    def _send(self, data):
+        self._sock.sendall(data)
+
+
+class UdpTransport(_SocketTransport):
+    """Connected UDP socket. Each write() is sent as one datagram.
+
+    UDP has no connection, so an unreachable peer only shows up as errors
+    reported by the local stack (ICMP port unreachable), if at all.
+    """
+
+    def __init__(self, host, port, timeout=None):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.connect((host, port))
+        except OSError as e:
+            sock.close()
+            raise TransportError(f"Cannot open udp://{host}:{port}: {e}")
+        super().__init__(f"udp://{host}:{port}", sock, timeout)
+
+    def _receive(self):
+        self._buf += self._sock.recv(UDP_MAX_DATAGRAM)
+
+    def _send(self, data):
+        self._sock.send(data)
+
+
+class _Pipe:
+    """One direction of a loopback link."""
+
+    def __init__(self):
+        self.buf = bytearray()
+        self.written = 0  # bytes ever written into the pipe
+        self.closed = False
+        self.cond = threading.Condition()
+
+
+class LoopbackTransport(Transport):
+    """One end of an in-process byte link (see loopback_pair())."""
+
+    def __init__(self, port, rx, tx, timeout=None):
+        super().__init__(port, timeout)
+        self._rx = rx
+        self._tx = tx
+
+    def _fill(self, timeout):
+        with self._rx.cond:
+            if not self._rx.buf and not self._rx.closed and timeout != 0:
+                self._rx.cond.wait(timeout)
+            if self._rx.buf:
+                self._buf += self._rx.buf
+                self._rx.buf.clear()
+            elif self._rx.closed:
+                raise TransportError(f"{self.port}: peer closed the link")
+
+    def _send(self, data):
+        with self._tx.cond:
+            if self._tx.closed:
+                raise TransportError(f"{self.port}: peer closed the link")
+            self._tx.buf += data
+            self._tx.written += len(data)
+            self._tx.cond.notify_all()
+
+    @property
+    def bytes_received(self):
+        """Bytes the other end has written to this one so far (read or not)."""
+        return self._rx.written
+
+    def close(self):
+        super().close()
+        for pipe in (self._rx, self._tx):
+            with pipe.cond:
+                pipe.closed = True
+                pipe.cond.notify_all()
+
+
+def loopback_pair(name="loop://", timeout=None):
+    """Return two connected LoopbackTransports (host end, device end)."""
+    a_to_b, b_to_a = _Pipe(), _Pipe()
+    return (LoopbackTransport(name, b_to_a, a_to_b, timeout),
+            LoopbackTransport(name, a_to_b, b_to_a, timeout))
+
+
+_loopback_endpoints = {}
+_loopback_lock = threading.Lock()
+_loopback_ids = itertools.count()
+
+
+def register_loopback(accept, name=None):
+    """Make loop://name openable; accept(device_end) is called on every open.
+
+    Returns the URL to pass to ArduinoCom.connect().
+    """
+    with _loopback_lock:
+        if name is None:
+            name = f"bsense{next(_loopback_ids)}"
+        _loopback_endpoints[name] = accept
+    return f"loop://{name}"
+
+
+def unregister_loopback(url):
+    with _loopback_lock:
+        _loopback_endpoints.pop(url[len("loop://"):], None)
+
+
+def _split_host_port(url, scheme):
+    address = url[len(scheme):]
+    host, sep, port = address.rpartition(":")
+    if not sep or not port.isdigit():
+        raise ValueError(f"Expected {scheme}host:port, got {url}")
+    return host or "127.0.0.1", int(port)
+
+
+def open_transport(path, timeout=None):
+    """Open the transport for a port path or URL (see module docstring)."""
+    if path.startswith("tcp://"):
+        return TcpTransport(*_split_host_port(path, "tcp://"), timeout=timeout)
+    if path.startswith("udp://"):
+        return UdpTransport(*_split_host_port(path, "udp://"), timeout=timeout)
+    if path.startswith("loop://"):
+        with _loopback_lock:
+            accept = _loopback_endpoints.get(path[len("loop://"):])
+        if accept is None:
+            raise TransportError(f"No loopback endpoint registered as {path}")
+        host_end, device_end = loopback_pair(path, timeout)
+        accept(device_end)
+        return host_end
+    return serial.Serial(path, BAUD_RATE, timeout=timeout)
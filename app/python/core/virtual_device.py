@@ -0,0 +1,468 @@
+"""Virtual Bsense device on a pseudo-terminal, socket or in-process link.
+
+VirtualBsense behaves like the Teensy running teensyScript.ino. By default it
+opens a pty pair (Linux/macOS) and ArduinoCom.connect(device.port) opens the
+slave side like a real serial port; VirtualBsense(transport="tcp"|"udp"|"loop")
+serves the same emulation on a localhost socket or an in-process loopback
+(see core.transport), and device.port is then the URL to connect to. A thread
+parses the byte stream the same way the firmware loop() does. Each decoded command is timestamped
+with time.perf_counter_ns() and the actuator on/off state is modelled, so
+scheduling latency, throughput and jitter can be measured without hardware.
+With clock=SimulatedClock (core.clock) the device runs on that clock instead,
+and idle() tells the clock when a loop:// device has handled every byte.
+
+Example:
+    device = VirtualBsense()
+    device.start()
+    arduino.connect(device.port)
+    ...
+    device.stop()
+    print(device.commands)
+"""
+import collections
+import os
+import select
+import socket
+import struct
+import threading
+import time
+import logging
+
+from core.transport import register_loopback, unregister_loopback, TransportError
+from core.clock import SYSTEM_CLOCK
+
+from core.protocol import (START_CHAR, SEQUENCED, PING, IDENTIFY, TABLE_ENTRY, TRIGGER, TABLE_SIZE,
+                           SCHEDULED, FLUSH, SCHEDULE_SIZE, MULTI, MULTI_MAX_PAYLOAD, MULTI_PROTOCOL,
+                           COUNTERS_REQUEST, COUNTERS_PROTOCOL, PROTOCOL_VERSION, SEQ_MODULO, encode_ack,
+                           encode_pong, encode_ready, encode_flushed, encode_counters, decode_scheduled, decode_multi)
+
+logger = logging.getLogger(__name__)
+
+BUFFER_SIZE = 64          # firmware buff[64]
+FRAME_TIMEOUT_NS = 100_000_000  # firmware drops a frame not complete 100 ms after its start byte
+TRIGGER_US = 5000         # trigger pulse length
+TABLE_DATA_SIZE = 10      # firmware table_data row size
+SEQ_WINDOW = 32           # sequenced commands remembered to ignore retransmissions
+SPIN_US = 1000            # scheduled commands closer than this are waited for by spinning
+STIMULUS_LENGTHS = {'v': 5, 'w': 5, 'b': 5, 'c': 10}  # payload bytes each stimulus command needs
+FIRMWARE_VERSION = "virtual"
+
+# One decoded command. recv_ns is the clock time (perf_counter_ns()) when it was applied,
+# device_us the emulated micros() at onset, seq the sequence number or None.
+Command = collections.namedtuple("Command", "recv_ns device_us source payload seq")
+
+
+class _PtyLink:
+    """Master side of a pty; the slave path is opened by the host."""
+
+    def __init__(self):
+        import tty
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+    def recv(self, timeout):
+        ready, _, _ = select.select([self._master], [], [], timeout)
+        return os.read(self._master, 4096) if ready else b""
+
+    def send(self, data):
+        os.write(self._master, data)
+
+    def close(self):
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+
+class _TcpLink:
+    """Listening socket on localhost serving one host connection at a time."""
+
+    def __init__(self):
+        self._listener = socket.create_server(("127.0.0.1", 0))
+        self.port = "tcp://127.0.0.1:{}".format(self._listener.getsockname()[1])
+        self._client = None
+
+    def recv(self, timeout):
+        sock = self._client or self._listener
+        ready, _, _ = select.select([sock], [], [], timeout)
+        if not ready:
+            return b""
+        if self._client is None:
+            self._client, _ = self._listener.accept()
+            self._client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            return b""
+        data = self._client.recv(4096)
+        if not data:
+            self._client.close()  # host disconnected: wait for the next one
+            self._client = None
+        return data
+
+    def send(self, data):
+        if self._client is not None:
+            self._client.sendall(data)
+
+    def drop(self):
+        client = self._client
+        if client is not None:
+            client.shutdown(socket.SHUT_RDWR)  # the emulation thread sees the end of stream and closes it
+
+    def close(self):
+        for sock in (self._client, self._listener):
+            if sock is not None:
+                sock.close()
+
+
+class _UdpLink:
+    """Bound UDP socket on localhost, replying to the last sender."""
+
+    def __init__(self):
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind(("127.0.0.1", 0))
+        self.port = "udp://127.0.0.1:{}".format(self._sock.getsockname()[1])
+        self._peer = None
+
+    def recv(self, timeout):
+        ready, _, _ = select.select([self._sock], [], [], timeout)
+        if not ready:
+            return b""
+        data, self._peer = self._sock.recvfrom(65535)
+        return data
+
+    def send(self, data):
+        if self._peer is not None:
+            self._sock.sendto(data, self._peer)
+
+    def close(self):
+        self._sock.close()
+
+
+class _LoopLink:
+    """In-process endpoint registered as loop://name."""
+
+    def __init__(self):
+        self._end = None
+        self._ready = threading.Condition()
+        self.handled = 0  # bytes of the current connection the device is done with
+        self.port = register_loopback(self.__accept)
+
+    def __accept(self, device_end):
+        with self._ready:
+            if self._end is not None:
+                self._end.close()
+            self._end = device_end
+            self.handled = 0
+            self._ready.notify_all()
+
+    def pending(self):
+        """Bytes written by the host that the device has not handled yet."""
+        end = self._end
+        return 0 if end is None else end.bytes_received - self.handled
+
+    def recv(self, timeout):
+        with self._ready:
+            if self._end is None:
+                self._ready.wait(timeout)
+                return b""
+            end = self._end
+        end.timeout = timeout
+        try:
+            data = end.read(1)
+            waiting = end.in_waiting if data else 0
+            return data + end.read(waiting) if waiting else data
+        except TransportError:
+            with self._ready:
+                if self._end is end:
+                    self._end = None  # host closed the link
+            return b""
+
+    def send(self, data):
+        end = self._end
+        if end is not None:
+            end.write(data)
+
+    def drop(self):
+        end = self._end
+        if end is not None:
+            end.close()
+
+    def close(self):
+        unregister_loopback(self.port)
+        if self._end is not None:
+            self._end.close()
+
+
+_LINKS = {"pty": _PtyLink, "tcp": _TcpLink, "udp": _UdpLink, "loop": _LoopLink}
+
+
+class VirtualBsense:
+    def __init__(self, transport="pty", clock=None):
+        if transport not in _LINKS:
+            raise ValueError(f"Unknown transport '{transport}' (expected one of {', '.join(_LINKS)})")
+        self.transport = transport
+        self.clock = clock if clock is not None else SYSTEM_CLOCK
+        self.protocol = PROTOCOL_VERSION  # reported when identified; lower it to emulate older firmware
+        self.commands = []
+        self.frames = 0      # complete frames parsed
+        self.malformed = 0   # frames rejected (bad length or content)
+        self.dropped = 0     # frames dropped (timeout, oversize, schedule full)
+        self.skipped = 0     # bytes discarded while looking for a start byte
+        self.rx_bytes = 0    # bytes received from the host
+        self.port = None
+        self._link = None
+        self._thread = None
+        self._active = False
+        self._lock = threading.Lock()
+        self._buf = bytearray()
+        self._frame_ns = None  # clock time when the start byte of the current frame was parsed
+        self._t0_ns = self.clock.now_ns()
+        self._last_seq = None  # newest sequenced command run
+        self._seq_window = 0  # bit k set: seq _last_seq - k ran (as the firmware's seq_window)
+        self._seq_onset = [0] * SEQ_WINDOW
+        self.table = [None] * TABLE_SIZE  # (cmd, payload) per slot, as stored by 't' frames
+        self._schedule = collections.deque()  # (seq, onset micros, cmd, payload), fired in order
+        # Actuator model: end times in device micros (unwrapped)
+        self._end_us = {"vib1": 0, "buzzer": 0, "trigger": 0}
+        self._params = {"vib1": None, "buzzer": None}
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self):
+        """Open the link and start the firmware emulation thread. Returns the port to connect to."""
+        self._link = _LINKS[self.transport]()
+        self.port = self._link.port
+        self._active = True
+        self._thread = threading.Thread(target=self.__loop, daemon=True)
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._active = False
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+            self._thread = None
+        if self._link is not None:
+            self._link.close()
+            self._link = None
+
+    def drop_link(self):
+        """Cut the host's connection like a cable glitch; the port stays open for reconnecting.
+
+        The device keeps its state (table, scheduled commands). Only tcp and
+        loop links can be dropped.
+        """
+        if not hasattr(self._link, "drop"):
+            raise NotImplementedError(f"{self.transport} links cannot be dropped")
+        self._link.drop()
+
+    def idle(self):
+        """True once every byte the host wrote has been handled (loop links only).
+
+        A SimulatedClock checks this before it moves on (core.clock).
+        """
+        if not hasattr(self._link, "pending"):
+            raise NotImplementedError(f"{self.transport} links cannot report pending bytes")
+        return self._link.pending() == 0
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -- device clock and state --------------------------------------------
+
+    def micros(self, now_ns=None):
+        """Emulated micros(): microseconds since start, unwrapped."""
+        if now_ns is None:
+            now_ns = self.clock.now_ns()
+        return (now_ns - self._t0_ns) // 1000
+
+    def actuator_state(self, now_ns=None):
+        """Return {'vib1': bool, 'buzzer': bool, 'trigger': bool} at now_ns."""
+        t_us = self.micros(now_ns)
+        with self._lock:
+            return {name: t_us < end for name, end in self._end_us.items()}
+
+    def last_params(self, actuator):
+        """Return (amp, freq, duration_ms) of the last command for 'vib1' or 'buzzer'."""
+        with self._lock:
+            return self._params[actuator]
+
+    def write(self, data):
+        """Send bytes from the device to the host."""
+        self._link.send(data)
+
+    # -- firmware emulation --------------------------------------------------
+
+    def __loop(self):
+        timeout = 0.01
+        while self._active:
+            try:
+                data = self._link.recv(timeout)
+                self.rx_bytes += len(data)
+                self._buf += data
+            except OSError:
+                time.sleep(0.01)
+                continue
+            self.__parse(self.clock.now_ns())
+            if data and hasattr(self._link, "handled"):
+                self._link.handled += len(data)
+            remaining_us = self.__fire_due()
+            timeout = 0.01 if remaining_us is None else min(0.01, (remaining_us - SPIN_US) / 1e6)
+
+    def __until(self, onset_us):
+        """Signed microseconds from now to a raw 32-bit device time."""
+        delta = (onset_us - self.micros()) & 0xffffffff
+        return delta - (1 << 32) if delta >= 1 << 31 else delta
+
+    def __fire_due(self):
+        """Mirror of the firmware schedule interrupt: fire due commands in order.
+
+        Returns the microseconds until the next scheduled command, or None.
+        """
+        while self._schedule:
+            seq, onset_us, cmd, data = self._schedule[0]
+            remaining = self.__until(onset_us)
+            if remaining > SPIN_US:
+                return remaining
+            while self.__until(onset_us) > 0:
+                pass  # spin for the last microseconds
+            self._schedule.popleft()
+            fired = self.__apply(cmd, data, seq)
+            if fired is not None:
+                self.write(encode_ack(seq, fired))
+        return None
+
+    def __parse(self, now_ns):
+        """Mirror of teensyScript.ino parse_frames(): resync on the start byte, never wait."""
+        buf = self._buf
+        while buf:
+            if self._frame_ns is None:
+                start = buf.find(START_CHAR)
+                skipped = len(buf) if start < 0 else start
+                self.skipped += skipped
+                del buf[:skipped]
+                if start < 0:
+                    return
+                self._frame_ns = now_ns
+            if len(buf) >= 3 and buf[2] > BUFFER_SIZE:
+                del buf[:3]  # longer than the frame buffer: resync on the next start byte
+                self._frame_ns = None
+                self.dropped += 1
+                continue
+            if len(buf) < 3 or len(buf) < 3 + buf[2]:
+                if now_ns - self._frame_ns >= FRAME_TIMEOUT_NS:
+                    buf.clear()  # the rest of the frame never came
+                    self._frame_ns = None
+                    self.dropped += 1
+                return
+            end = 3 + buf[2]
+            source, payload = chr(buf[1]), bytes(buf[3:end])
+            del buf[:end]
+            self._frame_ns = None
+            self.frames += 1
+            self.__dispatch(source, payload)
+
+    def __dispatch(self, source, payload):
+        if source == IDENTIFY:
+            self.write(encode_ready(self.protocol, FIRMWARE_VERSION))
+        elif source == COUNTERS_REQUEST and self.protocol >= COUNTERS_PROTOCOL:
+            self.write(encode_counters(self.frames, self.malformed, self.dropped, self.skipped))
+        elif source == PING:
+            if len(payload) < 2:
+                self.malformed += 1
+                return
+            self.write(encode_pong(struct.unpack_from('<H', payload)[0], self.micros()))
+        elif source == TABLE_ENTRY:
+            if len(payload) >= 2 and payload[0] < TABLE_SIZE and len(payload) - 2 <= TABLE_DATA_SIZE \
+                    and chr(payload[1]) != TRIGGER:
+                self.table[payload[0]] = (chr(payload[1]), bytes(payload[2:]))
+            else:
+                self.malformed += 1
+        elif source == SCHEDULED:
+            try:
+                seq, onset_us, cmd, data = decode_scheduled(payload)
+            except ValueError:
+                self.malformed += 1
+                return
+            if len(data) > MULTI_MAX_PAYLOAD:
+                self.malformed += 1  # does not fit a schedule slot
+                return
+            if len(self._schedule) >= SCHEDULE_SIZE - 1:
+                self.dropped += 1  # ring buffer full
+                return
+            self._schedule.append((seq, onset_us, cmd, data))
+        elif source == FLUSH:
+            count = len(self._schedule)
+            self._schedule.clear()
+            self.write(encode_flushed(count))
+        elif source == SEQUENCED:
+            if len(payload) < 3:
+                self.malformed += 1
+                return
+            seq = struct.unpack_from('<H', payload)[0]
+            behind = (self._last_seq - seq) % SEQ_MODULO if self._last_seq is not None else None
+            if behind is not None and behind < SEQ_WINDOW and (self._seq_window >> behind) & 1:
+                self.write(encode_ack(seq, self._seq_onset[seq % SEQ_WINDOW]))  # already run: ack again only
+                return
+            onset = self.__apply(chr(payload[2]), payload[3:], seq)
+            if onset is not None:
+                if behind is None:
+                    self._last_seq, self._seq_window = seq, 1
+                elif behind < SEQ_WINDOW:
+                    self._seq_window |= 1 << behind  # older command run late
+                elif behind >= SEQ_MODULO // 2:
+                    ahead = (seq - self._last_seq) % SEQ_MODULO
+                    self._seq_window = ((self._seq_window << ahead) | 1) & 0xffffffff if ahead < SEQ_WINDOW else 1
+                    self._last_seq = seq
+                self._seq_onset[seq % SEQ_WINDOW] = onset
+                self.write(encode_ack(seq, onset))
+        else:
+            self.__apply(source, payload, None)
+
+    def __apply(self, cmd, data, seq):
+        """Mirror of apply_command(); returns the onset micros or None if rejected."""
+        if cmd == TRIGGER:
+            # stored stimulus: recorded as the command it stands for
+            if len(data) < 1 or data[0] >= TABLE_SIZE or self.table[data[0]] is None:
+                self.malformed += 1
+                return None
+            cmd, data = self.table[data[0]]
+        if cmd == MULTI and self.protocol < MULTI_PROTOCOL:
+            self.malformed += 1  # unknown to older firmware
+            return None
+        if cmd == MULTI:
+            # every command is checked before any starts, then all start at one onset
+            try:
+                commands = decode_multi(data)
+            except ValueError:
+                commands = None
+            if not commands or any(len(d) < STIMULUS_LENGTHS.get(c, MULTI_MAX_PAYLOAD + 1) for c, d in commands):
+                self.malformed += 1
+                return None
+        else:
+            if cmd not in STIMULUS_LENGTHS or len(data) < STIMULUS_LENGTHS[cmd]:
+                self.malformed += 1  # unknown command or payload too short
+                return None
+            commands = [(cmd, data)]
+        now_ns = self.clock.now_ns()
+        t_us = self.micros(now_ns)
+        for cmd, data in commands:
+            self.__start(cmd, data, seq, now_ns, t_us)
+        return t_us & 0xffffffff
+
+    def __start(self, cmd, data, seq, now_ns, t_us):
+        with self._lock:
+            self._end_us["trigger"] = t_us + TRIGGER_US
+            if cmd in ('v', 'c'):
+                amp, freq, dur = struct.unpack_from('<BHH', data)
+                self._end_us["vib1"] = t_us + dur * 1000
+                self._params["vib1"] = (amp, freq, dur)
+            if cmd in ('b', 'c'):
+                amp, freq, dur = struct.unpack_from('<BHH', data, 5 if cmd == 'c' else 0)
+                self._end_us["buzzer"] = t_us + dur * 1000
+                self._params["buzzer"] = (amp, freq, dur)
+            self.commands.append(Command(now_ns, t_us & 0xffffffff, cmd, bytes(data), seq))
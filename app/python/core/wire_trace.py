@@ -0,0 +1,210 @@
+"""Binary trace of every frame sent to and received from a device.
+
+A trace file is a header followed by blocks of records:
+
+    header   b"BSTRACE" version:u8  start_wall:f64  start_ns:i64
+    block    count:u32  frame_bytes:u32
+             count x (t_ns:i64  direction:u8  length:u16)
+             the count frames back to back (frame_bytes bytes)
+
+All integers are little-endian. t_ns is time.perf_counter_ns() when the
+frame was written (TX) or read (RX); start_wall / start_ns map it to
+time.time() (wall = start_wall + (t_ns - start_ns) / 1e9). A frame is the
+complete wire frame, start byte included. The fixed-size record headers
+of a block are contiguous, so load_trace() reads them as one NumPy array.
+
+TraceWriter buffers records in memory, so recording costs two bytearray
+appends per frame; full blocks are written to the file by a background
+thread, never by the caller. Use iter_trace() to walk a trace in Python,
+or load_trace() to get NumPy arrays (NumPy is only needed for the latter).
+"""
+import collections
+import logging
+import queue
+import struct
+import threading
+import time
+
+MAGIC = b"BSTRACE"
+VERSION = 2
+TX = 0  # host -> device
+RX = 1  # device -> host
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("<7sBdq")
+_BLOCK = struct.Struct("<II")
+_RECORD = struct.Struct("<qBH")
+FLUSH_SIZE = 64 * 1024  # bytes buffered before a block is handed to the file thread
+
+# One traced frame: t_ns (perf_counter_ns), direction (TX/RX), frame (bytes)
+TraceRecord = collections.namedtuple("TraceRecord", "t_ns direction frame")
+
+
+class TraceWriter:
+    """Append-only trace file, safe to use from several threads."""
+
+    def __init__(self, path, flush_size=FLUSH_SIZE):
+        self.path = path
+        self.flush_size = flush_size
+        self.records = 0
+        self._lock = threading.Lock()
+        self._headers = bytearray()  # record headers of the block being filled
+        self._frames = bytearray()   # and its frames
+        self._count = 0
+        self._file = open(path, "wb")
+        self._file.write(_HEADER.pack(MAGIC, VERSION, time.time(), time.perf_counter_ns()))
+        self._blocks = queue.Queue()  # encoded blocks for the file thread, None to stop it
+        self._thread = threading.Thread(target=self.__file_loop, args=(self._file,), daemon=True)
+        self._thread.start()
+
+    def record(self, direction, t_ns, frame):
+        with self._lock:
+            if self._file is None:
+                return
+            self._headers += _RECORD.pack(t_ns, direction, len(frame))
+            self._frames += frame
+            self._count += 1
+            self.records += 1
+            if len(self._headers) + len(self._frames) >= self.flush_size:
+                self.__hand_off()
+
+    def __hand_off(self):
+        # Called with _lock held: queue the current block for the file thread
+        if self._count:
+            self._blocks.put(_BLOCK.pack(self._count, len(self._frames)) + self._headers + self._frames)
+            self._headers = bytearray()
+            self._frames = bytearray()
+            self._count = 0
+
+    def __file_loop(self, file):
+        failed = False
+        while True:
+            block = self._blocks.get()
+            try:
+                if block is None:
+                    return
+                if not failed:
+                    file.write(block)
+            except OSError as e:
+                failed = True  # the rest of the session is not recorded
+                logger.error(f"Trace {self.path}: write failed, recording stopped: {e}")
+            finally:
+                self._blocks.task_done()
+
+    def flush(self):
+        """Write everything recorded so far to the file."""
+        with self._lock:
+            if self._file is None:
+                return
+            self.__hand_off()
+        self._blocks.join()
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self.__hand_off()
+            self._blocks.put(None)
+            file, self._file = self._file, None
+        self._thread.join()
+        file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_header(f):
+    """Read and check a trace header. Returns (start_wall, start_ns)."""
+    data = f.read(_HEADER.size)
+    if len(data) < _HEADER.size:
+        raise ValueError("Not a Bsense trace: file too short")
+    magic, version, start_wall, start_ns = _HEADER.unpack(data)
+    if magic != MAGIC:
+        raise ValueError("Not a Bsense trace: bad magic")
+    if version != VERSION:
+        raise ValueError(f"Unsupported trace version {version}")
+    return start_wall, start_ns
+
+
+def iter_trace(path):
+    """Yield the TraceRecords of a trace file in order.
+
+    Records cut short at the end of the file (a session that crashed) are
+    ignored.
+    """
+    with open(path, "rb") as f:
+        read_header(f)
+        data = f.read()
+    for headers, count, frames in _blocks(data):
+        pos = frames
+        for k in range(count):
+            t_ns, direction, length = _RECORD.unpack_from(data, headers + k * _RECORD.size)
+            if pos + length > len(data):
+                return
+            yield TraceRecord(t_ns, direction, data[pos:pos + length])
+            pos += length
+
+
+def _blocks(data):
+    # (offset of the record headers, record count, offset of the frames) for
+    # every block; the last one may be cut short
+    pos = 0
+    end = len(data)
+    while pos + _BLOCK.size <= end:
+        count, frame_bytes = _BLOCK.unpack_from(data, pos)
+        headers = pos + _BLOCK.size
+        frames = headers + count * _RECORD.size
+        if frames > end:
+            count = (end - headers) // _RECORD.size
+        yield headers, count, frames
+        pos = frames + frame_bytes
+
+
+def load_trace(path):
+    """Load a trace into NumPy arrays.
+
+    Returns a dict with one entry per frame in:
+        t_ns       int64   perf_counter_ns() timestamp
+        direction  uint8   TX or RX
+        source     uint8   frame source byte (e.g. ord('v'))
+        length     uint16  frame length in bytes
+        offset     int64   start of the frame in data
+    plus data (uint8, all frames back to back, without the record
+    headers), start_wall and start_ns.
+    """
+    import numpy as np
+
+    record = np.dtype([("t_ns", "<i8"), ("direction", "u1"), ("length", "<u2")])  # _RECORD
+    with open(path, "rb") as f:
+        start_wall, start_ns = read_header(f)
+        data = f.read()
+    records = []
+    frames = []
+    for headers, count, pos in _blocks(data):
+        block = np.frombuffer(data, dtype=record, count=count, offset=headers) if count else np.zeros(0, record)
+        # a block cut short keeps the records whose frame is complete
+        ends = pos + np.cumsum(block["length"], dtype=np.int64)
+        block = block[ends <= len(data)]
+        records.append(block)
+        frames.append(data[pos:pos + int(block["length"].sum(dtype=np.int64))])
+    records = np.concatenate(records) if records else np.zeros(0, record)
+    raw = np.frombuffer(b"".join(frames), dtype=np.uint8)
+    length = records["length"].copy()
+    offset = np.cumsum(length, dtype=np.int64) - length
+    return {
+        "t_ns": records["t_ns"].copy(),
+        "direction": records["direction"].copy(),
+        "source": raw[offset + 1] if len(offset) else np.zeros(0, dtype=np.uint8),
+        "length": length,
+        "offset": offset,
+        "data": raw,
+        "start_wall": start_wall,
+        "start_ns": start_ns,
+    }
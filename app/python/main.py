@@ -1,11 +1,71 @@
-import ui.main_window
 import sys
+import time
 import logging
+import multiprocessing
+from core.arduino_communication import discover_devices
+
+END_MARGIN = 30.0  # seconds a headless run may overrun its planned duration before it is stopped
+
+
+def run_headless(ports, file, channel_map, stats_path=None, reconnect=None, trace_path=None, timing_path=None,
+                 device_scheduling=False, acks=False):
+    """Run an experiment file on one or more devices without the GUI."""
+    from core.device_group import DeviceGroup
+    from core.experiment import Experiment
+
+    group = DeviceGroup(channel_map=channel_map)
+    exp = Experiment(devices=group, stats_path=stats_path, reconnect=reconnect, trace_path=trace_path,
+                     timing_path=timing_path, device_scheduling=device_scheduling, acks=acks)
+    ended = []
+
+    def log(text):
+        logging.info(text)
+        if text == "End of experiment":
+            ended.append(True)
+
+    exp.add_cb_log(log)
+    try:
+        exp.from_json(file)
+        unused = group.unused_channels(exp.channels)
+        if unused:
+            logging.error(f"-c channel(s) not used by {file}: {', '.join(unused)}")
+            return 2
+        try:
+            exp.connect_arduino(ports)
+        except ValueError as e:
+            logging.error(str(e))
+            return 2
+        exp.start()
+        # ends with the plan, or earlier on a stimulus error or a lost link; with
+        # --reconnect an outage can stretch the run, so there is no bound then
+        timeout = None if reconnect else exp.duration_s + END_MARGIN
+        if not exp.wait_finished(timeout):
+            logging.error(f"{file} still running {timeout:.0f} s after start, stopping it")
+            exp.stop()
+        time.sleep(0.1)  # let the writer threads drain the last frames
+        for name, stats in group.skew_summary().items():
+            if stats["count"]:
+                logging.info(f"{name}: mean {stats['mean'] / 1e3:.1f} us, max {stats['max'] / 1e3:.1f} us "
+                             f"over {stats['count']} events")
+    finally:
+        exp.close()
+    return 0 if ended else 1
 
 if __name__ == "__main__":
+    # frozen builds (PyInstaller): a spawned engine process (--rt) must run the engine, not main
+    multiprocessing.freeze_support()
     debug = False
     port = None  # Will use platform default if not specified
     file = ""
+    headless = False
+    channel_map = {}
+    stats_path = None
+    reconnect = None
+    trace_path = None
+    timing_path = None
+    realtime = False
+    device_scheduling = False
+    acks = False
 
     # Parse command line arguments
     args = sys.argv[1:]
@@ -19,6 +79,31 @@ if __name__ == "__main__":
         elif args[i] == "-f" and i + 1 < len(args):
             file = args[i + 1]
             i += 1
+        elif args[i] == "--stats" and i + 1 < len(args):
+            stats_path = args[i + 1]
+            i += 1
+        elif args[i] == "--reconnect" and i + 1 < len(args):
+            reconnect = args[i + 1]
+            i += 1
+        elif args[i] == "--trace" and i + 1 < len(args):
+            trace_path = args[i + 1]
+            i += 1
+        elif args[i] == "--timing" and i + 1 < len(args):
+            timing_path = args[i + 1]
+            i += 1
+        elif args[i] == "--rt":
+            realtime = True
+        elif args[i] == "--device-timing":
+            device_scheduling = True
+        elif args[i] == "--acks":
+            acks = True
+        elif args[i] == "--headless":
+            headless = True
+        elif args[i] == "-c" and i + 1 < len(args):
+            # -c <channel>=<device index>[,<device index>...]
+            name, _, indices = args[i + 1].partition("=")
+            channel_map[name] = [int(k) for k in indices.split(",") if k]
+            i += 1
         i += 1
 
     # Configure logging based on debug mode
@@ -28,11 +113,39 @@ if __name__ == "__main__":
         format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     )
 
-    gui = ui.main_window.BsenseGUI()
+    if port == "auto":
+        # Probe all serial ports for Bsense devices and use the first one found
+        devices = discover_devices()
+        for device in devices:
+            logging.info(f"Found Bsense on {device.port}: firmware {device.firmware}, serial {device.serial_number}")
+        if devices:
+            # headless runs drive every device found, the GUI uses the first one
+            port = ",".join(d.port for d in devices) if headless else devices[0].port
+        else:
+            logging.warning("No Bsense device found (-p auto)")
+            port = None
+
+    if headless or (port and "," in port):
+        if not port or not file:
+            logging.error("Headless mode needs -p <port>[,<port>...] and -f <file>")
+            sys.exit(2)
+        if realtime:
+            logging.warning("--rt only applies to the GUI; the headless run keeps the engine in this process")
+        sys.exit(run_headless(port, file, channel_map, stats_path, reconnect, trace_path, timing_path,
+                              device_scheduling, acks))
+    if device_scheduling or acks:
+        logging.warning("--device-timing and --acks only apply to headless runs")
+
+    import ui.main_window
+    gui = ui.main_window.BsenseGUI(realtime=realtime)
     if debug:
         gui.debug_mode()
     if port:
         gui.set_port(port)
     if file:
         gui.set_file(file)
+    if reconnect:
+        gui.set_reconnect(reconnect)
+    if trace_path:
+        gui.set_trace(trace_path)
     gui.run()
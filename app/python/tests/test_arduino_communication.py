@@ -5,7 +5,35 @@ import os
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from core.arduino_communication import ArduinoCom
+import queue
+import threading
+import time
+from unittest import mock
+import serial
+
+from core.arduino_communication import ArduinoCom, discover_devices
+from core.protocol import encode_signal, encode_ack, encode_pong, decode_sequenced, FrameParser
+
+
+class FakePort:
+    """Minimal stand-in for serial.Serial that records written frames."""
+
+    def __init__(self, block=None, fail=False):
+        self.is_open = True
+        self.written = []
+        self.block = block  # threading.Event the write waits on
+        self.fail = fail
+
+    def write(self, data):
+        if self.block is not None:
+            self.block.wait(timeout=2.0)
+        if self.fail:
+            raise serial.SerialException("write failed")
+        self.written.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.is_open = False
 
 
 class TestSignalValidation(unittest.TestCase):
@@ -95,6 +123,245 @@ class TestSignalEncoding(unittest.TestCase):
         self.arduino.send_signal(('c', 0.5, 170, 500, 0.3, 1000, 300))
 
 
+class AckingPort(FakePort):
+    """Fake port that acknowledges sequenced frames and answers pings like the firmware does."""
+
+    def __init__(self, drop_acks=0):
+        super().__init__()
+        self.drop_acks = drop_acks  # number of acks to swallow (simulates loss)
+        self.executed = []
+        self._parser = FrameParser()
+        self._rx = bytearray()
+        self._lock = threading.Lock()
+        self.timeout = 0.01
+
+    def write(self, data):
+        super().write(data)
+        for source, payload in self._parser.feed(data):
+            if source == 'p':
+                with self._lock:
+                    self._rx += encode_pong(int.from_bytes(payload[:2], 'little'), 777)
+                continue
+            if source != 'q':
+                continue
+            seq, cmd, _ = decode_sequenced(payload)
+            if seq not in self.executed:
+                self.executed.append(seq)
+            if self.drop_acks > 0:
+                self.drop_acks -= 1
+                continue
+            with self._lock:
+                self._rx += encode_ack(seq, 1000 + seq)
+        return len(data)
+
+    @property
+    def in_waiting(self):
+        return len(self._rx)
+
+    def read(self, size=1):
+        with self._lock:
+            if not self._rx:
+                data = b""
+            else:
+                data = bytes(self._rx[:size])
+                del self._rx[:size]
+        if not data:
+            threading.Event().wait(self.timeout)
+        return data
+
+
+class TestAcknowledgements(unittest.TestCase):
+    """Tests for sequenced frames and the reader thread."""
+
+    def setUp(self):
+        self.arduino = ArduinoCom()
+        self.frame = encode_signal(('v', 0.5, 170, 100))
+
+    def tearDown(self):
+        self.arduino.stop_reader()
+        self.arduino.stop_writer()
+
+    def test_ack_matches_handle(self):
+        """Each submitted frame is matched with its ack and timed."""
+        self.arduino.arduino = AckingPort()
+        self.arduino.enable_acks(timeout=0.5)
+        handles = [self.arduino.submit(self.frame) for _ in range(3)]
+        for i, handle in enumerate(handles):
+            self.assertEqual(handle.seq, i)
+            self.assertTrue(handle.wait_ack(timeout=1.0))
+            self.assertEqual(handle.device_us, 1000 + i)
+            self.assertGreaterEqual(handle.rtt_ns, 0)
+        self.assertEqual(self.arduino.acked_frames, 3)
+        self.assertEqual(self.arduino.pending_acks, 0)
+
+    def test_sequenced_frame_wraps_command(self):
+        """The written frame carries the sequence number and original command."""
+        self.arduino.arduino = AckingPort()
+        self.arduino.enable_acks()
+        handle = self.arduino.submit(self.frame)
+        source, payload = FrameParser().feed(handle.frame)[0]
+        self.assertEqual(source, 'q')
+        self.assertEqual(decode_sequenced(payload), (0, 'v', self.frame[3:]))
+
+    def test_retransmit_on_timeout(self):
+        """A missing ack triggers a retransmission, which is then acked."""
+        self.arduino.arduino = AckingPort(drop_acks=1)
+        self.arduino.enable_acks(timeout=0.05, retransmits=2)
+        handle = self.arduino.submit(self.frame)
+        self.assertTrue(handle.wait_ack(timeout=1.0))
+        self.assertEqual(handle.attempts, 2)
+        self.assertEqual(self.arduino.retransmits, 1)
+        self.assertEqual(len(self.arduino.arduino.written), 2)
+
+    def test_lost_without_retransmit(self):
+        """Without retransmits an unacknowledged frame is reported lost."""
+        reported = []
+        self.arduino.arduino = AckingPort(drop_acks=1)
+        self.arduino.ack_cb = reported.append
+        self.arduino.enable_acks(timeout=0.05)
+        handle = self.arduino.submit(self.frame)
+        self.assertFalse(handle.wait_ack(timeout=1.0))
+        self.assertTrue(handle.lost)
+        self.assertEqual(self.arduino.lost_frames, 1)
+        self.assertEqual(reported, [handle])
+
+    def test_failing_callback_keeps_reader(self):
+        """An exception in ack_cb is logged; later acks are still processed."""
+        def fail(handle):
+            raise TypeError("bad callback")
+        self.arduino.arduino = AckingPort()
+        self.arduino.ack_cb = fail
+        self.arduino.enable_acks(timeout=0.5)
+        with self.assertLogs("core.arduino_communication", level="ERROR"):
+            first = self.arduino.submit(self.frame)
+            self.assertTrue(first.wait_ack(timeout=1.0))
+            second = self.arduino.submit(self.frame)
+            self.assertTrue(second.wait_ack(timeout=1.0))
+        self.assertEqual(self.arduino.acked_frames, 2)
+
+    def test_read_error_on_open_port(self):
+        """A TypeError from the read of a port that is still open drops the link instead of looping."""
+        class BrokenPort(AckingPort):
+            def read(self, size=1):
+                raise TypeError("broken read")
+        lost = threading.Event()
+        self.arduino.arduino = BrokenPort()
+        self.arduino.disconnect_cb = lambda error: lost.set()
+        with self.assertLogs("core.arduino_communication", level="ERROR"):
+            self.arduino.start_reader()
+            self.assertTrue(lost.wait(1.0))
+        self.assertIsNone(self.arduino.arduino)
+
+    def test_acks_with_writer_thread(self):
+        """Acks also work when writes go through the writer thread."""
+        self.arduino.arduino = AckingPort()
+        self.arduino.start_writer()
+        self.arduino.enable_acks(timeout=0.5)
+        handle = self.arduino.submit(self.frame)
+        self.assertTrue(handle.wait_ack(timeout=1.0))
+
+
+class TestClockSyncService(unittest.TestCase):
+    """Tests for the ping/pong exchange run by ArduinoCom."""
+
+    def setUp(self):
+        self.arduino = ArduinoCom()
+
+    def tearDown(self):
+        self.arduino.stop_clock_sync()
+        self.arduino.stop_reader()
+
+    def test_clock_sync_gets_samples(self):
+        """Pongs are matched to pings and fed to the estimator."""
+        self.arduino.arduino = AckingPort()
+        self.arduino.start_clock_sync(interval=0.01)
+        for _ in range(100):
+            if self.arduino.clock.sample_count >= 2:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(self.arduino.clock.synced)
+        self.assertIsInstance(self.arduino.device_to_host(777), int)
+        self.assertIsInstance(self.arduino.device_to_wall(777), float)
+
+
+class TestAsyncWriter(unittest.TestCase):
+    """Tests for the background writer thread and write handles."""
+
+    def setUp(self):
+        self.arduino = ArduinoCom()
+        self.frame = encode_signal(('v', 0.5, 170, 100))
+
+    def tearDown(self):
+        self.arduino.stop_writer()
+
+    def test_submit_without_writer_is_synchronous(self):
+        """Without the writer thread submit writes immediately."""
+        self.arduino.arduino = FakePort()
+        handle = self.arduino.submit(self.frame)
+        self.assertTrue(handle.done())
+        self.assertEqual(self.arduino.arduino.written, [self.frame])
+        self.assertGreaterEqual(handle.latency_ns, 0)
+
+    def test_writer_completes_handles(self):
+        """Queued frames are written in order and timestamped."""
+        self.arduino.arduino = FakePort()
+        self.arduino.start_writer(maxsize=8)
+        handles = [self.arduino.submit(self.frame) for _ in range(3)]
+        for handle in handles:
+            self.assertTrue(handle.wait(timeout=1.0))
+            self.assertIsNone(handle.error)
+            self.assertGreaterEqual(handle.complete_ns, handle.enqueue_ns)
+        self.assertEqual(len(self.arduino.arduino.written), 3)
+
+    def test_queue_full_rejects_without_blocking(self):
+        """A full queue raises queue.Full instead of blocking the caller."""
+        release = threading.Event()
+        self.arduino.arduino = FakePort(block=release)
+        self.arduino.start_writer(maxsize=1)
+        first = self.arduino.submit(self.frame)
+        deadline = time.monotonic() + 1.0
+        while self.arduino.queue_depth > 0:  # wait for the writer to take it and block in write()
+            self.assertLess(time.monotonic(), deadline, "writer did not take the frame")
+        second = self.arduino.submit(self.frame)
+        with self.assertRaises(queue.Full):
+            self.arduino.submit(self.frame)
+        self.assertEqual(self.arduino.rejected_writes, 1)
+        self.assertEqual(self.arduino.queue_capacity, 1)
+        release.set()
+        self.assertTrue(first.wait(timeout=1.0))
+        self.assertTrue(second.wait(timeout=1.0))
+
+    def test_stop_with_stalled_write(self):
+        """stop_writer() returns when write() is stalled and the queue full; queued frames fail."""
+        release = threading.Event()
+        self.arduino.arduino = FakePort(block=release)
+        self.arduino.start_writer(maxsize=1)
+        self.arduino.submit(self.frame)
+        deadline = time.monotonic() + 1.0
+        while self.arduino.queue_depth > 0:
+            self.assertLess(time.monotonic(), deadline, "writer did not take the frame")
+        queued = self.arduino.submit(self.frame)
+        start = time.monotonic()
+        with self.assertLogs("core.arduino_communication", level="WARNING"):
+            self.arduino.stop_writer(timeout=0.1)
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertFalse(self.arduino.writer_running)
+        self.assertTrue(queued.done())
+        self.assertIsInstance(queued.error, serial.SerialException)
+        release.set()
+
+    def test_write_error_notifies(self):
+        """A failed background write is reported on the handle and callback."""
+        errors = []
+        self.arduino.arduino = FakePort(fail=True)
+        self.arduino.disconnect_cb = errors.append
+        self.arduino.start_writer()
+        handle = self.arduino.submit(self.frame)
+        self.assertTrue(handle.wait(timeout=1.0))
+        self.assertIsInstance(handle.error, serial.SerialException)
+        self.assertEqual(len(errors), 1)
+
+
 class TestConnectionState(unittest.TestCase):
     """Tests for connection state management."""
 
@@ -112,7 +379,6 @@ class TestConnectionState(unittest.TestCase):
 
     def test_check_connection_when_not_connected(self):
         """check_connection when not connected should raise SerialException."""
-        import serial
         with self.assertRaises(serial.SerialException) as ctx:
             self.arduino.check_connection()
         self.assertIn("disconnected", str(ctx.exception).lower())
@@ -136,5 +402,93 @@ class TestConnectionRetry(unittest.TestCase):
         )
 
 
+class ListedPort:
+    """Stand-in for a serial.tools.list_ports entry."""
+
+    def __init__(self, device, vid, serial_number=None):
+        self.device = device
+        self.vid = vid
+        self.serial_number = serial_number
+
+
+class TestDiscoveryCandidates(unittest.TestCase):
+    """Tests for the choice of ports discover_devices() writes to."""
+
+    def setUp(self):
+        self.listed = [ListedPort("/dev/ttyACM0", 0x16C0, "1234"), ListedPort("/dev/ttyUSB0", 0x067B, "GPS"),
+                       ListedPort("/dev/ttyACM1", 0x2341, "5678"), ListedPort("/dev/ttyS0", None)]
+        self.probed = []
+
+    def discover(self, **kwargs):
+        def probe(path, timeout, serial_number):
+            self.probed.append((path, serial_number))
+        with mock.patch("serial.tools.list_ports.comports", return_value=self.listed), \
+                mock.patch("core.arduino_communication.probe_port", probe):
+            discover_devices(**kwargs)
+        return sorted(self.probed)
+
+    def test_only_teensy_and_arduino_probed(self):
+        self.assertEqual(self.discover(), [("/dev/ttyACM0", "1234"), ("/dev/ttyACM1", "5678")])
+
+    def test_by_serial_number(self):
+        self.assertEqual(self.discover(serial_numbers={"5678"}), [("/dev/ttyACM1", "5678")])
+
+    def test_explicit_ports_probed_as_given(self):
+        self.assertEqual(self.discover(ports=["/dev/ttyUSB0"]), [("/dev/ttyUSB0", "GPS")])
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "pseudo-terminals not available")
+class TestHandshake(unittest.TestCase):
+    """Tests for the ready banner handshake in connect()."""
+
+    def setUp(self):
+        self.arduino = ArduinoCom()
+        self.master, self.slave = os.openpty()
+        self.port = os.ttyname(self.slave)
+
+    def tearDown(self):
+        self.arduino.disconnect()
+        os.close(self.master)
+        os.close(self.slave)
+
+    def test_legacy_firmware_fallback(self):
+        """Without a banner connect() succeeds after the handshake timeout."""
+        self.arduino.connect(self.port, retries=1, handshake_timeout=0.1)
+        self.assertTrue(self.arduino.is_connected())
+        self.assertIsNone(self.arduino.device_info)
+        self.assertFalse(self.arduino.load_table([encode_signal(('v', 1.0, 170, 100))]))
+        self.assertFalse(self.arduino.table_loaded)
+
+    def test_single_identify(self):
+        """Only one identify frame is sent while waiting (legacy firmware reads it as a trigger)."""
+        from core.protocol import encode_identify
+        self.arduino.connect(self.port, retries=1, handshake_timeout=0.3)
+        self.assertEqual(os.read(self.master, 1024), encode_identify())
+
+    def test_port_closed_when_handshake_fails(self):
+        """A port whose handshake raises is closed before the next attempt."""
+        opened = []
+
+        def open_failing(path, timeout):
+            opened.append(FakePort(fail=True))
+            return opened[-1]
+
+        with mock.patch("core.arduino_communication.open_transport", open_failing):
+            with self.assertRaises(Exception):
+                self.arduino.connect(self.port, retries=2, retry_delay=0.01)
+        self.assertEqual(len(opened), 2)
+        self.assertFalse(any(port.is_open for port in opened))
+
+    def test_banner_sets_device_info(self):
+        """A ready banner ends the handshake and reports the firmware."""
+        from core.protocol import encode_ready
+        answer = threading.Timer(0.05, lambda: os.write(self.master, encode_ready(2, "1.2.0")))
+        answer.start()
+        self.arduino.connect(self.port, retries=1, handshake_timeout=1.0)
+        answer.join()
+        self.assertEqual(self.arduino.device_info.protocol, 2)
+        self.assertEqual(self.arduino.device_info.firmware, "1.2.0")
+
+
 if __name__ == '__main__':
     unittest.main()
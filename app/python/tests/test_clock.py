@@ -0,0 +1,65 @@
+import unittest
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.clock import SystemClock, SimulatedClock
+
+
+class TestSystemClock(unittest.TestCase):
+    """Tests for the sleep-then-spin wait on the host clock."""
+
+    def test_wait_reaches_deadline(self):
+        clock = SystemClock()
+        deadline = clock.now_ns() + 20_000_000
+        self.assertTrue(clock.wait_until(deadline, threading.Event()))
+        self.assertGreaterEqual(clock.now_ns(), deadline)
+
+    def test_stop_interrupts_wait(self):
+        clock = SystemClock()
+        stop = threading.Event()
+        threading.Timer(0.02, stop.set).start()
+        t0 = time.perf_counter()
+        self.assertFalse(clock.wait_until(clock.now_ns() + 5_000_000_000, stop))
+        self.assertLess(time.perf_counter() - t0, 1.0)
+
+
+class TestSimulatedClock(unittest.TestCase):
+    """Tests for the clock that jumps to its deadlines."""
+
+    def test_wait_jumps_forward_only(self):
+        clock = SimulatedClock(start_ns=1000)
+        stop = threading.Event()
+        self.assertTrue(clock.wait_until(3600 * 10 ** 9, stop))
+        self.assertEqual(clock.now_ns(), 3600 * 10 ** 9)
+        clock.wait_until(5, stop)
+        self.assertEqual(clock.now_ns(), 3600 * 10 ** 9)
+        clock.advance(10)
+        self.assertEqual(clock.now_ns(), 3600 * 10 ** 9 + 10)
+
+    def test_stopped_wait_does_not_move(self):
+        clock = SimulatedClock()
+        stop = threading.Event()
+        stop.set()
+        self.assertFalse(clock.wait_until(10 ** 9, stop))
+        self.assertEqual(clock.now_ns(), 0)
+
+    def test_wait_settles_devices_first(self):
+        """The clock only moves once every registered device reports idle."""
+        clock = SimulatedClock()
+        busy = threading.Event()
+        busy.set()
+        clock.add_settle(lambda: not busy.is_set())
+        threading.Timer(0.05, busy.clear).start()
+        t0 = time.perf_counter()
+        clock.wait_until(10 ** 9, threading.Event())
+        self.assertGreaterEqual(time.perf_counter() - t0, 0.04)
+        self.assertEqual(clock.now_ns(), 10 ** 9)
+
+
+if __name__ == '__main__':
+    unittest.main()
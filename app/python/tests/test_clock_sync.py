@@ -0,0 +1,96 @@
+import unittest
+import random
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.clock_sync import ClockSync, MICROS_WRAP
+
+
+class SimulatedDevice:
+    """Device clock running with a fixed offset and drift relative to the host."""
+
+    def __init__(self, offset_us=5_000_000, drift_ppm=30.0):
+        self.offset_us = offset_us
+        self.rate = 1.0 + drift_ppm * 1e-6
+
+    def micros(self, host_ns):
+        return int(self.offset_us + host_ns / 1000.0 * self.rate) % MICROS_WRAP
+
+    def exchange(self, host_ns, rng):
+        """Return (send_ns, recv_ns, device_us) for a ping sent at host_ns."""
+        up = rng.randint(100_000, 600_000)    # 0.1-0.6 ms each way (USB full speed)
+        down = rng.randint(100_000, 600_000)
+        return host_ns, host_ns + up + down, self.micros(host_ns + up)
+
+
+class TestClockSync(unittest.TestCase):
+    """Tests for the ping/pong clock estimator."""
+
+    def setUp(self):
+        self.rng = random.Random(1)
+
+    def run_session(self, sync, device, start_ns, duration_s, interval_s=1.0):
+        t = start_ns
+        end = start_ns + int(duration_s * 1e9)
+        while t < end:
+            sync.add_sample(*device.exchange(t, self.rng))
+            t += int(interval_s * 1e9)
+        return t
+
+    def test_not_synced_initially(self):
+        """Mapping is unavailable before the first exchange."""
+        sync = ClockSync()
+        self.assertFalse(sync.synced)
+        with self.assertRaises(RuntimeError):
+            sync.device_to_host(0)
+
+    def test_sub_millisecond_mapping(self):
+        """Offset and drift are recovered to well under a millisecond."""
+        sync = ClockSync()
+        device = SimulatedDevice()
+        now = self.run_session(sync, device, 10**12, 120)
+        for host_ns in (now - 30 * 10**9, now - 10**9, now):
+            error = abs(sync.device_to_host(device.micros(host_ns)) - host_ns)
+            self.assertLess(error, 500_000)
+        self.assertAlmostEqual(sync.drift_ppm, 30.0, delta=10.0)
+
+    def test_micros_wraparound(self):
+        """Mapping stays stable across the 32-bit micros() wrap over hours."""
+        sync = ClockSync()
+        device = SimulatedDevice(offset_us=MICROS_WRAP - 60_000_000)  # wraps after one minute
+        now = self.run_session(sync, device, 10**12, 3 * 3600, interval_s=10.0)
+        error = abs(sync.device_to_host(device.micros(now)) - now)
+        self.assertLess(error, 500_000)
+
+    def test_host_to_device_roundtrip(self):
+        """host_to_device inverts device_to_host."""
+        sync = ClockSync()
+        device = SimulatedDevice()
+        now = self.run_session(sync, device, 10**12, 30)
+        device_us = sync.host_to_device(now)
+        self.assertLess(abs(sync.device_to_host(device_us) - now), 2_000)
+
+    def test_noisy_burst_keeps_nominal_rate(self):
+        """Samples too close together to resolve drift do not skew the mapping."""
+        sync = ClockSync()
+        device = SimulatedDevice(drift_ppm=0.0)
+        sync.add_sample(10**12, 10**12 + 200_000, device.micros(10**12 + 100_000))
+        sync.add_sample(10**12 + 1_000_000, 10**12 + 11_000_000, device.micros(10**12 + 1_100_000))
+        self.assertEqual(sync.drift_ppm, 0.0)
+        later = 10**12 + 10 * 10**9
+        self.assertLess(abs(sync.device_to_host(device.micros(later)) - later), 10_000_000)
+
+    def test_reset(self):
+        """Reset drops all samples."""
+        sync = ClockSync()
+        self.run_session(sync, SimulatedDevice(), 10**12, 5)
+        sync.reset()
+        self.assertFalse(sync.synced)
+        self.assertEqual(sync.sample_count, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
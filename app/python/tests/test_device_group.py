@@ -0,0 +1,109 @@
+import unittest
+import sys
+import os
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.device_group import DeviceGroup
+from core.experiment import Experiment
+from core.protocol import encode_signal
+from core.virtual_device import VirtualBsense
+
+
+def wait_for(predicate, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "pseudo-terminals not available")
+class TestDeviceGroup(unittest.TestCase):
+    """Tests for driving several virtual devices as one output."""
+
+    def setUp(self):
+        self.boxes = [VirtualBsense() for _ in range(3)]
+        for box in self.boxes:
+            box.start()
+        self.group = DeviceGroup(channel_map={"left": [0], "right": [1, 2]})
+        self.group.connect(",".join(box.port for box in self.boxes))
+
+    def tearDown(self):
+        self.group.close()
+        for box in self.boxes:
+            box.stop()
+
+    def test_broadcast_releases_at_shared_deadline(self):
+        """Unmapped stimuli reach every device, none before the deadline."""
+        event = self.group.submit(encode_signal(('v', 0.5, 170, 10)))
+        self.assertTrue(event.wait(1.0))
+        self.assertTrue(wait_for(lambda: all(box.commands for box in self.boxes)))
+        for handle in event.handles.values():
+            self.assertGreaterEqual(handle.complete_ns, event.deadline_ns)
+        self.assertIsNotNone(event.write_skew_ns)
+        self.assertLess(event.write_skew_ns, 5_000_000)
+        summary = self.group.skew_summary()
+        self.assertEqual(summary["write_skew_ns"]["count"], 1)
+        self.assertIsNone(summary["onset_skew_ns"]["mean"])
+
+    def test_channel_mapping(self):
+        """A mapped channel only reaches its devices."""
+        self.group.submit(encode_signal(('b', 0.5, 1000, 10)), channel="right").wait(1.0)
+        self.assertTrue(wait_for(lambda: self.boxes[1].commands and self.boxes[2].commands))
+        time.sleep(0.05)
+        self.assertEqual(self.boxes[0].commands, [])
+
+    def test_numeric_channel(self):
+        """A numeric Channel matches the same name given on the command line (always a string)."""
+        group = DeviceGroup(channel_map={"1": [2]})
+        group.devices = self.group.devices  # share the open connections
+        self.assertEqual(list(group.devices_for(1)), [2])
+        self.assertEqual(list(group.devices_for("1")), [2])
+
+    def test_index_out_of_range_rejected(self):
+        """Mapping a channel to a device that was not given fails before connecting."""
+        group = DeviceGroup(channel_map={"booth": [5]})
+        with self.assertRaises(ValueError) as ctx:
+            group.connect(",".join(box.port for box in self.boxes[:2]))
+        self.assertIn("booth", str(ctx.exception))
+        self.assertEqual(group.devices, [])
+
+    def test_unused_channels(self):
+        exp = Experiment(devices=self.group)
+        try:
+            exp.from_dict({"Type": "stimulus", "Content": [
+                {"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 10, "Channel": "left"}]})
+            self.assertEqual(exp.channels, {"left"})
+            self.assertEqual(self.group.unused_channels(exp.channels), ["right"])
+        finally:
+            exp.close()
+
+    def test_onset_skew_with_acks(self):
+        """With acks and clock sync the device onset spread is recorded."""
+        self.group.enable_acks()
+        self.group.start_clock_sync(interval=0.05)
+        self.assertTrue(wait_for(lambda: all(d.clock.synced for d in self.group.devices), 2.0))
+        event = self.group.submit(encode_signal(('v', 0.5, 170, 10)))
+        self.assertTrue(wait_for(lambda: event.onset_skew_ns is not None))
+        self.assertLess(event.onset_skew_ns, 10_000_000)
+
+    def test_experiment_channel_field(self):
+        """Experiment routes stimuli by their Channel field."""
+        exp = Experiment(devices=self.group)
+        try:
+            exp.from_dict({"Type": "stimulus", "Content": [
+                {"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 10, "channel": "left"}]})
+            exp.start()
+            self.assertTrue(wait_for(lambda: self.boxes[0].commands))
+            time.sleep(0.05)
+            self.assertEqual(self.boxes[1].commands, [])
+        finally:
+            exp.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
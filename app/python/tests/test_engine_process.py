@@ -0,0 +1,115 @@
+import unittest
+import sys
+import os
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.engine_process import ExperimentProcess, apply_realtime, default_placement
+from core.virtual_device import VirtualBsense
+
+
+def wait_for(predicate, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+def stimuli(n, delay):
+    return {"Type": "Sequence", "Repeat": n, "Content": [
+        {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+        {"Type": "Delay", "Duration": delay}]}
+
+
+class TestRealtimePlacement(unittest.TestCase):
+    """Tests for the CPU / scheduling policy helpers."""
+
+    def test_nothing_requested(self):
+        info = apply_realtime()
+        self.assertEqual(info, {"tid": threading.get_native_id(), "cpu": None, "policy": "default",
+                                "priority": None})
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ValueError):
+            apply_realtime(policy="idle")
+        with self.assertRaises(ValueError):
+            ExperimentProcess(policy="idle")
+
+    def test_default_placement(self):
+        cpu, priority = default_placement()
+        self.assertTrue(1 <= priority <= 99)
+        if cpu is not None:
+            self.assertIn(cpu, os.sched_getaffinity(0))
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "pseudo-terminals not available")
+class TestExperimentProcess(unittest.TestCase):
+    """Tests for the experiment engine in a child process, driving a pty VirtualBsense."""
+
+    def setUp(self):
+        self.device = VirtualBsense()
+        self.device.start()
+        self.exp = ExperimentProcess(*default_placement(), async_writes=True)
+        self.logs = []
+        self.events = []
+        self.exp.add_cb_log(self.logs.append)
+        self.exp.add_cb_event(self.events.append)
+        self.exp.connect_arduino(self.device.port)
+
+    def tearDown(self):
+        self.exp.close()
+        self.device.stop()
+
+    def test_engine_in_child(self):
+        self.assertNotEqual(self.exp.engine_info["pid"], os.getpid())
+        self.assertTrue(self.exp.process.is_alive())
+
+    @unittest.skipUnless(hasattr(os, "sched_getscheduler"), "scheduling policies not available")
+    def test_only_timing_threads_raised(self):
+        """The scheduler and writer get the real-time policy, the rest of the child does not."""
+        info = self.exp.engine_info
+        self.assertEqual(set(info["threads"]), {"scheduler", "writer"})
+        self.assertEqual(os.sched_getscheduler(info["pid"]), os.SCHED_OTHER)  # the child's main thread
+        if info["policy"] == "fifo":
+            for tid in info["threads"].values():
+                self.assertEqual(os.sched_getscheduler(tid), os.SCHED_FIFO)
+
+    def test_run_to_end(self):
+        """The plan runs in the child; log lines and events come back through the callbacks."""
+        self.exp.from_dict(stimuli(10, 0.01))
+        self.assertEqual(len(self.exp.sequence), 20)
+        self.assertEqual(self.exp.sequence[0][1], "Vib1")
+        self.exp.start()
+        self.assertTrue(wait_for(lambda: "End of experiment" in self.logs))
+        self.assertTrue(wait_for(lambda: len(self.device.commands) == 10))
+        self.assertEqual(self.events[-1], 19)
+        self.assertFalse(self.exp.running)
+        self.assertEqual(self.exp.timing_stats()["events"], 10)
+
+    def test_attributes_round_trip(self):
+        self.exp.from_dict(stimuli(5, 1))
+        self.exp.current_idx = 4
+        self.assertEqual(self.exp.current_idx, 4)
+        self.assertFalse(self.exp.running)
+        self.exp.timing_path = "run_timing.csv"
+        self.assertEqual(self.exp.timing_path, "run_timing.csv")
+
+    def test_errors_raised_in_parent(self):
+        with self.assertRaises(ValueError):
+            self.exp.from_dict({"Type": "Sequence", "Repeat": 1, "Content": [{"Type": "Nap"}]})
+        self.exp.from_dict(stimuli(1, 0.01))  # the engine still serves commands
+
+    def test_close_ends_process(self):
+        self.exp.close()
+        self.assertFalse(self.exp.process.is_alive())
+        with self.assertRaises(RuntimeError):
+            self.exp.start()
+
+
+if __name__ == '__main__':
+    unittest.main()
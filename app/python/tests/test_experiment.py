@@ -1,11 +1,14 @@
 import unittest
 import sys
 import os
+import threading
+import time
 
 # Add parent directory to path for imports
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from core.experiment import Experiment
+from core.clock import SimulatedClock
 
 
 class TestCaseInsensitivity(unittest.TestCase):
@@ -182,6 +185,83 @@ class TestStimulusValidation(unittest.TestCase):
             self.exp.from_dict(rules)
         self.assertIn("Frequency", str(ctx.exception))
 
+    def test_stimulus_frame_precompiled(self):
+        """Stimulus events carry their wire frame, built at load time."""
+        rules = {
+            "Type": "stimulus",
+            "Content": [{"Type": "Vib1", "Amplitude": 1.0, "Frequency": 170, "Duration": 100}]
+        }
+        self.exp.from_dict(rules)
+        frame = self.exp.sequence[0][3]
+        self.assertIsInstance(frame, bytes)
+        self.assertEqual(frame, bytes([0xaa, ord('v'), 5, 255, 170, 0, 100, 0]))
+
+    def test_stimulus_table_deduplicated(self):
+        """Repeated stimuli share one table entry and its trigger frame."""
+        rules = {
+            "Type": "Sequence",
+            "Repeat": 10,
+            "Content": [
+                {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 1.0, "Frequency": 170, "Duration": 100}]},
+                {"Type": "stimulus", "Content": [{"Type": "Buzzer", "Amplitude": 0.5, "Tone": 1000, "Duration": 30}]},
+                {"Type": "Delay", "Duration": 0.1},
+            ]
+        }
+        self.exp.from_dict(rules)
+        self.assertEqual(len(self.exp.stimulus_table), 2)
+        stimuli = [event for event in self.exp.sequence if event[1] != "Delay"]
+        self.assertEqual({event[5] for event in stimuli}, {bytes([0xaa, ord('x'), 1, i]) for i in (0, 1)})
+        for event in stimuli:
+            self.assertEqual(self.exp.stimulus_table[event[5][3]], event[3])
+
+    def test_stimulus_table_overflow(self):
+        """Beyond the table size the least frequent stimuli keep full frames."""
+        rules = {
+            "Type": "Sequence",
+            "Repeat": 1,
+            "Content": [{"Type": "stimulus", "Content": [
+                {"Type": "Vib1", "Amplitude": 0.5, "Frequency": 100 + i, "Duration": 10}]} for i in range(130)]
+        }
+        self.exp.from_dict(rules)
+        self.assertEqual(len(self.exp.stimulus_table), 128)
+        self.assertEqual(sum(event[5] is None for event in self.exp.sequence), 2)
+
+    def test_same_channel_merged(self):
+        """Items of one stimulus on the same channel share one MULTI frame."""
+        rules = {
+            "Type": "stimulus",
+            "Content": [
+                {"Type": "Vib1", "Amplitude": 1.0, "Frequency": 170, "Duration": 100},
+                {"Type": "Vib2", "Amplitude": 0.5, "Frequency": 200, "Duration": 100},
+                {"Type": "Buzzer", "Amplitude": 0.5, "Tone": 1000, "Duration": 30, "Channel": 1},
+            ]
+        }
+        self.exp.from_dict(rules)
+        self.assertEqual(len(self.exp.sequence), 2)
+        merged, single = self.exp.sequence
+        self.assertEqual(merged[1], "Vib1+Vib2")
+        self.assertEqual(merged[3][1], ord('m'))
+        self.assertEqual((single[3][1], single[4]), (ord('b'), 1))
+        self.assertNotIn(merged[3], self.exp.stimulus_table)
+
+    def test_unmerged_stimulus_warned(self):
+        """Items too long for one MULTI frame are sent separately, with a warning."""
+        log = []
+        self.exp.log_cb = log.append
+        rules = {
+            "Type": "stimulus",
+            "Content": [
+                {"Type": "Vib1", "Amplitude": 1.0, "Frequency": 170, "Duration": 100},
+                {"Type": "Vib2", "Amplitude": 0.5, "Frequency": 200, "Duration": 100},
+                {"Type": "Buzzer", "Amplitude": 0.5, "Tone": 1000, "Duration": 30},
+                {"Type": "Buzzer", "Amplitude": 0.2, "Tone": 500, "Duration": 30},
+            ]
+        }
+        self.exp.from_dict(rules)
+        self.assertEqual(len(self.exp.sequence), 4)
+        self.assertEqual(len(log), 1)
+        self.assertIn("Vib1+Vib2+Buzzer+Buzzer does not fit one multi-channel frame", log[0])
+
     def test_unknown_stimulus_type(self):
         """Unknown stimulus type should raise ValueError."""
         rules = {
@@ -192,6 +272,16 @@ class TestStimulusValidation(unittest.TestCase):
             self.exp.from_dict(rules)
         self.assertIn("Unknown stimulus type", str(ctx.exception))
 
+    def test_invalid_channel(self):
+        """A Channel that is not a name or a number should raise ValueError."""
+        rules = {
+            "Type": "stimulus",
+            "Content": [{"Type": "Buzzer", "Amplitude": 0.5, "Channel": ["booth1"]}]
+        }
+        with self.assertRaises(ValueError) as ctx:
+            self.exp.from_dict(rules)
+        self.assertIn("Channel", str(ctx.exception))
+
 
 class TestDropoutSequenceValidation(unittest.TestCase):
     """Tests for dropout sequence validation."""
@@ -261,6 +351,106 @@ class TestExperimentControl(unittest.TestCase):
         self.exp.pause()
         self.assertEqual(self.exp.current_idx, 2)
 
+    def test_start_wakes_loop(self):
+        """An idle experiment sleeps until start() wakes it; it does not poll."""
+        started = threading.Event()
+        self.exp.add_cb_event(lambda idx: started.set())
+        self.assertFalse(started.wait(0.05))  # nothing runs while idle
+        self.exp.start()
+        self.assertTrue(started.wait(1.0))
+        self.exp.stop()
+
+    def test_long_plan_constant_overhead(self):
+        """The plan is not copied per event: 100k events run in about 100k times the cost of one."""
+        self.exp.from_dict({"Type": "Sequence", "Repeat": 100_000,
+                            "Content": [{"Type": "Delay", "Duration": 0}]})
+        self.assertIsInstance(self.exp.sequence, tuple)
+        done = threading.Event()
+        self.exp.add_cb_log(lambda message: message == "End of experiment" and done.set())
+        self.exp.start()
+        self.assertTrue(done.wait(20.0))
+        self.assertFalse(self.exp.running)
+
+    def test_absolute_deadlines(self):
+        """Time spent in the callbacks does not add to the session length."""
+        clock = SimulatedClock()
+        exp = Experiment(clock=clock)
+        exp.from_dict({"Type": "Sequence", "Repeat": 20,
+                       "Content": [{"Type": "Delay", "Duration": 0.02}]})
+        log = []
+        done = threading.Event()
+
+        def slow_log(message):
+            log.append((clock.now_ns(), message))
+            clock.advance(5_000_000)  # a callback taking 5 ms
+            if message == "End of experiment":
+                done.set()
+        exp.add_cb_log(slow_log)
+        try:
+            exp.start()
+            self.assertTrue(done.wait(5.0))
+        finally:
+            exp.close()
+        # 20 x 20 ms; relative waits would take 20 x 25 ms
+        self.assertEqual([t for t, message in log if message.startswith("delay")],
+                         [k * 20_000_000 for k in range(20)])
+        self.assertEqual(log[-1], (400_000_000, "End of experiment"))
+
+    def test_duration(self):
+        """The planned duration is the sum of the plan's delays."""
+        self.exp.from_dict({"Type": "Sequence", "Repeat": 4, "Content": [
+            {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+            {"Type": "Delay", "Duration": 0.25}]})
+        self.assertEqual(self.exp.duration_s, 1.0)
+
+    def test_wait_finished_on_stop(self):
+        """wait_finished returns when the run is stopped, not only at the end of the plan."""
+        self.exp.from_dict({"Type": "Sequence", "Repeat": 1, "Content": [{"Type": "Delay", "Duration": 60}]})
+        self.exp.start()
+        self.assertFalse(self.exp.wait_finished(0.05))
+        threading.Timer(0.05, self.exp.stop).start()
+        self.assertTrue(self.exp.wait_finished(5.0))
+        self.assertFalse(self.exp.running)
+
+    def test_unknown_resume_policy(self):
+        """Only the shift and keep reconnect policies exist."""
+        with self.assertRaises(ValueError):
+            self.exp.enable_reconnect("restart")
+        self.assertIsNone(self.exp.reconnect)
+
+
+class TestSimulatedClock(unittest.TestCase):
+    """Tests for running a plan on a simulated clock."""
+
+    def test_long_plan_fast_forwarded(self):
+        """A 40-minute plan runs in well under a second, with its log on the planned times."""
+        clock = SimulatedClock()
+        exp = Experiment(clock=clock)
+        log = []
+        done = threading.Event()
+
+        def on_log(message):
+            log.append((clock.now_ns(), message))
+            if message == "End of experiment":
+                done.set()
+        exp.add_cb_log(on_log)
+        exp.from_dict({"Type": "Sequence", "Repeat": 240, "Content": [{"Type": "Delay", "Duration": 10}]})
+        try:
+            t0 = time.perf_counter()
+            exp.start()
+            self.assertTrue(done.wait(5.0))
+            self.assertLess(time.perf_counter() - t0, 1.0)
+        finally:
+            exp.close()
+        self.assertEqual(log[-1], (2400 * 10 ** 9, "End of experiment"))
+        self.assertEqual([t for t, _ in log[:3]], [0, 10 * 10 ** 9, 20 * 10 ** 9])
+
+    def test_needs_host_timing(self):
+        """Device scheduling and the writer thread run on the host clock."""
+        for kwargs in ({"async_writes": True}, {"device_scheduling": True}):
+            with self.assertRaises(ValueError):
+                Experiment(clock=SimulatedClock(), **kwargs)
+
 
 class TestRandomizedSequenceValidation(unittest.TestCase):
     """Tests for Randomized_sequence schema validation."""
@@ -0,0 +1,225 @@
+import unittest
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.firmware_host import (FirmwareHost, add_prototypes, find_compiler, PIN_TRIG, PIN_VIB1_PWM,
+                                PIN_VIB1_PH, PIN_BUZZER_AMP, PIN_BUZZER_TONE)
+from core.protocol import (encode_signal, encode_sequenced, encode_scheduled, encode_multi, encode_ping,
+                           encode_counters_request, decode_ack, decode_pong, decode_ready, decode_counters,
+                           ACK, PONG, READY, COUNTERS, PROTOCOL_VERSION)
+
+
+class TestPrototypes(unittest.TestCase):
+    """Tests for the prototypes added before compiling a sketch."""
+
+    def test_prototypes_before_first_definition(self):
+        source = ("#define X 1\n"
+                  "int counter = 0;\n"
+                  "void tick()\n{\n    helper(2);\n}\n"
+                  "bool helper(uint8_t *data, int n) // comment\n{\n    return n;\n}\n"
+                  "void setup()\n{\n}\n")
+        lines = add_prototypes(source).splitlines()
+        self.assertEqual(lines[2:5], ["void tick();", "bool helper(uint8_t *data, int n);", "#line 3"])
+        self.assertEqual(lines[5], "void tick()")
+
+
+@unittest.skipIf(find_compiler() is None, "no C++ compiler")
+class TestTeensyFirmware(unittest.TestCase):
+    """Tests for teensyScript.ino running on the simulated clock."""
+
+    def setUp(self):
+        self.fw = FirmwareHost()
+        self.fw.start()
+
+    def tearDown(self):
+        self.fw.stop()
+
+    def test_ready_and_pong(self):
+        """The boot banner carries the protocol version; a ping is answered with micros()."""
+        source, payload = self.fw.frames[0][1:]
+        self.assertEqual(source, READY)
+        self.assertEqual(decode_ready(payload)[0], PROTOCOL_VERSION)
+        self.fw.send(encode_ping(7))
+        self.fw.run(100)
+        frame = self.fw.frames[-1]
+        self.assertEqual(frame.source, PONG)
+        token, device_us = decode_pong(frame.payload)
+        self.assertEqual(token, 7)
+        self.assertLessEqual(abs(device_us - frame.t_us), 1)
+
+    def test_buzzer_timeline(self):
+        """Trigger and buzzer turn on at onset and off within a timer tick of their duration."""
+        onset = self.fw.now_us
+        self.fw.send(encode_signal(('b', 0.5, 1000, 30)))
+        self.fw.run(50_000)
+        self.assertEqual(self.fw.timeline(PIN_BUZZER_TONE, "f"), [(onset, 1000)])
+        (on_us, amp), (off_us, zero) = self.fw.timeline(PIN_BUZZER_AMP, "a", onset)
+        self.assertEqual((on_us - onset, amp, zero), (0, 254, 0))
+        self.assertLessEqual(off_us - on_us - 30_000, 1000)
+        trigger = self.fw.timeline(PIN_TRIG)
+        self.assertEqual([value for _, value in trigger], [1, 0])
+        self.assertLessEqual(trigger[1][0] - trigger[0][0] - 5000, 1000)
+
+    def test_sequenced_ack(self):
+        """A sequenced command is acked with its onset; a retransmission is not run again."""
+        frame = encode_sequenced(9, encode_signal(('v', 1.0, 170, 10)))
+        self.fw.send(frame)
+        self.fw.run(20_000)
+        self.fw.send(frame)
+        self.fw.run(1000)
+        acks = [decode_ack(f.payload) for f in self.fw.frames if f.source == ACK]
+        self.assertEqual(len(acks), 2)
+        self.assertEqual(acks[0], acks[1])
+        self.assertEqual(len(self.fw.timeline(PIN_TRIG)), 2)
+
+    def test_retransmit_after_later_command(self):
+        """A's ack is lost and B runs: the retransmitted A is acked again, not run twice."""
+        frame_a = encode_sequenced(9, encode_signal(('v', 1.0, 170, 10)))
+        frame_b = encode_sequenced(10, encode_signal(('v', 1.0, 170, 10)))
+        self.fw.send(frame_a)
+        self.fw.run(20_000)
+        self.fw.send(frame_b)
+        self.fw.run(20_000)
+        self.fw.send(frame_a)
+        self.fw.run(20_000)
+        acks = [decode_ack(f.payload) for f in self.fw.frames if f.source == ACK]
+        self.assertEqual([seq for seq, _ in acks], [9, 10, 9])
+        self.assertEqual(acks[0], acks[2])
+        self.assertEqual(len(self.fw.timeline(PIN_TRIG)), 4)  # two pulses, on and off
+
+    def test_scheduled_multi_across_wraparound(self):
+        """A scheduled MULTI frame starts both channels at its onset, even past the micros() wrap."""
+        self.fw.stop()
+        self.fw = FirmwareHost(start_us=2 ** 32 - 150_000)
+        self.fw.start()
+        onset = self.fw.now_us + 60_000  # the clock wraps 50 ms from now
+        multi = encode_multi([encode_signal(('v', 1.0, 170, 10)), encode_signal(('b', 0.5, 1000, 10))])
+        self.fw.send(encode_scheduled(4, onset & 0xffffffff, multi))
+        self.fw.run(80_000)
+        _, device_us = decode_ack(self.fw.frames[-1].payload)
+        self.assertEqual(device_us, onset & 0xffffffff)
+        self.assertEqual(self.fw.timeline(PIN_BUZZER_AMP, "a", onset)[0], (onset, 254))
+        self.assertEqual(self.fw.timeline(PIN_TRIG, since_us=onset)[0], (onset, 1))
+        self.assertEqual(self.fw.timeline(PIN_VIB1_PWM, "a", onset)[0], (onset, 510))
+
+    def counters(self):
+        self.fw.send(encode_counters_request())
+        self.fw.run(10)
+        self.assertEqual(self.fw.frames[-1].source, COUNTERS)
+        return decode_counters(self.fw.frames[-1].payload)
+
+    def test_back_to_back_frames_one_pass(self):
+        """Queued frames are all handled in the loop() pass that reads them."""
+        frames = b"".join(encode_sequenced(i, encode_signal(('v', 1.0, 170, 10))) for i in range(5))
+        self.fw.send(frames)
+        stats = self.fw.run(5)
+        self.assertEqual(stats.busy_loops, 1)
+        acks = [decode_ack(f.payload)[0] for f in self.fw.frames if f.source == ACK]
+        self.assertEqual(acks, list(range(5)))
+
+    def test_resync_after_garbage(self):
+        """Bytes outside a frame are skipped up to the next start byte and counted."""
+        self.fw.send(b"\x01\x02\x03" + encode_sequenced(1, encode_signal(('v', 1.0, 170, 10))))
+        self.fw.run(10)
+        self.assertEqual(self.fw.frames[-1].source, ACK)
+        counters = self.counters()
+        self.assertEqual((counters["skipped_bytes"], counters["dropped"]), (3, 0))
+
+    def test_incomplete_frame_dropped(self):
+        """A frame whose rest never comes is dropped after the timeout, without stalling loop()."""
+        frame = encode_signal(('v', 1.0, 170, 10))
+        self.fw.send(frame[:5])
+        stats = self.fw.run(50_000)
+        self.assertGreater(stats.loops, 40_000)  # loop() kept running while the frame was incomplete
+        self.fw.run(60_000)
+        self.fw.send(frame)
+        self.fw.run(10)
+        self.assertEqual(len(self.fw.timeline(PIN_TRIG, since_us=self.fw.now_us - 10)), 1)
+        counters = self.counters()
+        self.assertEqual((counters["dropped"], counters["malformed"]), (1, 0))
+
+    def test_malformed_counted(self):
+        self.fw.send(bytes([0xaa, ord('v'), 2, 1, 2]))
+        self.fw.run(10)
+        counters = self.counters()
+        self.assertEqual(counters["malformed"], 1)
+        self.assertEqual(counters["frames"], 2)  # the bad frame and the counters request
+
+    def test_unknown_source_rejected(self):
+        """A frame with an unknown source byte starts nothing and is counted as malformed."""
+        self.fw.send(bytes([0xaa, ord('z'), 5, 1, 2, 3, 4, 5]))
+        self.fw.send(encode_sequenced(1, bytes([0xaa, ord('z'), 5, 1, 2, 3, 4, 5])))
+        self.fw.run(10)
+        self.assertEqual(self.fw.timeline(PIN_TRIG), [])
+        self.assertEqual([f for f in self.fw.frames if f.source == ACK], [])
+        counters = self.counters()
+        self.assertEqual((counters["malformed"], counters["frames"]), (2, 3))
+
+    def test_run_stats(self):
+        """Each run reports its loop() passes and timer handler calls."""
+        self.fw.send(encode_signal(('v', 1.0, 170, 10)))
+        stats = self.fw.run(10_000)
+        self.assertEqual(stats.t_us, self.fw.now_us)
+        self.assertGreater(stats.loops, 1000)
+        self.assertEqual(stats.busy_loops, 1)
+        self.assertGreater(stats.isr_calls, 10)
+
+
+@unittest.skipIf(find_compiler() is None, "no C++ compiler")
+class TestVib1Waveform(unittest.TestCase):
+    """Tests for the Vib1 drive synthesised by the wave interrupt."""
+
+    def drive(self, freq, duration_ms=200, defines=None):
+        with FirmwareHost(defines=defines) as fw:
+            onset = fw.now_us
+            fw.send(encode_signal(('v', 1.0, freq, duration_ms)))
+            fw.run(duration_ms * 1000 + 10_000)
+            return onset, fw.timeline(PIN_VIB1_PH, since_us=onset), fw.timeline(PIN_VIB1_PWM, "a", onset)
+
+    def test_square_frequency(self):
+        """The direction pin toggles at the requested frequency (sub-percent error)."""
+        for freq in (170, 200, 230):
+            with self.subTest(freq=freq):
+                _, direction, _ = self.drive(freq)
+                rises = [t for t, value in direction if value == 1]
+                measured = (len(rises) - 1) / ((rises[-1] - rises[0]) / 1e6)
+                self.assertLess(abs(measured - freq) / freq, 0.005)
+
+    def test_square_onset_and_duration(self):
+        """The drive starts at the onset and stops within one wave tick of the duration."""
+        onset, _, pwm = self.drive(170, duration_ms=100)
+        self.assertEqual(pwm[0], (onset, 510))
+        off_us, value = pwm[-1]
+        self.assertEqual(value, 0)
+        self.assertLessEqual(abs(off_us - onset - 100_000), 25)
+
+    def test_sine_amplitude(self):
+        """With WAVE_SINE the duty follows |sin|: peak at full scale, mean 2/pi of it."""
+        onset, direction, pwm = self.drive(200, defines={"VIB1_WAVEFORM": "WAVE_SINE"})
+        rises = [t for t, value in direction if value == 1]
+        self.assertLess(abs((len(rises) - 1) / ((rises[-1] - rises[0]) / 1e6) - 200), 1)
+        self.assertGreaterEqual(max(value for _, value in pwm), 500)
+        # time-weighted mean duty over whole periods
+        start, end = rises[0], rises[-1]
+        area = 0
+        for (t0, value), (t1, _) in zip(pwm, pwm[1:]):
+            area += value * max(0, min(t1, end) - max(t0, start))
+        self.assertLess(abs(area / (end - start) / (510 * 2 / 3.14159) - 1), 0.02)
+
+
+@unittest.skipIf(find_compiler() is None, "no C++ compiler")
+class TestArduinoFirmware(unittest.TestCase):
+    """Tests for arduino.ino against the same harness."""
+
+    def test_buzzer_tone(self):
+        with FirmwareHost("arduino") as fw:
+            fw.send(encode_signal(('b', 0.5, 1000, 30)))
+            fw.run(50_000)
+            self.assertEqual([value for _, value in fw.timeline(6, "t")], [1000, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+import sys
+import os
+import tempfile
+import threading
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.hotplug import HotplugMonitor, inotify_available
+
+
+@unittest.skipUnless(inotify_available(), "inotify not available")
+class TestHotplugMonitor(unittest.TestCase):
+    """Tests for inotify based device node removal detection."""
+
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.node = os.path.join(self.dir.name, "ttyACM0")
+        open(self.node, "w").close()
+        self.removed = threading.Event()
+        self.removed_at = None
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def on_removed(self, path):
+        self.removed_at = time.perf_counter()
+        self.removed.set()
+
+    def test_removal_detected_quickly(self):
+        """Removing the node fires the callback within milliseconds."""
+        monitor = HotplugMonitor(self.node, self.on_removed)
+        self.assertTrue(monitor.start())
+        start = time.perf_counter()
+        os.remove(self.node)
+        self.assertTrue(self.removed.wait(timeout=1.0))
+        self.assertLess(self.removed_at - start, 0.05)
+        monitor.stop()
+
+    def test_other_files_ignored(self):
+        """Removing a different node in the same directory does not fire."""
+        other = os.path.join(self.dir.name, "ttyACM1")
+        open(other, "w").close()
+        monitor = HotplugMonitor(self.node, self.on_removed)
+        monitor.start()
+        os.remove(other)
+        self.assertFalse(self.removed.wait(timeout=0.1))
+        monitor.stop()
+
+    def test_symlink_resolved(self):
+        """A by-id style symlink is resolved to the real node."""
+        link = os.path.join(self.dir.name, "usb-Teensyduino")
+        os.symlink(self.node, link)
+        monitor = HotplugMonitor(link, self.on_removed)
+        monitor.start()
+        os.remove(self.node)
+        self.assertTrue(self.removed.wait(timeout=1.0))
+        monitor.stop()
+
+    def test_unwatchable_path(self):
+        """Paths that are not files (e.g. COM3) cannot be monitored."""
+        self.assertFalse(HotplugMonitor("COM3", self.on_removed).start())
+
+
+if __name__ == '__main__':
+    unittest.main()
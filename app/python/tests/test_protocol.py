@@ -0,0 +1,159 @@
+import unittest
+import sys
+import os
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.protocol import (encode_signal, encode_frame, frame_to_hex, encode_sequenced,
+                           decode_sequenced, encode_ack, decode_ack, encode_table_entry,
+                           decode_table_entry, encode_trigger, encode_scheduled, decode_scheduled,
+                           encode_multi, decode_multi, split_multi, encode_counters, decode_counters,
+                           FrameParser)
+
+
+class TestFrameEncoding(unittest.TestCase):
+    """Tests for the exact bytes produced for each signal type."""
+
+    def test_vib1_frame(self):
+        """Vib1 frame is header + amp + freq (LE) + duration (LE)."""
+        frame = encode_signal(('v', 1.0, 170, 500))
+        self.assertEqual(frame, bytes([0xaa, ord('v'), 5, 255, 170, 0, 0xf4, 0x01]))
+
+    def test_buzzer_frame(self):
+        """Buzzer frame uses the same 5-byte payload layout."""
+        frame = encode_signal(('b', 0.0, 1000, 30))
+        self.assertEqual(frame, bytes([0xaa, ord('b'), 5, 0, 0xe8, 0x03, 30, 0]))
+
+    def test_combined_frame(self):
+        """Combined frame carries a 10-byte payload."""
+        frame = encode_signal(('c', 0.5, 170, 500, 0.2, 1000, 300))
+        self.assertEqual(len(frame), 13)
+        self.assertEqual(frame[:3], bytes([0xaa, ord('c'), 10]))
+        self.assertEqual(frame[3], 127)
+        self.assertEqual(frame[8], 51)
+        self.assertEqual(frame[11:], (300).to_bytes(2, 'little'))
+
+    def test_amplitude_clamped(self):
+        """Out of range amplitudes are clamped to 0-255."""
+        self.assertEqual(encode_signal(('v', 1.5, 100, 500))[3], 255)
+        self.assertEqual(encode_signal(('v', -0.5, 100, 500))[3], 0)
+
+    def test_frequency_out_of_range(self):
+        """Values that do not fit in uint16 raise ValueError."""
+        with self.assertRaises(ValueError) as ctx:
+            encode_signal(('v', 0.5, 70000, 500))
+        self.assertIn("out of range", str(ctx.exception))
+
+    def test_invalid_signal_type(self):
+        """Unknown sources are rejected before encoding."""
+        with self.assertRaises(ValueError) as ctx:
+            encode_signal(('x', 0.5, 100, 500))
+        self.assertIn("Invalid signal type", str(ctx.exception))
+
+    def test_encode_frame_too_long(self):
+        """Payloads longer than 255 bytes cannot be framed."""
+        with self.assertRaises(ValueError):
+            encode_frame('v', bytes(256))
+
+    def test_frame_to_hex(self):
+        """Hex formatting matches the debug log format."""
+        self.assertEqual(frame_to_hex(bytes([0xaa, 0x76, 0x05])), "aa 76 05")
+
+
+class TestSequencedFrames(unittest.TestCase):
+    """Tests for sequenced commands and acknowledgements."""
+
+    def test_sequenced_roundtrip(self):
+        """A sequenced frame carries seq, source and the original payload."""
+        frame = encode_signal(('b', 0.5, 1000, 30))
+        wrapped = encode_sequenced(513, frame)
+        self.assertEqual(wrapped[:3], bytes([0xaa, ord('q'), 8]))
+        self.assertEqual(decode_sequenced(wrapped[3:]), (513, 'b', frame[3:]))
+
+    def test_sequence_wraps(self):
+        """Sequence numbers wrap at 16 bits."""
+        wrapped = encode_sequenced(65536 + 7, encode_signal(('v', 0.5, 170, 100)))
+        self.assertEqual(decode_sequenced(wrapped[3:])[0], 7)
+
+    def test_scheduled_roundtrip(self):
+        """A scheduled frame carries seq, the device onset and the command."""
+        frame = encode_trigger(3)
+        wrapped = encode_scheduled(9, (1 << 32) + 1234, frame)
+        self.assertEqual(wrapped[:3], bytes([0xaa, ord('s'), 8]))
+        self.assertEqual(decode_scheduled(wrapped[3:]), (9, 1234, 'x', bytes([3])))
+
+    def test_counters_roundtrip(self):
+        frame = encode_counters(10, 1, 2, 2 ** 32 + 3)
+        self.assertEqual(frame[:3], bytes([0xaa, ord('n'), 16]))
+        self.assertEqual(decode_counters(frame[3:]),
+                         {"frames": 10, "malformed": 1, "dropped": 2, "skipped_bytes": 3})
+
+    def test_ack_roundtrip(self):
+        """Ack frames carry seq and the device onset time."""
+        frame = encode_ack(42, 123456789)
+        self.assertEqual(decode_ack(frame[3:]), (42, 123456789))
+
+
+class TestStimulusTable(unittest.TestCase):
+    """Tests for table upload and trigger frames."""
+
+    def test_table_entry_roundtrip(self):
+        """A table entry carries the slot, source and stimulus payload."""
+        frame = encode_signal(('c', 0.5, 170, 100, 0.2, 1000, 30))
+        entry = encode_table_entry(3, frame)
+        self.assertEqual(entry[:3], bytes([0xaa, ord('t'), 12]))
+        self.assertEqual(decode_table_entry(entry[3:]), (3, 'c', frame[3:]))
+
+    def test_trigger_frame(self):
+        """A trigger is 4 bytes whatever the stimulus."""
+        self.assertEqual(encode_trigger(5), bytes([0xaa, ord('x'), 1, 5]))
+        with self.assertRaises(ValueError):
+            encode_trigger(128)
+
+    def test_only_stimuli_in_table(self):
+        """Non-stimulus frames cannot be stored."""
+        with self.assertRaises(ValueError):
+            encode_table_entry(0, encode_trigger(1))
+
+
+class TestMultiFrames(unittest.TestCase):
+    """Tests for multi-channel frames."""
+
+    def test_multi_roundtrip(self):
+        """A MULTI frame carries each command with its source and length."""
+        vib = encode_signal(('v', 1.0, 170, 100))
+        buzz = encode_signal(('b', 0.5, 1000, 30))
+        frame = encode_multi([vib, buzz])
+        self.assertEqual(frame[:4], bytes([0xaa, ord('m'), 15, 2]))
+        self.assertEqual(decode_multi(frame[3:]), [('v', vib[3:]), ('b', buzz[3:])])
+        self.assertEqual(split_multi(frame), [vib, buzz])
+
+    def test_multi_too_long(self):
+        """Commands that do not fit the firmware schedule slot are refused."""
+        combined = encode_signal(('c', 0.5, 170, 100, 0.2, 1000, 30))
+        with self.assertRaises(ValueError):
+            encode_multi([combined, combined])
+        with self.assertRaises(ValueError):
+            encode_multi([encode_trigger(1)])
+
+
+class TestFrameParser(unittest.TestCase):
+    """Tests for the incremental frame parser."""
+
+    def test_split_frame(self):
+        """Frames split across reads are reassembled."""
+        parser = FrameParser()
+        frame = encode_ack(1, 2)
+        self.assertEqual(parser.feed(frame[:4]), [])
+        self.assertEqual(parser.feed(frame[4:]), [('k', frame[3:])])
+
+    def test_resync_after_garbage(self):
+        """Bytes before a start byte are skipped."""
+        parser = FrameParser()
+        frames = parser.feed(b"\x01\x02" + encode_ack(1, 2) + encode_ack(3, 4))
+        self.assertEqual([decode_ack(p) for _, p in frames], [(1, 2), (3, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
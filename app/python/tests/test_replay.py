@@ -0,0 +1,92 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.protocol import encode_signal, encode_identify, encode_ack, encode_ping, encode_pong, encode_scheduled
+from core.replay import load_tx_frames, recorded_clock, replay_trace, summarize
+from core.wire_trace import TraceWriter, TX, RX
+
+
+class TestReplay(unittest.TestCase):
+    """Tests for replaying a recorded trace into the virtual device."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "session.trace")
+        frame = encode_signal(('v', 0.5, 170, 10))
+        with TraceWriter(self.path) as trace:
+            trace.record(TX, 0, encode_identify())
+            for k in range(20):
+                trace.record(TX, 1_000_000_000 + k * 10_000_000, frame)  # every 10 ms
+                trace.record(RX, 1_000_050_000 + k * 10_000_000, encode_ack(k, 0))
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_load_tx_frames(self):
+        """Only host -> device frames are replayed, the handshake is skipped."""
+        frames = load_tx_frames(self.path)
+        self.assertEqual(len(frames), 20)
+        self.assertEqual(frames[1][0] - frames[0][0], 10_000_000)
+        self.assertEqual(len(load_tx_frames(self.path, skip=())), 21)
+
+    def test_original_timing(self):
+        """Every frame reaches the device; intervals follow the recording."""
+        report = replay_trace(self.path, "virtual")
+        self.assertEqual(report.frames, 20)
+        self.assertEqual(report.device_commands, 20)
+        self.assertEqual(report.device_malformed, 0)
+        stats = report.to_dict()
+        self.assertAlmostEqual(stats["planned_duration_s"], 0.19, places=3)
+        self.assertLess(stats["abs_interval_error_ns"]["p50"], 2_000_000)  # median; noisy wakeups
+
+    def test_accelerated(self):
+        """Speed scales the planned timeline; speed 0 sends as fast as possible."""
+        fast = replay_trace(self.path, "virtual", speed=4)
+        self.assertAlmostEqual(fast.to_dict()["planned_duration_s"], 0.19 / 4, places=3)
+        burst = replay_trace(self.path, "virtual", speed=0)
+        self.assertEqual(burst.device_commands, 20)
+        self.assertLess(burst.to_dict()["duration_s"], 0.19)
+
+    def record_scheduled(self, pongs):
+        """A device-scheduled session: onsets 20 ms after each send, in a device clock 7 s ahead."""
+        frame = encode_signal(('v', 0.5, 170, 10))
+        with TraceWriter(self.path) as trace:
+            for token in range(4):
+                t_ns = 500_000_000 + token * 1_000_000
+                trace.record(TX, t_ns, encode_ping(token))
+                if pongs:
+                    trace.record(RX, t_ns + 100_000, encode_pong(token, (t_ns + 50_000) // 1000 + 7_000_000))
+            for k in range(20):
+                t_ns = 1_000_000_000 + k * 10_000_000
+                trace.record(TX, t_ns, encode_scheduled(k, (t_ns + 20_000_000) // 1000 + 7_000_000, frame))
+
+    def test_scheduled_rebased(self):
+        """'s' onsets are moved to the replay device's clock; recorded pings are not replayed."""
+        self.record_scheduled(pongs=True)
+        clock = recorded_clock(self.path)
+        self.assertAlmostEqual(clock.device_to_host(8_000_000), 1_000_000_000, delta=10_000)
+        self.assertEqual(len(load_tx_frames(self.path)), 20)
+        report = replay_trace(self.path, "virtual")
+        self.assertEqual((report.rebased, report.skipped_scheduled), (20, 0))
+        self.assertEqual(report.device_commands, 20)  # fired, not held for the old session's micros()
+
+    def test_scheduled_skipped_without_mapping(self):
+        """Without recorded pongs 's' frames cannot be rebased and are skipped."""
+        self.record_scheduled(pongs=False)
+        self.assertIsNone(recorded_clock(self.path))
+        report = replay_trace(self.path, "virtual")
+        self.assertEqual((report.frames, report.skipped_scheduled), (0, 20))
+        self.assertIn("20 skipped", report.summary())
+
+    def test_summarize(self):
+        self.assertEqual(summarize([3, 1, 2])["p50"], 2)
+        self.assertIsNone(summarize([])["mean"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,138 @@
+import unittest
+import sys
+import os
+import json
+import tempfile
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial
+
+from core.arduino_communication import ArduinoCom
+from core.protocol import encode_signal
+from core.telemetry import Histogram, LinkTelemetry
+
+
+class FakePort:
+    """Minimal stand-in for serial.Serial that records written frames."""
+
+    def __init__(self, fail=False):
+        self.is_open = True
+        self.written = []
+        self.fail = fail
+
+    def write(self, data):
+        if self.fail:
+            raise serial.SerialException("write failed")
+        self.written.append(bytes(data))
+        return len(data)
+
+    def close(self):
+        self.is_open = False
+
+
+class TestHistogram(unittest.TestCase):
+    """Tests for the power-of-two bucket histogram."""
+
+    def test_exact_min_max_mean(self):
+        h = Histogram()
+        for value in (3, 10, 1000):
+            h.record(value)
+        self.assertEqual((h.count, h.min, h.max), (3, 3, 1000))
+        self.assertAlmostEqual(h.mean, 1013 / 3)
+
+    def test_percentile_within_a_factor_of_two(self):
+        """Percentiles are estimated from buckets and clamped to min/max."""
+        h = Histogram()
+        for value in range(1, 1001):
+            h.record(value)
+        for q, exact in ((50, 500), (90, 900), (99, 990)):
+            estimate = h.percentile(q)
+            self.assertGreaterEqual(estimate, exact / 2)
+            self.assertLessEqual(estimate, exact * 2)
+        self.assertEqual(h.percentile(100), 1000)
+        self.assertIsNone(Histogram().percentile(50))
+
+
+class TestLinkTelemetry(unittest.TestCase):
+    """Tests for the write-path counters and rates."""
+
+    def test_rates_from_recorded_writes(self):
+        t = LinkTelemetry()
+        for i in range(100):  # 100 frames of 8 bytes over 0.99 s
+            start = 5_000_000_000 + i * 10_000_000
+            t.record_write(8, start, start + 20_000)
+        rates = t.rates(now_ns=6_500_000_000)
+        self.assertAlmostEqual(rates["frames_per_s"], 100 / 0.99002, places=1)
+        self.assertAlmostEqual(rates["bytes_per_s"], 800 / 0.99002, places=0)
+        self.assertEqual(rates["last_s_frames"], 100)
+        self.assertEqual(rates["peak_bytes_per_s"], 800)
+        self.assertEqual(t.histograms["write_ns"].max, 20_000)
+
+    def test_reset(self):
+        t = LinkTelemetry()
+        t.record_write(8, 0, 1)
+        t.record_error()
+        t.reset()
+        snapshot = t.snapshot()
+        self.assertEqual((snapshot["frames_written"], snapshot["write_errors"]), (0, 0))
+        self.assertIsNone(snapshot["rates"]["frames_per_s"])
+
+
+class TestArduinoComStats(unittest.TestCase):
+    """Tests for the telemetry recorded by ArduinoCom."""
+
+    def setUp(self):
+        self.arduino = ArduinoCom()
+        self.frame = encode_signal(('v', 0.5, 170, 100))
+
+    def tearDown(self):
+        self.arduino.stop_writer()
+
+    def test_writes_counted(self):
+        """Every write is counted with its size and write-call duration."""
+        self.arduino.arduino = FakePort()
+        self.arduino.start_writer()
+        handles = [self.arduino.submit(self.frame) for _ in range(5)]
+        for handle in handles:
+            self.assertTrue(handle.wait(timeout=1.0))
+        stats = self.arduino.stats()
+        self.assertEqual(stats["frames_written"], 5)
+        self.assertEqual(stats["bytes_written"], 5 * len(self.frame))
+        self.assertEqual(stats["histograms"]["write_ns"]["count"], 5)
+        self.assertEqual(stats["histograms"]["queue_wait_ns"]["count"], 5)
+        self.assertEqual(stats["histograms"]["queue_depth"]["count"], 5)
+        self.assertEqual(stats["rejected_writes"], 0)
+
+    def test_write_error_counted(self):
+        self.arduino.arduino = FakePort(fail=True)
+        with self.assertRaises(serial.SerialException):
+            self.arduino.send_frame(self.frame)
+        stats = self.arduino.stats()
+        self.assertEqual((stats["frames_written"], stats["write_errors"]), (0, 1))
+
+    def test_ping_error_counted(self):
+        """A clock sync ping that cannot be written counts as a write error."""
+        self.arduino.arduino = FakePort(fail=True)
+        with self.assertRaises(serial.SerialException):
+            self.arduino.ping()
+        stats = self.arduino.stats()
+        self.assertEqual((stats["frames_written"], stats["write_errors"]), (0, 1))
+        self.assertIsNone(self.arduino.arduino)  # the link is dropped, as for a failed stimulus write
+
+    def test_dump_stats(self):
+        """dump_stats writes the stats dict as JSON."""
+        self.arduino.arduino = FakePort()
+        self.arduino.send_frame(self.frame)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stats.json")
+            self.arduino.dump_stats(path)
+            with open(path) as f:
+                stats = json.load(f)
+        self.assertEqual(stats["frames_written"], 1)
+        self.assertIn("retransmits", stats)
+
+
+if __name__ == '__main__':
+    unittest.main()
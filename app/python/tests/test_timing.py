@@ -0,0 +1,84 @@
+import unittest
+import sys
+import os
+import tempfile
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.timing import OnsetRecorder, percentiles
+
+
+class PendingWrite:
+    """Stand-in for a WriteHandle whose write completes later."""
+    complete_ns = None
+
+
+class TestPercentiles(unittest.TestCase):
+    """Tests for the nearest-rank percentiles."""
+
+    def test_nearest_rank(self):
+        result = percentiles(list(range(1, 101)))
+        self.assertEqual(result, {"p50": 50, "p95": 95, "p99": 99, "max": 100})
+
+    def test_empty(self):
+        self.assertEqual(percentiles([]), {"p50": None, "p95": None, "p99": None, "max": None})
+
+
+class TestOnsetRecorder(unittest.TestCase):
+    """Tests for the per-event onset ring buffer."""
+
+    def test_lateness_and_interval_error(self):
+        recorder = OnsetRecorder()
+        # planned every 10 ms; the second onset 2 ms late
+        for idx, late_ns in enumerate((0, 2_000_000, 0)):
+            planned = idx * 10_000_000
+            recorder.record(idx, planned, planned + late_ns)
+        stats = recorder.stats()
+        self.assertEqual(stats["events"], 3)
+        self.assertEqual(stats["lateness_ms"]["max"], 2.0)
+        self.assertEqual(stats["interval_error_ms"]["max"], 2.0)
+        self.assertEqual(stats["drift_ms"], 0.0)
+        self.assertEqual(stats["write_ms"]["max"], 2.0)  # no handle: complete at dispatch
+
+    def test_ring_keeps_last_events(self):
+        """Past its capacity the oldest rows are overwritten; the totals cover every event."""
+        recorder = OnsetRecorder(capacity=4)
+        for idx in range(10):
+            recorder.record(idx, 0, idx * 1_000_000)
+        self.assertEqual(len(recorder), 4)
+        self.assertEqual([row[0] for row in recorder.events()], [6, 7, 8, 9])
+        stats = recorder.stats()
+        self.assertEqual((stats["events"], stats["kept"]), (10, 4))
+        self.assertEqual(stats["mean_lateness_ms"], 4.5)
+
+    def test_write_completed_later(self):
+        """The write completion time is read from the handle once it is known."""
+        recorder = OnsetRecorder()
+        handle = PendingWrite()
+        recorder.record(0, 1000, 1500, handle)
+        self.assertIsNone(recorder.events()[0][3])
+        handle.complete_ns = 4000
+        self.assertEqual(recorder.events()[0][3], 4000)
+        self.assertEqual(recorder.stats()["write_ms"]["max"], 0.003)
+
+    def test_reset(self):
+        recorder = OnsetRecorder()
+        recorder.record(0, 0, 10)
+        recorder.reset()
+        self.assertEqual((recorder.count, recorder.events()), (0, []))
+
+    def test_export_csv(self):
+        recorder = OnsetRecorder()
+        recorder.record(3, 1_000_000, 1_250_000, PendingWrite())
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "timing.csv")
+            recorder.export(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        self.assertEqual(lines, ["event,planned_ns,dispatch_ns,complete_ns,lateness_ms",
+                                 "3,1000000,1250000,,0.250"])
+
+
+if __name__ == '__main__':
+    unittest.main()
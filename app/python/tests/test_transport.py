@@ -0,0 +1,100 @@
+import unittest
+import sys
+import os
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial
+
+from core.arduino_communication import ArduinoCom
+from core.protocol import encode_signal
+from core.transport import loopback_pair, open_transport, TransportError
+from core.virtual_device import VirtualBsense
+
+
+def wait_for(predicate, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+class TestLoopback(unittest.TestCase):
+    """Tests for the in-process loopback transport."""
+
+    def test_read_write(self):
+        """Bytes written on one end are read on the other, pyserial style."""
+        host, device = loopback_pair(timeout=0.05)
+        host.write(b"\xaa\x76\x01\x02")
+        self.assertEqual(device.in_waiting, 4)
+        self.assertEqual(device.read(3), b"\xaa\x76\x01")
+        self.assertEqual(device.read(3), b"\x02")  # partial after the timeout
+        self.assertEqual(host.read(1), b"")
+
+    def test_close_reported_as_serial_error(self):
+        """A closed peer raises a SerialException subclass on both ends."""
+        host, device = loopback_pair(timeout=0.05)
+        device.close()
+        with self.assertRaises(serial.SerialException):
+            host.read(1)
+        with self.assertRaises(TransportError):
+            host.write(b"x")
+
+    def test_unknown_endpoint(self):
+        """Opening an unregistered loop:// name fails like a missing port."""
+        with self.assertRaises(serial.SerialException):
+            open_transport("loop://nothing-here")
+
+    def test_bad_url(self):
+        with self.assertRaises(ValueError):
+            open_transport("tcp://localhost")
+
+
+class TestTransports(unittest.TestCase):
+    """ArduinoCom against the emulator over every transport."""
+
+    TRANSPORTS = ("tcp", "udp", "loop") + (("pty",) if hasattr(os, "openpty") else ())
+
+    def test_handshake_acks_and_sync(self):
+        """Connect, acknowledged frames and clock sync work on every transport."""
+        for transport in self.TRANSPORTS:
+            with self.subTest(transport=transport), VirtualBsense(transport) as device:
+                arduino = ArduinoCom()
+                try:
+                    arduino.connect(device.port, retries=1)
+                    self.assertEqual(arduino.device_info.firmware, "virtual")
+                    arduino.enable_acks(timeout=0.5)
+                    arduino.start_clock_sync(interval=0.02)
+                    handle = arduino.submit(encode_signal(('c', 0.5, 170, 100, 0.2, 1000, 30)))
+                    self.assertTrue(handle.wait_ack(1.0))
+                    self.assertEqual(device.last_params("buzzer"), (51, 1000, 30))
+                    self.assertTrue(wait_for(lambda: arduino.clock.sample_count >= 3))
+                finally:
+                    arduino.close()
+
+    def test_peer_loss_detected(self):
+        """Stopping the emulator reports the disconnection once (stream transports)."""
+        for transport in ("tcp", "loop"):
+            with self.subTest(transport=transport):
+                device = VirtualBsense(transport)
+                device.start()
+                arduino = ArduinoCom()
+                lost = []
+                arduino.disconnect_cb = lambda e: lost.append(e)
+                try:
+                    arduino.connect(device.port, retries=1)
+                    device.stop()
+                    self.assertTrue(wait_for(lambda: lost))
+                    self.assertEqual(len(lost), 1)
+                    self.assertFalse(arduino.is_connected())
+                finally:
+                    arduino.close()
+                    device.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,500 @@
+import unittest
+import sys
+import os
+import time
+import tempfile
+from unittest import mock
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serial
+
+from core.arduino_communication import ArduinoCom, READ_TIMEOUT, discover_devices
+from core.protocol import (encode_signal, encode_trigger, encode_multi, encode_frame, encode_sequenced, decode_ack,
+                           FrameParser, ACK)
+from core.virtual_device import VirtualBsense
+from core.experiment import Experiment
+from core.fast_forward import fast_forward
+
+
+def wait_for(predicate, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "pseudo-terminals not available")
+class TestVirtualDevice(unittest.TestCase):
+    """Tests for the pty based firmware emulator."""
+
+    def setUp(self):
+        self.device = VirtualBsense()
+        self.device.start()
+        self.arduino = ArduinoCom()
+        # Open the pty directly: connect() is exercised separately
+        self.arduino.arduino = serial.Serial(self.device.port, 115200, timeout=READ_TIMEOUT)
+
+    def tearDown(self):
+        self.arduino.stop_clock_sync()
+        self.arduino.stop_reader()
+        self.arduino.disconnect()
+        self.device.stop()
+
+    def test_decodes_frames(self):
+        """Frames written by ArduinoCom are decoded and timestamped."""
+        before = time.perf_counter_ns()
+        self.arduino.send_signal(('v', 1.0, 170, 100))
+        self.arduino.send_signal(('c', 0.5, 170, 100, 0.2, 1000, 30))
+        self.assertTrue(wait_for(lambda: len(self.device.commands) == 2))
+        first, second = self.device.commands
+        self.assertEqual(first.source, 'v')
+        self.assertEqual(second.source, 'c')
+        self.assertGreaterEqual(first.recv_ns, before)
+        self.assertLessEqual(first.recv_ns, second.recv_ns)
+        self.assertEqual(self.device.last_params("buzzer"), (51, 1000, 30))
+
+    def test_actuator_state(self):
+        """Actuators turn on at onset and off after their duration."""
+        self.arduino.send_signal(('b', 0.5, 1000, 50))
+        self.assertTrue(wait_for(lambda: self.device.commands))
+        onset = self.device.commands[0].recv_ns
+        self.assertTrue(self.device.actuator_state(onset + 1000)["buzzer"])
+        self.assertFalse(self.device.actuator_state(onset)["vib1"])
+        self.assertFalse(self.device.actuator_state(onset + 60_000_000)["buzzer"])
+
+    def test_short_payload_rejected(self):
+        """A command shorter than its expected length is not applied."""
+        self.arduino.send_frame(bytes([0xaa, ord('v'), 2, 1, 2]))
+        self.assertTrue(wait_for(lambda: self.device.malformed == 1))
+        self.assertEqual(self.device.commands, [])
+
+    def test_unknown_source_rejected(self):
+        """A frame with an unknown source byte is not applied."""
+        self.arduino.send_frame(bytes([0xaa, ord('z'), 5, 1, 2, 3, 4, 5]))
+        self.assertTrue(wait_for(lambda: self.device.malformed == 1))
+        self.assertEqual(self.device.commands, [])
+
+    def test_bad_start_byte_skipped(self):
+        """Bytes before a start byte are skipped and the next frame is still parsed."""
+        self.arduino.send_frame(bytes([0x00, ord('v'), 5]))
+        self.arduino.send_signal(('v', 1.0, 170, 100))
+        self.assertTrue(wait_for(lambda: len(self.device.commands) == 1))
+        self.assertEqual((self.device.skipped, self.device.dropped), (3, 0))
+
+    def test_parser_counters(self):
+        """The parser counters are reported to the host on request."""
+        self.arduino.disconnect()
+        self.arduino.connect(self.device.port, retries=1)
+        self.arduino.send_frame(b"\x01\x02" + bytes([0xaa, ord('v'), 2, 1, 2]))
+        self.assertTrue(wait_for(lambda: self.device.malformed == 1))
+        counters = self.arduino.request_device_counters(timeout=1.0)
+        self.assertEqual((counters["malformed"], counters["skipped_bytes"]), (1, 2))
+        self.assertEqual(counters["frames"], self.device.frames)
+        self.assertEqual(self.arduino.stats()["device_counters"], counters)
+
+    def test_acks_and_clock_sync(self):
+        """The emulator answers sequenced frames and pings."""
+        self.arduino.enable_acks(timeout=0.5)
+        self.arduino.start_clock_sync(interval=0.02)
+        handle = self.arduino.submit(encode_signal(('v', 1.0, 170, 100)))
+        self.assertTrue(handle.wait_ack(timeout=1.0))
+        self.assertEqual(self.device.commands[0].seq, handle.seq)
+        self.assertEqual(self.device.commands[0].device_us, handle.device_us)
+        self.assertTrue(wait_for(lambda: self.arduino.clock.sample_count >= 4))
+        onset = self.arduino.device_to_host(handle.device_us)
+        self.assertLess(abs(onset - self.device.commands[0].recv_ns), 2_000_000)
+
+    def test_retransmit_after_later_command(self):
+        """A retransmission of A arriving after B ran (A's ack lost) is acked, not run again."""
+        frame_a = encode_sequenced(1, encode_signal(('v', 1.0, 170, 10)))
+        frame_b = encode_sequenced(2, encode_signal(('b', 0.5, 1000, 10)))
+        for frame in (frame_a, frame_b, frame_a):
+            self.arduino.send_frame(frame)
+        self.assertTrue(wait_for(lambda: self.device.commands and len(self.device.commands) >= 2))
+        time.sleep(0.05)
+        self.assertEqual([c.seq for c in self.device.commands], [1, 2])
+        acks = []
+        parser = FrameParser()
+        deadline = time.monotonic() + 1.0
+        while len(acks) < 3 and time.monotonic() < deadline:
+            acks += [decode_ack(p) for s, p in parser.feed(self.arduino.arduino.read(64)) if s == ACK]
+        self.assertEqual([seq for seq, _ in acks], [1, 2, 1])
+        self.assertEqual(acks[0], acks[2])  # the original onset
+
+    def test_connect_opens_pty(self):
+        """ArduinoCom.connect() opens the emulator like a real port."""
+        self.arduino.disconnect()
+        start = time.perf_counter()
+        self.arduino.connect(self.device.port, retries=1)
+        self.assertLess(time.perf_counter() - start, 1.0)  # handshake, not a fixed sleep
+        self.assertTrue(self.arduino.is_connected())
+        self.assertEqual(self.arduino.device_info.firmware, "virtual")
+        self.assertEqual(self.arduino.device_info.port, self.device.port)
+        self.arduino.send_signal(('v', 1.0, 170, 100))
+        self.assertTrue(wait_for(lambda: len(self.device.commands) == 1))
+
+    def test_stimulus_table_trigger(self):
+        """After a table upload a 4 byte trigger runs the stored stimulus."""
+        self.arduino.disconnect()
+        self.arduino.connect(self.device.port, retries=1)
+        frames = [encode_signal(('v', 1.0, 170, 100)), encode_signal(('c', 0.5, 170, 100, 0.2, 1000, 30))]
+        self.assertTrue(self.arduino.load_table(frames))
+        self.assertTrue(wait_for(lambda: self.device.table[1] is not None))
+        rx = self.device.rx_bytes
+        self.arduino.send_frame(encode_trigger(1))
+        self.assertTrue(wait_for(lambda: len(self.device.commands) == 1))
+        self.assertEqual(self.device.rx_bytes - rx, 4)
+        self.assertEqual(self.device.commands[0].source, 'c')
+        self.assertEqual(self.device.last_params("buzzer"), (51, 1000, 30))
+
+    def test_multi_single_onset(self):
+        """Every command of a MULTI frame starts at the same device time."""
+        self.arduino.send_frame(encode_multi([encode_signal(('v', 1.0, 170, 100)),
+                                              encode_signal(('b', 0.5, 1000, 30))]))
+        self.assertTrue(wait_for(lambda: len(self.device.commands) == 2))
+        vib, buzz = self.device.commands
+        self.assertEqual((vib.source, buzz.source), ('v', 'b'))
+        self.assertEqual(vib.device_us, buzz.device_us)
+        self.assertEqual(self.device.last_params("buzzer"), (127, 1000, 30))
+
+    def test_multi_malformed_rejected(self):
+        """A MULTI frame with one bad command starts none of them."""
+        payload = encode_multi([encode_signal(('v', 1.0, 170, 100))])[3:] + bytes([ord('b'), 2, 1, 2])
+        payload = bytes([2]) + payload[1:]
+        self.arduino.send_frame(encode_frame('m', payload))
+        self.assertTrue(wait_for(lambda: self.device.malformed == 1))
+        self.assertEqual(self.device.commands, [])
+
+    def test_trigger_empty_slot_rejected(self):
+        """Triggering a slot that was never stored does nothing."""
+        self.arduino.send_frame(encode_trigger(7))
+        self.assertTrue(wait_for(lambda: self.device.malformed == 1))
+        self.assertEqual(self.device.commands, [])
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "pseudo-terminals not available")
+class TestUnplug(unittest.TestCase):
+    """Tests for disconnect detection when the device goes away."""
+
+    def test_unplug_detected_without_sending(self):
+        """Removing the device fires disconnect_cb promptly, with no write needed."""
+        device = VirtualBsense()
+        device.start()
+        arduino = ArduinoCom()
+        lost = []
+        arduino.disconnect_cb = lambda e: lost.append(time.perf_counter())
+        arduino.connect(device.port, retries=1)
+        start = time.perf_counter()
+        device.stop()
+        try:
+            self.assertTrue(wait_for(lambda: lost, timeout=1.0))
+            self.assertLess(lost[0] - start, 0.1)
+            self.assertEqual(len(lost), 1)
+            self.assertFalse(arduino.is_connected())
+        finally:
+            arduino.close()
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "pseudo-terminals not available")
+class TestDiscovery(unittest.TestCase):
+    """Tests for concurrent port probing."""
+
+    def test_discover_among_silent_ports(self):
+        """Only ports answering the identify request are reported, quickly."""
+        silent = [os.openpty() for _ in range(3)]
+        devices = [VirtualBsense() for _ in range(2)]
+        for device in devices:
+            device.start()
+        try:
+            ports = [os.ttyname(s) for _, s in silent] + [d.port for d in devices] + ["/dev/nonexistent_port_12345"]
+            start = time.perf_counter()
+            found = discover_devices(timeout=0.3, ports=ports)
+            self.assertLess(time.perf_counter() - start, 0.9)
+            self.assertEqual(sorted(info.port for info in found), sorted(d.port for d in devices))
+            self.assertTrue(all(info.firmware == "virtual" for info in found))
+        finally:
+            for device in devices:
+                device.stop()
+            for master, slave in silent:
+                os.close(master)
+                os.close(slave)
+
+    def test_discover_no_ports(self):
+        """An empty candidate list returns no devices."""
+        self.assertEqual(discover_devices(ports=[]), [])
+
+
+@unittest.skipUnless(hasattr(os, "openpty"), "pseudo-terminals not available")
+class TestDeviceScheduling(unittest.TestCase):
+    """Tests for commands timed by the device from a look-ahead queue."""
+
+    def setUp(self):
+        self.device = VirtualBsense()
+        self.device.start()
+
+    def tearDown(self):
+        self.device.stop()
+
+    def test_schedule_and_flush(self):
+        """Scheduled commands fire at their onset; a flush cancels the rest."""
+        arduino = ArduinoCom()
+        try:
+            arduino.connect(self.device.port, retries=1)
+            arduino.start_clock_sync(interval=0.05)
+            self.assertTrue(wait_for(lambda: arduino.schedule_supported))
+            onset = time.perf_counter_ns() + 30_000_000
+            frame = encode_signal(('v', 1.0, 170, 10))
+            first = arduino.schedule(frame, onset)
+            later = arduino.schedule(frame, onset + 10_000_000_000)
+            self.assertTrue(first.wait_ack(1.0))
+            self.assertLess(abs(self.device.commands[0].recv_ns - onset), 2_000_000)
+            self.assertEqual(arduino.flush_schedule(), [later])
+            self.assertTrue(later.lost)
+            self.assertEqual(len(self.device.commands), 1)
+        finally:
+            arduino.close()
+
+    def run_experiment(self, n_events, delay_s, **kwargs):
+        exp = Experiment(device_scheduling=True, **kwargs)
+        exp.connect_arduino(self.device.port)
+        exp.from_dict({"Type": "Sequence", "Repeat": n_events, "Content": [
+            {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+            {"Type": "Delay", "Duration": delay_s}]})
+        self.assertTrue(wait_for(lambda: exp.arduino.schedule_supported))
+        return exp
+
+    def test_intervals_timed_by_device(self):
+        """Inter-onset intervals follow the plan even while the host is busy."""
+        exp = self.run_experiment(20, 0.01, lookahead=4)
+        done = []
+        exp.log_cb = lambda text: done.append(text) if text == "End of experiment" else None
+        try:
+            exp.start()
+            self.assertTrue(wait_for(lambda: done, timeout=3.0))
+        finally:
+            exp.close()
+        onsets = [c.recv_ns for c in self.device.commands]
+        self.assertEqual(len(onsets), 20)
+        errors = sorted(abs((b - a) - 10_000_000) for a, b in zip(onsets, onsets[1:]))
+        self.assertLess(errors[len(errors) // 2], 2_000_000)  # median; the emulator thread can be preempted
+
+    def test_pause_flushes_and_resumes(self):
+        """Pausing drops the device queue; resuming continues with the next stimulus."""
+        exp = self.run_experiment(10, 0.05)
+        try:
+            exp.start()
+            self.assertTrue(wait_for(lambda: len(self.device.commands) >= 3))
+            exp.pause()
+            time.sleep(0.2)
+            fired = len(self.device.commands)
+            self.assertLess(fired, 10)
+            self.assertEqual(exp.current_idx, 2 * fired - 1)  # the delay after the last onset
+            exp.start()
+            self.assertTrue(wait_for(lambda: len(self.device.commands) == 10, timeout=3.0))
+        finally:
+            exp.close()
+
+    def test_current_idx_follows_acks(self):
+        """current_idx and event_cb follow the stimuli the device fired, not those scheduled ahead."""
+        exp = self.run_experiment(10, 0.05, lookahead=8)
+        events = []
+        exp.event_cb = events.append
+        try:
+            exp.start()
+            self.assertTrue(wait_for(lambda: len(self.device.commands) >= 2))
+            current = exp.current_idx
+            self.assertLessEqual(current, 2 * len(self.device.commands) - 1)
+            self.assertEqual(events, sorted(events))
+            self.assertTrue(exp.wait_finished(3.0))
+        finally:
+            exp.close()
+        self.assertEqual(events, list(range(20)))
+        self.assertEqual(exp.current_idx, 20)
+
+    def test_multi_split_for_older_firmware(self):
+        """Merged channels go out as MULTI frames, or as separate frames to older firmware."""
+        rules = {"Type": "stimulus", "Content": [
+            {"Type": "Vib1", "Amplitude": 1.0, "Frequency": 170, "Duration": 5},
+            {"Type": "Buzzer", "Amplitude": 0.5, "Tone": 1000, "Duration": 5}]}
+        for protocol in (5, 4):
+            self.device.protocol = protocol
+            self.device.commands.clear()
+            exp = Experiment(device_scheduling=True)
+            exp.connect_arduino(self.device.port)
+            exp.from_dict(rules)
+            try:
+                self.assertEqual(exp.arduino.multi_supported, protocol == 5)
+                self.assertTrue(wait_for(lambda: exp.arduino.schedule_supported))
+                exp.start()
+                self.assertTrue(wait_for(lambda: len(self.device.commands) == 2))
+            finally:
+                exp.close()
+            self.assertEqual([c.source for c in self.device.commands], ['v', 'b'])
+            self.assertEqual(self.device.malformed, 0)
+
+
+class TestHostTiming(unittest.TestCase):
+    """Tests for onsets timed by the host scheduler."""
+
+    def setUp(self):
+        self.device = VirtualBsense("loop")
+        self.device.start()
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.device.stop()
+        self.tmp.cleanup()
+
+    def test_onsets_on_absolute_deadlines(self):
+        """Onsets follow the planned grid; their timing is logged and exported at the end."""
+        log = []
+        timing_path = os.path.join(self.tmp.name, "timing.csv")
+        exp = Experiment(timing_path=timing_path)
+        exp.log_cb = log.append
+        exp.connect_arduino(self.device.port)
+        exp.from_dict({"Type": "Sequence", "Repeat": 20, "Content": [
+            {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+            {"Type": "Delay", "Duration": 0.01}]})
+        try:
+            exp.start()
+            self.assertTrue(wait_for(lambda: "End of experiment" in log, timeout=3.0))
+            report = exp.drift_report()
+            stats = exp.timing.stats()
+        finally:
+            exp.close()
+        onsets = [c.recv_ns for c in self.device.commands]
+        self.assertEqual(len(onsets), 20)
+        # distance from the 10 ms grid through the onsets (a late first onset does not shift it)
+        offsets = sorted(t - k * 10_000_000 for k, t in enumerate(onsets))
+        errors = sorted(abs(t - k * 10_000_000 - offsets[len(offsets) // 2]) for k, t in enumerate(onsets))
+        self.assertLess(errors[len(errors) // 2], 1_000_000)
+        self.assertEqual(report["onsets"], 20)
+        self.assertLess(stats["lateness_ms"]["p50"], 1.0)
+        self.assertTrue(any(line.startswith("timing: 20 onsets") for line in log))
+        with open(timing_path) as f:
+            rows = [line.split(",") for line in f.read().splitlines()[1:]]
+        self.assertEqual([int(row[0]) for row in rows], list(range(0, 40, 2)))
+        self.assertTrue(all(row[3] for row in rows))  # write completion known for every stimulus
+
+    def test_channels_on_single_device(self):
+        """Channelled stimuli all go to a single ArduinoCom."""
+        log = []
+        exp = Experiment()
+        exp.log_cb = log.append
+        exp.connect_arduino(self.device.port)
+        exp.from_dict({"Type": "Sequence", "Repeat": 3, "Content": [
+            {"Type": "stimulus", "Content": [
+                {"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5, "Channel": "booth1"},
+                {"Type": "Buzzer", "Amplitude": 0.5, "Tone": 1000, "Duration": 5, "Channel": "booth2"}]},
+            {"Type": "Delay", "Duration": 0.01}]})
+        try:
+            exp.start()
+            self.assertTrue(wait_for(lambda: "End of experiment" in log, timeout=3.0))
+        finally:
+            exp.close()
+        self.assertFalse([line for line in log if line.startswith("stimulus error")])
+        self.assertTrue(wait_for(lambda: len(self.device.commands) >= 3))
+
+
+class TestFastForward(unittest.TestCase):
+    """Tests for playing a plan into the virtual device on a simulated clock."""
+
+    def test_device_timeline(self):
+        """The device decodes every stimulus at its planned simulated time."""
+        result = fast_forward({"Type": "Sequence", "Repeat": 100, "Content": [
+            {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+            {"Type": "Delay", "Duration": 1.0}]})
+        self.assertEqual(result.duration_ns, 100 * 10 ** 9)
+        self.assertEqual([c.recv_ns for c in result.commands], [k * 10 ** 9 for k in range(100)])
+        self.assertEqual(result.timing["events"], 100)
+        self.assertEqual(result.timing["lateness_ms"]["max"], 0.0)
+        self.assertLess(result.wall_s, 5.0)
+
+    def test_stimulus_error_ends_run(self):
+        """A stimulus error stops the run; fast_forward returns instead of waiting for the end."""
+        submit = ArduinoCom.submit
+        calls = []
+
+        def failing(com, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == 3:
+                raise RuntimeError("write refused")
+            return submit(com, *args, **kwargs)
+
+        with mock.patch.object(ArduinoCom, "submit", failing):
+            result = fast_forward({"Type": "Sequence", "Repeat": 10, "Content": [
+                {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+                {"Type": "Delay", "Duration": 1.0}]}, timeout=10.0)
+        self.assertFalse(result.completed)
+        self.assertEqual(len(result.commands), 2)
+        self.assertIn("stimulus error: write refused", [text for _, text in result.log])
+
+
+class TestReconnect(unittest.TestCase):
+    """Tests for reconnecting after a glitch and resuming the experiment."""
+
+    def setUp(self):
+        self.device = VirtualBsense("loop")
+        self.device.start()
+
+    def tearDown(self):
+        self.device.stop()
+
+    def test_reconnect_after_glitch(self):
+        """The link is re-opened and handshaken; the outage is reported."""
+        arduino = ArduinoCom()
+        outages = []
+        arduino.reconnect_cb = outages.append
+        arduino.enable_reconnect(interval=0.05)
+        try:
+            arduino.connect(self.device.port, retries=1)
+            self.device.drop_link()
+            self.assertTrue(wait_for(lambda: outages))
+            self.assertGreater(outages[0], 0)
+            self.assertTrue(arduino.is_connected())
+            self.assertEqual(arduino.reconnects, 1)
+            arduino.send_frame(encode_signal(('v', 0.5, 170, 10)))
+            self.assertTrue(wait_for(lambda: self.device.commands))
+        finally:
+            arduino.close()
+
+    def run_with_glitch(self, policy, n_events=10, delay_s=0.05):
+        log = []
+        exp = Experiment(reconnect=policy)
+        exp.arduino.reconnect_interval = 0.2
+        exp.log_cb = log.append
+        exp.connect_arduino(self.device.port)
+        exp.from_dict({"Type": "Sequence", "Repeat": n_events, "Content": [
+            {"Type": "stimulus", "Content": [{"Type": "Vib1", "Amplitude": 0.5, "Frequency": 170, "Duration": 5}]},
+            {"Type": "Delay", "Duration": delay_s}]})
+        try:
+            exp.start()
+            self.assertTrue(wait_for(lambda: len(self.device.commands) >= 3))
+            self.device.drop_link()
+            self.assertTrue(wait_for(lambda: "End of experiment" in log, timeout=5.0))
+        finally:
+            exp.close()
+        self.assertTrue(any(line.startswith("reconnected after an outage of") for line in log))
+        return log
+
+    def test_shift_resumes_at_interrupted_event(self):
+        """With "shift" the run continues where it was cut, not from the start."""
+        log = self.run_with_glitch("shift")
+        # a frame written just before the cut may never reach the device
+        self.assertIn(len(self.device.commands), (9, 10))
+        self.assertFalse(any("missed" in line for line in log))
+
+    def test_keep_skips_stimuli_during_outage(self):
+        """With "keep" the plan keeps its times: stimuli due during the outage are skipped."""
+        log = self.run_with_glitch("keep")
+        missed = [line for line in log if line.startswith("stimulus missed during outage")]
+        self.assertGreater(len(missed), 0)
+        self.assertLessEqual(len(self.device.commands) + len(missed), 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# Add parent directory to path for imports
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.arduino_communication import ArduinoCom
+from core.protocol import encode_signal, encode_ack, IDENTIFY, READY, ACK, SEQUENCED
+from core.virtual_device import VirtualBsense
+from core.wire_trace import TraceWriter, iter_trace, load_trace, TX, RX
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def wait_for(predicate, timeout=1.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+class TestTraceFile(unittest.TestCase):
+    """Tests for writing and reading trace files."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "session.trace")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write_sample(self):
+        frames = [(1000, TX, encode_signal(('v', 0.5, 170, 10))), (2500, RX, encode_ack(7, 123456))]
+        with TraceWriter(self.path, flush_size=16) as trace:
+            for t_ns, direction, frame in frames:
+                trace.record(direction, t_ns, frame)
+        return frames
+
+    def test_round_trip(self):
+        """Records come back in order with timestamp, direction and frame."""
+        frames = self.write_sample()
+        self.assertEqual([tuple(r) for r in iter_trace(self.path)], frames)
+
+    def test_truncated_record_ignored(self):
+        """A record cut off at the end of the file is dropped, the rest is read."""
+        self.write_sample()
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        self.assertEqual(len(list(iter_trace(self.path))), 1)
+
+    def test_block_cut_short(self):
+        """In a block cut off at the end of the file, the records with a complete frame are read."""
+        frame = encode_signal(('v', 0.5, 170, 10))
+        with TraceWriter(self.path) as trace:
+            for k in range(3):
+                trace.record(TX, k, frame)
+        with open(self.path, "r+b") as f:
+            f.truncate(os.path.getsize(self.path) - 2)
+        self.assertEqual([r.t_ns for r in iter_trace(self.path)], [0, 1])
+
+    def test_flush_while_recording(self):
+        """flush() writes the block being filled; recording continues after it."""
+        frame = encode_signal(('v', 0.5, 170, 10))
+        with TraceWriter(self.path) as trace:
+            trace.record(TX, 1, frame)
+            trace.flush()
+            self.assertEqual(len(list(iter_trace(self.path))), 1)
+            trace.record(TX, 2, frame)
+        self.assertEqual([r.t_ns for r in iter_trace(self.path)], [1, 2])
+
+    def test_not_a_trace(self):
+        with open(self.path, "wb") as f:
+            f.write(b"0123456789abcdef0123456789")
+        with self.assertRaises(ValueError):
+            list(iter_trace(self.path))
+
+    @unittest.skipIf(numpy is None, "numpy not installed")
+    def test_load_numpy(self):
+        """load_trace returns one array entry per frame."""
+        frames = self.write_sample()
+        trace = load_trace(self.path)
+        self.assertEqual(list(trace["t_ns"]), [1000, 2500])
+        self.assertEqual(list(trace["direction"]), [TX, RX])
+        self.assertEqual(list(trace["source"]), [ord('v'), ord(ACK)])
+        offset, length = trace["offset"][1], trace["length"][1]
+        self.assertEqual(trace["data"][offset:offset + length].tobytes(), frames[1][2])
+        self.assertEqual(trace["data"].tobytes(), frames[0][2] + frames[1][2])  # frames only
+
+
+class TestLinkTrace(unittest.TestCase):
+    """Tests for tracing the frames of an ArduinoCom connection."""
+
+    def test_trace_both_directions(self):
+        """Handshake, sequenced commands and their acks are all traced."""
+        with tempfile.TemporaryDirectory() as tmp, VirtualBsense("loop") as device:
+            path = os.path.join(tmp, "link.trace")
+            arduino = ArduinoCom()
+            arduino.start_trace(path)
+            try:
+                arduino.connect(device.port, retries=1)
+                arduino.enable_acks(timeout=0.5)
+                self.assertTrue(arduino.submit(encode_signal(('v', 0.5, 170, 10))).wait_ack(1.0))
+            finally:
+                arduino.close()
+            records = list(iter_trace(path))
+        sent = [chr(r.frame[1]) for r in records if r.direction == TX]
+        received = [chr(r.frame[1]) for r in records if r.direction == RX]
+        self.assertEqual(sent[0], IDENTIFY)
+        self.assertIn(SEQUENCED, sent)
+        self.assertIn(READY, received)
+        self.assertIn(ACK, received)
+        times = [r.t_ns for r in records if r.direction == TX]
+        self.assertEqual(times, sorted(times))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,13 +7,14 @@ import time
 import sys
 import logging
 from core.experiment import Experiment
+from core.engine_process import ExperimentProcess, default_placement
 
 logger = logging.getLogger(__name__)
 #set theme
 ctk.set_default_color_theme("dark-blue") 
 
 class BsenseGUI(ctk.CTk):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, realtime=False, **kwargs):
         super().__init__(*args, **kwargs)
         
         
@@ -40,7 +41,11 @@ class BsenseGUI(ctk.CTk):
         
         self.file_log_open = False
         
-        self.exp = Experiment()
+        if realtime:
+            # engine in its own process (pinned, SCHED_FIFO where allowed): the Tk loop cannot delay onsets
+            self.exp = ExperimentProcess(*default_placement(), async_writes=True)
+        else:
+            self.exp = Experiment(async_writes=True)
         self.exp.log_cb = self.add_log
         self.exp.event_cb = self.on_new_event
         self.exp.disconnect_cb = self.on_disconnect  # callback for disconnect detection
@@ -67,6 +72,14 @@ class BsenseGUI(ctk.CTk):
         self.update_treeview(self.exp.sequence)
         self.add_log("Custom experiment: " + file)
 
+    def set_reconnect(self, policy):
+        # reconnect automatically and resume the run ("shift" or "keep" the remaining plan)
+        self.exp.enable_reconnect(policy)
+
+    def set_trace(self, path):
+        # record every frame on the link to a binary trace file
+        self.exp.start_trace(path)
+
         
 
     def setup_ui(self):
@@ -372,7 +385,10 @@ class BsenseGUI(ctk.CTk):
         self.exp_treeview.delete(*self.exp_treeview.get_children())
         #add the items
         for i in range(len(sequence)):
-            self.exp_treeview.insert("", i, text=str(i), values=(sequence[i][1], round(sequence[i][2][1], 2)))
+            value = sequence[i][2][1]
+            if isinstance(value, tuple):  # multi-channel stimulus: show the first channel
+                value = value[1]
+            self.exp_treeview.insert("", i, text=str(i), values=(sequence[i][1], round(value, 2)))
         #update the treeview
         self.exp_treeview.update_idletasks()
         if len(sequence) > 0:
@@ -422,6 +438,8 @@ class BsenseGUI(ctk.CTk):
                 #write everything in the log text widget to the file
                 self.file_log.write(self.log_text.get("1.0", tk.END))
                 self.file_log_open = True
+                # per-stimulus onset timing goes next to the log
+                self.exp.timing_path = filename[:-len(".log")] + "_timing.csv"
             except (IOError, OSError) as e:
                 self.add_log(f"Warning: Could not create log file: {e}")
                 self.file_log_open = False
@@ -0,0 +1,66 @@
+/*
+ * Mock Arduino / Teensy API for compiling the firmware on Linux.
+ *
+ * Time is simulated: micros() returns a virtual clock driven by the harness
+ * (host_main.cpp), and every call to it moves the clock forward a little,
+ * so busy-wait loops in the firmware terminate. Interval timers fire
+ * between two loop() calls, never in the middle of one, which makes a run
+ * fully deterministic. Pin writes and Serial output are reported to the
+ * driving process; Serial input comes from it.
+ */
+#ifndef BSENSE_HOST_ARDUINO_H
+#define BSENSE_HOST_ARDUINO_H
+
+#include <stdint.h>
+#include <stddef.h>
+#include <string.h>
+
+#define LOW 0
+#define HIGH 1
+#define INPUT 0
+#define OUTPUT 1
+#define LED_BUILTIN 13
+
+uint32_t micros();
+uint32_t millis();
+void delay(uint32_t ms);
+void delayMicroseconds(uint32_t us);
+
+void pinMode(int pin, int mode);
+void digitalWrite(int pin, int value);
+void analogWrite(int pin, int value);
+void analogWriteFrequency(int pin, float frequency);
+void analogWriteResolution(int bits);
+void tone(int pin, unsigned int frequency);
+void noTone(int pin);
+
+// Timers only fire between loop() calls, so there is nothing to mask
+inline void noInterrupts() {}
+inline void interrupts() {}
+
+class HostSerial
+{
+public:
+    void begin(uint32_t baud);
+    int available();
+    int read();
+    size_t readBytes(char *buffer, size_t length);
+    size_t write(uint8_t byte);
+    size_t write(const uint8_t *buffer, size_t size);
+    bool dtr();
+    operator bool() { return true; }
+};
+extern HostSerial Serial;
+
+// Teensy periodic interrupt
+class IntervalTimer
+{
+public:
+    bool begin(void (*handler)(), uint32_t period_us);
+    void end();
+
+private:
+    int slot = -1;
+};
+
+#endif
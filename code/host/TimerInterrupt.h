@@ -0,0 +1,27 @@
+/*
+ * Mock of the TimerInterrupt library used by arduino.ino (AVR hardware timers),
+ * backed by the harness interval timers.
+ */
+#ifndef BSENSE_HOST_TIMER_INTERRUPT_H
+#define BSENSE_HOST_TIMER_INTERRUPT_H
+
+#include "Arduino.h"
+
+class HostTimerInterrupt
+{
+public:
+    void init() {}
+    bool attachInterruptInterval(uint32_t period_ms, void (*handler)())
+    {
+        return timer.begin(handler, period_ms * 1000);
+    }
+    void detachInterrupt() { timer.end(); }
+
+private:
+    IntervalTimer timer;
+};
+
+extern HostTimerInterrupt ITimer1;
+extern HostTimerInterrupt ITimer3;
+
+#endif
@@ -0,0 +1,291 @@
+/*
+ * Linux harness for the firmware: implements the mock Arduino API of
+ * Arduino.h on a simulated clock and drives setup() / loop() / the interval
+ * timers from commands read on stdin. Built with the sketch by
+ * app/python/core/firmware_host.py.
+ *
+ * Commands (one per line on stdin):
+ *   rx <hex>      bytes arriving on Serial
+ *   dtr <0|1>     host opens / closes the port
+ *   run <us>      simulate that many microseconds
+ *   quit
+ *
+ * Events (one per line on stdout, times in simulated microseconds):
+ *   tx <t_us> <hex>                 bytes written with Serial.write()
+ *   pin <t_us> <pin> <kind> <value> a pin output changed; kind is d (digital),
+ *                                   a (PWM duty), f (PWM frequency) or t (tone)
+ *   done <t_us> <loops> <loop_ns> <busy_loops> <busy_ns> <isr_calls> <isr_ns>
+ *                                   end of setup() or of a run, with the loop()
+ *                                   and timer handler counts and host CPU time
+ *                                   since the previous done; busy loops are
+ *                                   the loop() calls that read Serial input
+ *   err <message>
+ *
+ * Options: -l <ns> simulated cost of one loop() pass (default 1000),
+ *          -m <ns> simulated cost of one micros() call (default 50),
+ *          -t <us> clock value at boot (default 0), to test wraparound.
+ */
+#include "Arduino.h"
+#include "TimerInterrupt.h"
+
+#include <chrono>
+#include <cstdio>
+#include <cstdlib>
+#include <cstring>
+#include <string>
+#include <vector>
+
+void setup();
+void loop();
+
+HostSerial Serial;
+HostTimerInterrupt ITimer1;
+HostTimerInterrupt ITimer3;
+
+namespace
+{
+const int MAX_TIMERS = 8;
+const int MAX_PINS = 64;
+
+struct Timer
+{
+    void (*handler)();
+    uint64_t period_ns;
+    uint64_t next_ns;
+    bool active;
+};
+
+uint64_t now_ns = 0;
+uint64_t loop_cost_ns = 1000;
+uint64_t micros_cost_ns = 50;
+Timer timers[MAX_TIMERS];
+std::vector<uint8_t> rx_buf;
+size_t rx_pos = 0;
+bool dtr_state = false;
+int pin_state[4][MAX_PINS]; // d, a, f, t; -1 until first written
+
+struct Counters
+{
+    uint64_t loops, loop_ns, busy_loops, busy_ns, isr_calls, isr_ns;
+} counters;
+
+const char PIN_KINDS[4] = {'d', 'a', 'f', 't'};
+
+uint64_t host_ns()
+{
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(
+               std::chrono::steady_clock::now().time_since_epoch())
+        .count();
+}
+
+unsigned long long now_us() { return (unsigned long long)(now_ns / 1000); }
+
+void set_pin(int kind, int pin, int value)
+{
+    if (pin < 0 || pin >= MAX_PINS || pin_state[kind][pin] == value) return;
+    pin_state[kind][pin] = value;
+    printf("pin %llu %d %c %d\n", now_us(), pin, PIN_KINDS[kind], value);
+}
+
+void fire_timers()
+{
+    for (int i = 0; i < MAX_TIMERS; i++)
+    {
+        Timer &timer = timers[i];
+        if (!timer.active || timer.next_ns > now_ns) continue;
+        // an overrun skips the ticks already missed, keeping the phase
+        timer.next_ns += timer.period_ns * ((now_ns - timer.next_ns) / timer.period_ns + 1);
+        uint64_t start = host_ns();
+        timer.handler();
+        counters.isr_ns += host_ns() - start;
+        counters.isr_calls++;
+    }
+}
+
+void run(uint64_t duration_us)
+{
+    uint64_t end_ns = now_ns + duration_us * 1000;
+    while (now_ns < end_ns)
+    {
+        fire_timers();
+        size_t pos = rx_pos;
+        uint64_t start = host_ns();
+        loop();
+        uint64_t elapsed = host_ns() - start;
+        counters.loops++;
+        counters.loop_ns += elapsed;
+        if (rx_pos != pos)
+        {
+            counters.busy_loops++;
+            counters.busy_ns += elapsed;
+        }
+        now_ns += loop_cost_ns;
+    }
+}
+
+void report_done()
+{
+    printf("done %llu %llu %llu %llu %llu %llu %llu\n", now_us(),
+           (unsigned long long)counters.loops, (unsigned long long)counters.loop_ns,
+           (unsigned long long)counters.busy_loops, (unsigned long long)counters.busy_ns,
+           (unsigned long long)counters.isr_calls, (unsigned long long)counters.isr_ns);
+    memset(&counters, 0, sizeof(counters));
+    fflush(stdout);
+}
+
+bool parse_hex(const char *text, std::vector<uint8_t> &out)
+{
+    size_t n = strlen(text);
+    if (n % 2) return false;
+    for (size_t i = 0; i < n; i += 2)
+    {
+        char byte[3] = {text[i], text[i + 1], 0};
+        char *end;
+        long value = strtol(byte, &end, 16);
+        if (*end) return false;
+        out.push_back((uint8_t)value);
+    }
+    return true;
+}
+} // namespace
+
+// -- mock Arduino API -------------------------------------------------------
+
+uint32_t micros()
+{
+    now_ns += micros_cost_ns;
+    return (uint32_t)(now_ns / 1000);
+}
+
+uint32_t millis() { return micros() / 1000; }
+
+void delay(uint32_t ms) { now_ns += (uint64_t)ms * 1000000; }
+
+void delayMicroseconds(uint32_t us) { now_ns += (uint64_t)us * 1000; }
+
+void pinMode(int, int) {}
+
+void digitalWrite(int pin, int value) { set_pin(0, pin, value ? HIGH : LOW); }
+
+void analogWrite(int pin, int value) { set_pin(1, pin, value); }
+
+void analogWriteFrequency(int pin, float frequency) { set_pin(2, pin, (int)frequency); }
+
+void analogWriteResolution(int) {}
+
+void tone(int pin, unsigned int frequency) { set_pin(3, pin, (int)frequency); }
+
+void noTone(int pin) { set_pin(3, pin, 0); }
+
+void HostSerial::begin(uint32_t) {}
+
+int HostSerial::available() { return (int)(rx_buf.size() - rx_pos); }
+
+int HostSerial::read()
+{
+    if (rx_pos >= rx_buf.size()) return -1;
+    return rx_buf[rx_pos++];
+}
+
+size_t HostSerial::readBytes(char *buffer, size_t length)
+{
+    size_t n = 0;
+    while (n < length && rx_pos < rx_buf.size()) buffer[n++] = (char)rx_buf[rx_pos++];
+    return n;
+}
+
+size_t HostSerial::write(uint8_t byte) { return write(&byte, 1); }
+
+size_t HostSerial::write(const uint8_t *buffer, size_t size)
+{
+    printf("tx %llu ", now_us());
+    for (size_t i = 0; i < size; i++) printf("%02x", buffer[i]);
+    printf("\n");
+    return size;
+}
+
+bool HostSerial::dtr() { return dtr_state; }
+
+bool IntervalTimer::begin(void (*handler)(), uint32_t period_us)
+{
+    if (slot < 0)
+    {
+        for (int i = 0; i < MAX_TIMERS && slot < 0; i++)
+        {
+            if (!timers[i].active) slot = i;
+        }
+        if (slot < 0) return false;
+    }
+    timers[slot].handler = handler;
+    timers[slot].period_ns = (uint64_t)period_us * 1000;
+    timers[slot].next_ns = now_ns + timers[slot].period_ns;
+    timers[slot].active = true;
+    return true;
+}
+
+void IntervalTimer::end()
+{
+    if (slot >= 0) timers[slot].active = false;
+    slot = -1;
+}
+
+// -- driver -----------------------------------------------------------------
+
+int main(int argc, char **argv)
+{
+    for (int i = 1; i + 1 < argc; i += 2)
+    {
+        if (!strcmp(argv[i], "-l")) loop_cost_ns = strtoull(argv[i + 1], NULL, 10);
+        else if (!strcmp(argv[i], "-m")) micros_cost_ns = strtoull(argv[i + 1], NULL, 10);
+        else if (!strcmp(argv[i], "-t")) now_ns = strtoull(argv[i + 1], NULL, 10) * 1000;
+    }
+    memset(pin_state, 0xff, sizeof(pin_state));
+
+    setup();
+    report_done();
+
+    std::string line;
+    char chunk[4096];
+    while (fgets(chunk, sizeof(chunk), stdin))
+    {
+        line += chunk;
+        if (line.empty() || line.back() != '\n') continue; // long rx line, keep reading
+        line.pop_back();
+        std::string command = line.substr(0, line.find(' '));
+        std::string arg = line.size() > command.size() ? line.substr(command.size() + 1) : "";
+        line.clear();
+
+        if (command == "rx")
+        {
+            std::vector<uint8_t> bytes;
+            if (!parse_hex(arg.c_str(), bytes))
+            {
+                printf("err bad hex\n");
+                fflush(stdout);
+                continue;
+            }
+            rx_buf.erase(rx_buf.begin(), rx_buf.begin() + rx_pos);
+            rx_pos = 0;
+            rx_buf.insert(rx_buf.end(), bytes.begin(), bytes.end());
+        }
+        else if (command == "dtr")
+        {
+            dtr_state = arg == "1";
+        }
+        else if (command == "run")
+        {
+            run(strtoull(arg.c_str(), NULL, 10));
+            report_done();
+        }
+        else if (command == "quit")
+        {
+            break;
+        }
+        else
+        {
+            printf("err unknown command '%s'\n", command.c_str());
+            fflush(stdout);
+        }
+    }
+    return 0;
+}
@@ -3,6 +3,30 @@
  *
  * Controls LRA vibration motor and buzzer for haptic/audio stimuli.
  * Communicates via serial (115200 baud) with binary protocol.
+ * Frames: [0xaa] [cmd] [len] [payload...] in both directions.
+ * A command wrapped in a 'q' frame ([seq:2][cmd:1][payload]) is acknowledged
+ * with a 'k' frame ([seq:2][onset micros:4]).
+ * A 'p' ping ([token:2]) is answered with an 'o' pong ([token:2][micros:4])
+ * so the host can map micros() to its own clock.
+ * An 'r' ready banner ([protocol:1][firmware version]) is sent at boot, when
+ * the host opens the port (DTR) and in reply to an 'i' identify request.
+ * A 't' frame ([index:1][cmd:1][payload]) stores a stimulus in the table;
+ * an 'x' frame ([index:1]) then runs it, so each onset only costs 4 bytes.
+ * An 's' frame ([seq:2][onset micros:4][cmd:1][payload]) queues a command in
+ * a ring buffer; the schedule interrupt fires it at that micros() time and a
+ * 'k' ack reports the actual onset. 'f' drops the queue and is answered with
+ * a 'd' frame ([number dropped:1]).
+ * An 'm' frame ([count:1] then [cmd:1][len:1][payload] per command) starts
+ * several channels in one pass with a single micros() onset. It can be sent
+ * on its own, sequenced or scheduled.
+ * A 'g' request is answered with an 'n' frame holding the parser counters
+ * ([frames:4][malformed:4][dropped:4][skipped bytes:4]).
+ *
+ * Frame parsing: loop() moves the bytes Serial has received into a ring
+ * buffer and a state machine consumes them without ever waiting, so several
+ * queued frames are handled per pass. Bytes outside a frame are skipped up to
+ * the next start byte, and a frame still incomplete FRAME_TIMEOUT_US after its
+ * start byte is dropped.
  *
  * Amplitude Scaling Notes:
  * - PWM resolution: 9-bit (0-511)
@@ -12,6 +36,16 @@
  * - Amplitude 0-255 is scaled by *4 to use full PWM range
  * - Effective usable amplitude: 0-77 (values above saturate the actuator)
  *
+ * Vib1 Waveform:
+ * - A 40 kHz waveform interrupt (WAVE_TICK_US) runs a 32-bit phase accumulator
+ *   (direct digital synthesis), so the drive frequency is exact on average
+ *   instead of being rounded to the 1 ms TimerHandler tick
+ * - VIB1_WAVEFORM selects the shape: WAVE_SQUARE (full amplitude, direction
+ *   flipped every half period, the original drive) or WAVE_SINE (duty follows
+ *   |sin| from a 256-entry half-wave table, direction pin gives the sign)
+ * - The drive starts at the command onset and stops within one wave tick of
+ *   the requested duration
+ *
  * Buzzer Implementation:
  * - Uses hardware PWM via analogWriteFrequency() for accurate tone generation
  * - Works well at high frequencies (e.g., 2000Hz) unlike manual toggling
@@ -20,6 +54,13 @@
  */
 
 #define TIMER_INTERVAL_US 1000
+#define WAVE_TICK_US 25          // Vib1 waveform sample period (40 kHz)
+
+#define WAVE_SQUARE 0
+#define WAVE_SINE 1
+#ifndef VIB1_WAVEFORM
+#define VIB1_WAVEFORM WAVE_SQUARE
+#endif
 
 #define PIN_TRIG 2
 #define PIN_VIB1_PWM 0
@@ -33,18 +74,48 @@
 #define PIN_BUZZER_AMP 3
 
 #define STARTING_CHAR 0xaa
+#define SEQUENCED_CHAR 'q'  // host -> device: command wrapped with a sequence number
+#define ACK_CHAR 'k'        // device -> host: acknowledgement of a sequenced command
+#define PING_CHAR 'p'       // host -> device: clock sync ping [token:2]
+#define PONG_CHAR 'o'       // device -> host: reply to a ping [token:2][micros:4]
+#define IDENTIFY_CHAR 'i'   // host -> device: request the ready banner
+#define READY_CHAR 'r'      // device -> host: ready banner [protocol:1][firmware version...]
+#define TABLE_ENTRY_CHAR 't' // host -> device: store a stimulus [index:1][cmd:1][payload...]
+#define TRIGGER_CHAR 'x'     // host -> device: run a stored stimulus [index:1]
+#define SCHEDULED_CHAR 's'   // host -> device: run a command at a device time [seq:2][onset micros:4][cmd:1][payload...]
+#define FLUSH_CHAR 'f'       // host -> device: drop the scheduled commands not fired yet
+#define FLUSHED_CHAR 'd'     // device -> host: reply to a flush [number dropped:1]
+#define MULTI_CHAR 'm'       // host -> device: several commands at one onset [count:1]([cmd:1][len:1][payload...])*
+#define COUNTERS_REQUEST_CHAR 'g' // host -> device: request the parser counters
+#define COUNTERS_CHAR 'n'    // device -> host: [frames:4][malformed:4][dropped:4][skipped bytes:4]
+
+#define PROTOCOL_VERSION 6
+#define FIRMWARE_VERSION "1.6.0"
+
+#define TABLE_SIZE 128
+#define TABLE_DATA_SIZE 10  // largest stimulus payload ('c')
+#define COMMAND_DATA_SIZE 24 // largest scheduled payload ('m' with three channels)
+
+#define SCHEDULE_SIZE 32         // ring buffer slots (holds SCHEDULE_SIZE - 1 commands)
+#define SCHEDULE_TICK_US 20      // schedule interrupt period; the last tick spins to the exact onset
+
+#define RX_RING_SIZE 256         // received bytes not parsed yet (holds RX_RING_SIZE - 1)
+#define FRAME_TIMEOUT_US 100000  // a frame not complete this long after its start byte is dropped
+#define MAX_FRAMES_PER_LOOP 8    // frames handled per loop() pass, so acks are not held back
 
 IntervalTimer myTimer;
+IntervalTimer scheduleTimer;
+IntervalTimer waveTimer;
 
 uint8_t ampVib1 = 0;
-uint32_t periodVib1 = 0;
+volatile uint32_t vib1_phase = 0;      // waveform phase, a full turn is 2^32
+volatile uint32_t vib1_phase_inc = 0;  // phase step per wave tick, 0 = no drive
 // uint8_t ampVib2 = 0;      // VIB2 unused
 // uint32_t periodVib2 = 0;  // VIB2 unused
 uint8_t ampBuzz = 0;
 uint16_t freqBuzz = 0;  // Buzzer frequency for analogWriteFrequency()
 
 unsigned long micros_time = 0;
-unsigned long start_us_vib1 = 0;
 unsigned long end_us_vib1 = 0;
 // unsigned long start_us_vib2 = 0;  // VIB2 unused
 // unsigned long end_us_vib2 = 0;    // VIB2 unused
@@ -61,27 +132,68 @@ uint8_t len;
 uint8_t buff[64];
 unsigned long t_us = 0;
 
+// Frame parser: Serial -> rx_ring -> parse state machine -> buff
+enum ParseState
+{
+    WAIT_START,
+    WAIT_SOURCE,
+    WAIT_LEN,
+    WAIT_PAYLOAD
+};
+uint8_t rx_ring[RX_RING_SIZE];
+uint16_t rx_head = 0;
+uint16_t rx_tail = 0;
+ParseState parse_state = WAIT_START;
+uint8_t parse_pos = 0;                 // payload bytes received so far
+unsigned long frame_start_us = 0;      // when the start byte of the current frame was parsed
+
+// Parser counters, reported in the 'n' frame
+uint32_t frames_received = 0;          // complete frames
+uint32_t frames_malformed = 0;         // complete frames rejected (bad length or content)
+uint32_t frames_dropped = 0;           // incomplete frames (timeout, length over the buffer) and schedule overflows
+uint32_t bytes_skipped = 0;            // bytes discarded while looking for a start byte
+
+bool last_dtr = false;                 // host port state, to announce readiness when it opens
+
+uint8_t table_cmd[TABLE_SIZE];                    // stored stimulus command, 0 = empty slot
+uint8_t table_len[TABLE_SIZE];
+uint8_t table_data[TABLE_SIZE][TABLE_DATA_SIZE];
+
+// Scheduled commands, in onset order. loop() writes at schedule_head, the
+// schedule interrupt fires from schedule_tail and reports onsets in fired_buf.
+struct ScheduledCommand
+{
+    unsigned long onset_us;
+    uint16_t seq;
+    uint8_t cmd;
+    uint8_t len;
+    uint8_t data[COMMAND_DATA_SIZE];
+};
+struct FiredCommand
+{
+    uint16_t seq;
+    unsigned long onset_us;
+};
+ScheduledCommand schedule_buf[SCHEDULE_SIZE];
+volatile uint8_t schedule_head = 0;
+volatile uint8_t schedule_tail = 0;
+FiredCommand fired_buf[SCHEDULE_SIZE];
+volatile uint8_t fired_head = 0;
+volatile uint8_t fired_tail = 0;
+
+// Sequenced commands already run, to ack retransmissions without running them again:
+// bit k of seq_window is set if seq last_seq - k ran (a retransmitted command can
+// arrive after later ones whose ack was not lost)
+#define SEQ_WINDOW 32
+uint16_t last_seq = 0;                 // newest sequenced command run
+bool last_seq_valid = false;
+uint32_t seq_window = 0;
+unsigned long seq_onset_us[SEQ_WINDOW]; // onset of each seq in the window, by seq % SEQ_WINDOW
+
 void TimerHandler()
 {
     t_us = micros();
 
-    if (vib1_state)
-    {
-        if (t_us >= end_us_vib1)
-        { // if the duration is over: turn it off
-            vib1(0, LOW);
-            vib1_state = false;
-        }
-        else if (periodVib1 > 0)
-        {
-            // Calculate direction based on elapsed time from start
-            unsigned long elapsed = t_us - start_us_vib1;
-            unsigned long half_period = periodVib1 / 2;
-            bool dir = (half_period > 0) ? ((elapsed / half_period) % 2) : LOW;
-            vib1(ampVib1, dir);
-        }
-    }
-
     // VIB2 unused
     // if (vib2_state && t_us >= end_us_vib2)
     // {
@@ -102,6 +214,89 @@ void TimerHandler()
     }
 }
 
+// Half a sine period (0..pi) in 256 steps, scaled to 0-255
+const uint8_t sine_table[256] = {
+      0,   3,   6,   9,  13,  16,  19,  22,  25,  28,  31,  34,  37,  41,  44,  47,
+     50,  53,  56,  59,  62,  65,  68,  71,  74,  77,  80,  83,  86,  89,  92,  95,
+     98, 100, 103, 106, 109, 112, 115, 117, 120, 123, 126, 128, 131, 134, 136, 139,
+    142, 144, 147, 149, 152, 154, 157, 159, 162, 164, 167, 169, 171, 174, 176, 178,
+    180, 183, 185, 187, 189, 191, 193, 195, 197, 199, 201, 203, 205, 207, 208, 210,
+    212, 214, 215, 217, 219, 220, 222, 223, 225, 226, 228, 229, 231, 232, 233, 234,
+    236, 237, 238, 239, 240, 241, 242, 243, 244, 245, 246, 247, 247, 248, 249, 249,
+    250, 251, 251, 252, 252, 253, 253, 253, 254, 254, 254, 255, 255, 255, 255, 255,
+    255, 255, 255, 255, 255, 255, 254, 254, 254, 253, 253, 253, 252, 252, 251, 251,
+    250, 249, 249, 248, 247, 247, 246, 245, 244, 243, 242, 241, 240, 239, 238, 237,
+    236, 234, 233, 232, 231, 229, 228, 226, 225, 223, 222, 220, 219, 217, 215, 214,
+    212, 210, 208, 207, 205, 203, 201, 199, 197, 195, 193, 191, 189, 187, 185, 183,
+    180, 178, 176, 174, 171, 169, 167, 164, 162, 159, 157, 154, 152, 149, 147, 144,
+    142, 139, 136, 134, 131, 128, 126, 123, 120, 117, 115, 112, 109, 106, 103, 100,
+     98,  95,  92,  89,  86,  83,  80,  77,  74,  71,  68,  65,  62,  59,  56,  53,
+     50,  47,  44,  41,  37,  34,  31,  28,  25,  22,  19,  16,  13,   9,   6,   3,
+};
+
+void WaveHandler() // one Vib1 drive sample every WAVE_TICK_US
+{
+    if (!vib1_state)
+    {
+        return;
+    }
+    if ((long)(micros() - end_us_vib1) >= 0)
+    { // if the duration is over: turn it off
+        vib1(0, LOW);
+        vib1_state = false;
+        return;
+    }
+    if (vib1_phase_inc == 0)
+    {
+        return;
+    }
+    vib1_phase += vib1_phase_inc;
+    bool dir = vib1_phase >> 31; // second half of the period drives the other way
+#if VIB1_WAVEFORM == WAVE_SINE
+    vib1((ampVib1 * sine_table[(vib1_phase >> 23) & 0xff]) / 255, dir);
+#else
+    vib1(ampVib1, dir);
+#endif
+}
+
+void vib1_start(uint16_t freq) // start the Vib1 waveform at phase 0, at micros_time
+{
+    vib1_phase = 0;
+    vib1_phase_inc = ((uint64_t)freq * WAVE_TICK_US << 32) / 1000000;
+    vib1_state = true;
+    if (vib1_phase_inc > 0)
+    {
+        vib1(VIB1_WAVEFORM == WAVE_SINE ? 0 : ampVib1, LOW);
+    }
+}
+
+void ScheduleHandler()
+{
+    while (schedule_tail != schedule_head)
+    {
+        ScheduledCommand &next = schedule_buf[schedule_tail];
+        if ((long)(next.onset_us - micros()) > SCHEDULE_TICK_US)
+        {
+            return; // not due before the next tick
+        }
+        while ((long)(next.onset_us - micros()) > 0)
+        {
+            // spin for the last few microseconds
+        }
+        if (apply_command(next.cmd, next.data, next.len))
+        {
+            uint8_t fired_next = (fired_head + 1) % SCHEDULE_SIZE;
+            if (fired_next != fired_tail) // acks are dropped if loop() fell this far behind
+            {
+                fired_buf[fired_head].seq = next.seq;
+                fired_buf[fired_head].onset_us = micros_time;
+                fired_head = fired_next;
+            }
+        }
+        schedule_tail = (schedule_tail + 1) % SCHEDULE_SIZE;
+    }
+}
+
 void vib1(int amp, bool dir) // switch the vibration1 on or off
 {
     // Amplitude scaled by 4 for 9-bit PWM (0-511)
@@ -171,97 +366,376 @@ void setup()
     pinMode(LED_BUILTIN, OUTPUT);
 
     myTimer.begin(TimerHandler, TIMER_INTERVAL_US); // start the timer with the handler and interval
+    scheduleTimer.begin(ScheduleHandler, SCHEDULE_TICK_US);
+    waveTimer.begin(WaveHandler, WAVE_TICK_US);
+    send_ready(); // announce readiness (the host may not be listening yet, see loop())
 }
 
-void loop()
+// Payload length a stimulus command needs, 0 for anything else
+uint8_t command_length(uint8_t cmd)
+{
+    if (cmd == 'v' || cmd == 'w' || cmd == 'b') return 5;
+    if (cmd == 'c') return 10;
+    return 0;
+}
+
+// Apply a stimulus command at the current time.
+// Returns false (and does nothing) for an unknown command or a payload too short for it.
+bool apply_command(uint8_t cmd, uint8_t *data, uint8_t data_len)
+{
+    if (cmd == TRIGGER_CHAR) // stored stimulus: run the table entry instead
+    {
+        if (data_len < 1 || data[0] >= TABLE_SIZE || table_cmd[data[0]] == 0) return false;
+        uint8_t index = data[0];
+        return apply_command(table_cmd[index], table_data[index], table_len[index]);
+    }
+    if (cmd == MULTI_CHAR)
+    {
+        return apply_multi(data, data_len);
+    }
+
+    // Validate the command and its message length
+    uint8_t needed = command_length(cmd);
+    if (needed == 0 || data_len < needed) {
+        return false; // Unknown command or invalid message length
+    }
+
+    micros_time = micros();               // get the current time
+    start_command(cmd, data);
+    return true;
+}
+
+// 'm' payload: [count:1] then [cmd:1][len:1][payload] per command.
+// Every command is checked first, so a bad frame starts nothing; then all
+// of them start with the same micros_time (no skew between channels).
+bool apply_multi(uint8_t *data, uint8_t data_len)
+{
+    if (data_len < 1 || data[0] == 0) return false;
+    uint8_t pos = 1;
+    for (uint8_t i = 0; i < data[0]; i++)
+    {
+        if (pos + 2 > data_len) return false;
+        uint8_t needed = command_length(data[pos]);
+        if (needed == 0 || data[pos + 1] < needed || pos + 2 + data[pos + 1] > data_len) return false;
+        pos += 2 + data[pos + 1];
+    }
+    micros_time = micros();               // one onset for every channel
+    pos = 1;
+    for (uint8_t i = 0; i < data[0]; i++)
+    {
+        start_command(data[pos], &data[pos + 2]);
+        pos += 2 + data[pos + 1];
+    }
+    return true;
+}
+
+// Start a validated stimulus command at micros_time
+void start_command(uint8_t cmd, uint8_t *data)
 {
-    if (Serial.available() >= 3)
+    trigger_pulse(true);                  // trigger a pulse on the trigger pin
+    delay_trig = micros_time + 5000;      // the trigger pulse is 5ms
+    switch (cmd)
     {
-        Serial.readBytes((char *)&buff, 3);
-        if (buff[0] == STARTING_CHAR)
+    case 'v':                                       // trigger a pulse for the vibration1
+    {
+        ampVib1 = data[0];                          // read the amplitude of the vibration1
+        end_us_vib1 = micros_time + *((uint16_t *)&data[3]) * ((unsigned long)1000);
+        vib1_start(*((uint16_t *)&data[1]));        // frequency (2 bytes)
+        break;
+    }
+    // VIB2 unused
+    // case 'w':
+    // {
+    //     ampVib2 = data[0];
+    //     uint16_t freqVib2 = *((uint16_t *)&data[1]);
+    //     periodVib2 = (freqVib2 > 0) ? (1000000 / freqVib2) : 0;
+    //     start_us_vib2 = micros_time;
+    //     end_us_vib2 = micros_time + *((uint16_t *)&data[3]) * ((unsigned long)1000);
+    //     vib2_state = true;
+    //     break;
+    // }
+    case 'b':                                       // trigger a pulse for the buzzer
+    {
+        ampBuzz = data[0];                          // read the amplitude of the buzzer
+        freqBuzz = *((uint16_t *)&data[1]);         // read the frequency (2 bytes)
+        start_us_buzz = micros_time;
+        end_us_buzz = micros_time + *((uint16_t *)&data[3]) * ((unsigned long)1000);
+        buzzer_start(ampBuzz, freqBuzz);            // start buzzer with hardware PWM
+        buzz_state = true;
+        break;
+    }
+    case 'c':                                       // combination of Buzzer and Vibration1
+    {
+        // Vibration 1
+        ampVib1 = data[0];                          // read the amplitude of the vibration1
+        end_us_vib1 = micros_time + *((uint16_t *)&data[3]) * ((unsigned long)1000);
+        vib1_start(*((uint16_t *)&data[1]));        // frequency (2 bytes)
+        // Buzzer
+        ampBuzz = data[5];                          // read the amplitude of the buzzer
+        freqBuzz = *((uint16_t *)&data[6]);         // read the frequency (2 bytes)
+        start_us_buzz = micros_time;
+        end_us_buzz = micros_time + *((uint16_t *)&data[8]) * ((unsigned long)1000);
+        buzzer_start(ampBuzz, freqBuzz);            // start buzzer with hardware PWM
+        buzz_state = true;
+        break;
+    }
+    default:
+        break;
+    }
+}
+
+bool store_table_entry(uint8_t *data, uint8_t data_len) // 't' frame: [index:1][cmd:1][payload...]
+{
+    if (data_len < 2 || data[0] >= TABLE_SIZE || data_len - 2 > TABLE_DATA_SIZE || data[1] == TRIGGER_CHAR)
+    {
+        return false;
+    }
+    uint8_t index = data[0];
+    table_cmd[index] = data[1];
+    table_len[index] = data_len - 2;
+    memcpy(table_data[index], &data[2], data_len - 2);
+    return true;
+}
+
+bool schedule_command(uint8_t *data, uint8_t data_len) // 's' frame: [seq:2][onset micros:4][cmd:1][payload...]
+{
+    if (data_len < 7 || data_len - 7 > COMMAND_DATA_SIZE)
+    {
+        return false;
+    }
+    uint8_t next = (schedule_head + 1) % SCHEDULE_SIZE;
+    if (next == schedule_tail)
+    {
+        frames_dropped++; // full: the host keeps fewer commands in flight than SCHEDULE_SIZE
+        return true;
+    }
+    ScheduledCommand &entry = schedule_buf[schedule_head];
+    memcpy(&entry.seq, &data[0], 2);
+    memcpy(&entry.onset_us, &data[2], 4);
+    entry.cmd = data[6];
+    entry.len = data_len - 7;
+    memcpy(entry.data, &data[7], entry.len);
+    schedule_head = next; // publish to the schedule interrupt
+    return true;
+}
+
+void flush_schedule() // 'f' frame: drop the commands not fired yet
+{
+    noInterrupts();
+    uint8_t dropped = (schedule_head - schedule_tail + SCHEDULE_SIZE) % SCHEDULE_SIZE;
+    schedule_tail = schedule_head;
+    interrupts();
+    send_fired_acks(); // commands fired before the flush are acknowledged before the reply
+    send_frame(FLUSHED_CHAR, &dropped, 1);
+}
+
+void send_fired_acks() // report the onsets of scheduled commands fired by the interrupt
+{
+    while (fired_tail != fired_head)
+    {
+        send_ack(fired_buf[fired_tail].seq, fired_buf[fired_tail].onset_us);
+        fired_tail = (fired_tail + 1) % SCHEDULE_SIZE;
+    }
+}
+
+void send_frame(uint8_t src, const uint8_t *payload, uint8_t payload_len) // send a frame to the host
+{
+    uint8_t header[3] = {STARTING_CHAR, src, payload_len};
+    Serial.write(header, 3);
+    Serial.write(payload, payload_len);
+}
+
+void send_ack(uint16_t seq, unsigned long onset_us) // acknowledge a sequenced command: [seq:2][onset micros:4]
+{
+    uint8_t ack[6];
+    memcpy(&ack[0], &seq, 2);
+    memcpy(&ack[2], &onset_us, 4);
+    send_frame(ACK_CHAR, ack, 6);
+}
+
+void send_pong(uint16_t token) // reply to a clock sync ping with the current time
+{
+    unsigned long now_us = micros();
+    uint8_t pong[6];
+    memcpy(&pong[0], &token, 2);
+    memcpy(&pong[2], &now_us, 4);
+    send_frame(PONG_CHAR, pong, 6);
+}
+
+void send_counters() // parser counters: [frames:4][malformed:4][dropped:4][skipped bytes:4]
+{
+    uint8_t counters[16];
+    memcpy(&counters[0], &frames_received, 4);
+    memcpy(&counters[4], &frames_malformed, 4);
+    memcpy(&counters[8], &frames_dropped, 4);
+    memcpy(&counters[12], &bytes_skipped, 4);
+    send_frame(COUNTERS_CHAR, counters, 16);
+}
+
+void send_ready() // ready banner: protocol version and firmware version
+{
+    uint8_t banner[1 + sizeof(FIRMWARE_VERSION) - 1];
+    banner[0] = PROTOCOL_VERSION;
+    memcpy(&banner[1], FIRMWARE_VERSION, sizeof(FIRMWARE_VERSION) - 1);
+    send_frame(READY_CHAR, banner, sizeof(banner));
+}
+
+void read_serial() // move the bytes Serial has received into the ring buffer
+{
+    int available = Serial.available();
+    while (available-- > 0 && (rx_head + 1) % RX_RING_SIZE != rx_tail)
+    {
+        rx_ring[rx_head] = Serial.read();
+        rx_head = (rx_head + 1) % RX_RING_SIZE;
+    }
+}
+
+void parse_frames() // consume the ring buffer and handle every complete frame
+{
+    if (parse_state != WAIT_START && micros() - frame_start_us > FRAME_TIMEOUT_US)
+    {
+        frames_dropped++; // the rest of the frame never came: resync on the next start byte
+        parse_state = WAIT_START;
+    }
+    uint8_t handled = 0;
+    while (rx_tail != rx_head && handled < MAX_FRAMES_PER_LOOP)
+    {
+        if (parse_state == WAIT_PAYLOAD)
+        {
+            // copy as much of the payload as is contiguous in the ring
+            uint16_t end = rx_head > rx_tail ? rx_head : RX_RING_SIZE;
+            uint16_t n = end - rx_tail;
+            if (n > (uint16_t)(len - parse_pos)) n = len - parse_pos;
+            memcpy(&buff[parse_pos], &rx_ring[rx_tail], n);
+            parse_pos += n;
+            rx_tail = (rx_tail + n) % RX_RING_SIZE;
+        }
+        else
         {
-            source = buff[1];                     // read what type of stimulus is {v: vibration1, w: vibration2, b: buzzer}
-            len = buff[2];                        // read the length of the message
-            if (len > sizeof(buff))               // bounds check to prevent buffer overflow
+            uint8_t byte = rx_ring[rx_tail];
+            rx_tail = (rx_tail + 1) % RX_RING_SIZE;
+            if (parse_state == WAIT_START)
             {
-                while (Serial.available()) Serial.read(); // flush invalid data
-                return;
-            }
-            // Wait for remaining data with timeout (non-blocking check)
-            unsigned long wait_start = millis();
-            while (Serial.available() < len && (millis() - wait_start) < 100) {
-                // Brief yield, timeout after 100ms
-            }
-            if (Serial.available() < len) {
-                return; // Timeout - incomplete message, skip
+                if (byte == STARTING_CHAR)
+                {
+                    frame_start_us = micros();
+                    parse_state = WAIT_SOURCE;
+                }
+                else
+                {
+                    bytes_skipped++;
+                }
+                continue;
             }
-            Serial.readBytes((char *)&buff, len); // read the message
-
-            // Validate message length for each command type
-            uint8_t expected_len = 0;
-            if (source == 'v' || source == 'b') expected_len = 5;  // 'w' (vib2) unused
-            else if (source == 'c') expected_len = 10;
-            if (expected_len > 0 && len < expected_len) {
-                return; // Invalid message length
-            }
-
-            micros_time = micros();               // get the current time
-            trigger_pulse(true);                  // trigger a pulse on the trigger pin
-            delay_trig = micros_time + 5000;      // the trigger pulse is 5ms
-            switch (source)
-            {
-            case 'v':                                       // trigger a pulse for the vibration1
+            if (parse_state == WAIT_SOURCE)
             {
-                ampVib1 = buff[0];                          // read the amplitude of the vibration1
-                uint16_t freqVib1 = *((uint16_t *)&buff[1]); // read the frequency (2 bytes)
-                periodVib1 = (freqVib1 > 0) ? (1000000 / freqVib1) : 0; // calculate the period in microseconds
-                start_us_vib1 = micros_time;
-                end_us_vib1 = micros_time + *((uint16_t *)&buff[3]) * ((unsigned long)1000);
-                vib1_state = true;
-                break;
+                source = byte; // {v: vibration1, w: vibration2, b: buzzer, ...}
+                parse_state = WAIT_LEN;
+                continue;
             }
-            // VIB2 unused
-            // case 'w':
-            // {
-            //     ampVib2 = buff[0];
-            //     uint16_t freqVib2 = *((uint16_t *)&buff[1]);
-            //     periodVib2 = (freqVib2 > 0) ? (1000000 / freqVib2) : 0;
-            //     start_us_vib2 = micros_time;
-            //     end_us_vib2 = micros_time + *((uint16_t *)&buff[3]) * ((unsigned long)1000);
-            //     vib2_state = true;
-            //     break;
-            // }
-            case 'b':                                       // trigger a pulse for the buzzer
+            if (byte > sizeof(buff)) // bounds check to prevent buffer overflow
             {
-                ampBuzz = buff[0];                          // read the amplitude of the buzzer
-                freqBuzz = *((uint16_t *)&buff[1]);         // read the frequency (2 bytes)
-                start_us_buzz = micros_time;
-                end_us_buzz = micros_time + *((uint16_t *)&buff[3]) * ((unsigned long)1000);
-                buzzer_start(ampBuzz, freqBuzz);            // start buzzer with hardware PWM
-                buzz_state = true;
-                break;
+                frames_dropped++;
+                parse_state = WAIT_START;
+                continue;
             }
-            case 'c':                                       // combination of Buzzer and Vibration1
+            len = byte;
+            parse_pos = 0;
+            parse_state = WAIT_PAYLOAD;
+        }
+        if (parse_pos == len)
+        {
+            parse_state = WAIT_START;
+            frames_received++;
+            if (!handle_frame())
             {
-                // Vibration 1
-                ampVib1 = buff[0];                          // read the amplitude of the vibration1
-                uint16_t freqVib1 = *((uint16_t *)&buff[1]); // read the frequency (2 bytes)
-                periodVib1 = (freqVib1 > 0) ? (1000000 / freqVib1) : 0; // calculate the period in microseconds
-                start_us_vib1 = micros_time;
-                end_us_vib1 = micros_time + *((uint16_t *)&buff[3]) * ((unsigned long)1000);
-                vib1_state = true;
-                // Buzzer
-                ampBuzz = buff[5];                          // read the amplitude of the buzzer
-                freqBuzz = *((uint16_t *)&buff[6]);         // read the frequency (2 bytes)
-                start_us_buzz = micros_time;
-                end_us_buzz = micros_time + *((uint16_t *)&buff[8]) * ((unsigned long)1000);
-                buzzer_start(ampBuzz, freqBuzz);            // start buzzer with hardware PWM
-                buzz_state = true;
-                break;
-            }
-            default:
-                break;
+                frames_malformed++;
             }
+            handled++;
+        }
+    }
+}
+
+// Run the frame in source / buff / len. Returns false if it was malformed.
+bool handle_frame()
+{
+    if (source == IDENTIFY_CHAR)
+    {
+        send_ready();
+    }
+    else if (source == COUNTERS_REQUEST_CHAR)
+    {
+        send_counters();
+    }
+    else if (source == TABLE_ENTRY_CHAR)
+    {
+        return store_table_entry(buff, len);
+    }
+    else if (source == SCHEDULED_CHAR)
+    {
+        return schedule_command(buff, len);
+    }
+    else if (source == FLUSH_CHAR)
+    {
+        flush_schedule();
+    }
+    else if (source == PING_CHAR)
+    {
+        if (len < 2) return false;
+        send_pong(*((uint16_t *)&buff[0]));
+    }
+    else if (source == SEQUENCED_CHAR)
+    {
+        // [seq:2][cmd:1][payload...]: run cmd and acknowledge it with its onset time
+        if (len < 3) return false;
+        uint16_t seq = *((uint16_t *)&buff[0]);
+        uint16_t behind = (uint16_t)(last_seq - seq); // how many seqs older than the newest run
+        if (last_seq_valid && behind < SEQ_WINDOW && (seq_window >> behind) & 1)
+        {
+            send_ack(seq, seq_onset_us[seq % SEQ_WINDOW]); // retransmission of a command already run: ack again only
+            return true;
+        }
+        noInterrupts();
+        bool applied = apply_command(buff[2], &buff[3], len - 3);
+        interrupts();
+        if (!applied) return false;
+        if (!last_seq_valid)
+        {
+            seq_window = 1;
+            last_seq = seq;
+            last_seq_valid = true;
+        }
+        else if (behind < SEQ_WINDOW)
+            seq_window |= 1UL << behind; // an older command, run late (its first copy was lost)
+        else if (behind >= 0x8000)
+        {
+            uint16_t ahead = (uint16_t)(seq - last_seq);
+            seq_window = ahead < SEQ_WINDOW ? (seq_window << ahead) | 1 : 1;
+            last_seq = seq;
         }
+        seq_onset_us[seq % SEQ_WINDOW] = micros_time;
+        send_ack(seq, micros_time);
     }
-}
\ No newline at end of file
+    else
+    {
+        noInterrupts(); // the schedule interrupt also runs apply_command()
+        bool applied = apply_command(source, buff, len);
+        interrupts();
+        return applied;
+    }
+    return true;
+}
+
+void loop()
+{
+    bool dtr = Serial.dtr();
+    if (dtr && !last_dtr)
+    {
+        send_ready(); // host just opened the port
+    }
+    last_dtr = dtr;
+
+    send_fired_acks();
+    read_serial();
+    parse_frames();
+}